@@ -0,0 +1,108 @@
+"""FEFO stock allocation shared by checkout, manual orders and cancellation."""
+from inventory import ensure_batch_id, ensure_purchase_price, find_batch, insert_batch
+
+
+class InsufficientStock(Exception):
+    def __init__(self, pid, requested, available):
+        super().__init__(f"product {pid}: requested {requested}, available {available}")
+        self.pid = pid
+        self.requested = requested
+        self.available = available
+
+
+def allocate(products, quantities, reserved=None):
+    """Deduct a whole cart ({pid: qty}) from ``products``, First-Expiry-First-Out.
+
+    Every line is planned before anything is deducted, so either the whole
+    cart fits and all batches are updated, or InsufficientStock is raised
+    and ``products`` is left untouched.  Storage hands out batches already
+    in FEFO order, so each line walks only the batches it draws from and
+    nothing is sorted.  ``reserved`` ({pid: qty}) is stock held for other
+    carts: those units must still be in stock after this cart is deducted.
+
+    Returns {pid: {"cost": average unit purchase cost, "allocations": [...]}}
+    where each allocation records the batch_id and quantity taken from it,
+    plus the batch's expiry and prices so release() can recreate a batch
+    that was deleted in the meantime.
+    """
+    plans = {}
+    for pid, qty in quantities.items():
+        needed = qty
+        spare = reserved.get(pid, 0) if reserved else 0  # must be left over
+        picks = []
+        for batch in products[pid].get("batches", []):
+            if needed <= 0 and spare <= 0:
+                break
+            available = int(batch.get("quantity", 0))
+            if available > 0:
+                take = min(available, needed)
+                if take:
+                    picks.append((batch, take))
+                    needed -= take
+                spare -= available - take
+        if needed > 0 or spare > 0:
+            raise InsufficientStock(pid, qty, max(qty - needed - max(spare, 0), 0))
+        plans[pid] = picks
+
+    result = {}
+    for pid, picks in plans.items():
+        product = products[pid]
+        cost_sum = 0.0
+        allocations = []
+        for batch, take in picks:
+            purchase_price = float(ensure_purchase_price(batch)["purchase_price"])
+            batch["quantity"] = int(batch.get("quantity", 0)) - take
+            cost_sum += take * purchase_price
+            allocations.append({
+                "batch_id": ensure_batch_id(product, batch),
+                "qty": take,
+                "expiry_date": batch.get("expiry_date", ""),
+                "price": batch.get("price", 0),
+                "purchase_price": purchase_price,
+            })
+        qty = quantities[pid]
+        result[pid] = {"cost": (cost_sum / qty) if qty > 0 else 0, "allocations": allocations}
+    return result
+
+
+def release(products, items):
+    """Return the stock consumed by an order's ``items`` to ``products``.
+
+    Lines with recorded allocations go back into exactly the batches they
+    were taken from (recreated if the batch has since been deleted).  Older
+    orders without allocations fall back to an undated batch.
+    """
+    for pid, item in items.items():
+        product = products.get(str(pid))
+        if product is None:
+            continue
+        allocations = item.get("allocations")
+        if allocations is None:
+            _release_unallocated(product, item)
+            continue
+        for a in allocations:
+            batch = find_batch(product, a["batch_id"])
+            if batch is not None:
+                batch["quantity"] = int(batch.get("quantity", 0)) + int(a["qty"])
+            else:
+                insert_batch(product, {
+                    "batch_id": a["batch_id"],
+                    "price": a.get("price", 0),
+                    "purchase_price": a.get("purchase_price", a.get("price", 0)),
+                    "quantity": int(a["qty"]),
+                    "expiry_date": a.get("expiry_date", ""),
+                })
+
+
+def _release_unallocated(product, item):
+    qty = int(item.get("qty", item.get("quantity", 0)))
+    # restore into an empty-expiry batch if exists, else add a new one
+    for b in product.get("batches", []):
+        if b.get("expiry_date", "") == "":
+            b["quantity"] = int(b.get("quantity", 0)) + qty
+            return
+    insert_batch(product, {
+        "price": float(item.get("price", 0)),
+        "quantity": qty,
+        "expiry_date": ""
+    })
@@ -1,45 +1,347 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, make_response
+from flask import Flask, Response, g, render_template, request, redirect, url_for, session, jsonify, make_response
+from flask import before_render_template, template_rendered
+import click
+import copy
 import json, os
-from datetime import datetime
-from fpdf import FPDF
+import time
+from datetime import date, datetime
 from collections import Counter
-from arabic_reshaper import reshape
-from bidi.algorithm import get_display
 import secrets
 import string
+import threading
+from functools import wraps
+from data_cache import DataCache
+from events import EventHub
+from invoice import InvoiceCache, invoice_hash, preshape, render_invoice, rtl_cache_stats
+from invoice_export import iter_invoice_zip, select_orders
+from images import IMMUTABLE_NAME, ImageVariants, image_sources, store_upload
+from page_cache import PageCache, content_version
+from allocation import InsufficientStock, allocate, release
+from analytics import OrderColumns, basket_sizes, margin_by_product, revenue_by_hour
+from catalog_search import normalize
+from inventory import expiry_ordinal, find_batch, insert_batch, order_batches
+from jobs import STATUSES as JOB_STATUSES, JobQueue
+from locking import FileLock
+from metrics import Registry
+from order_index import OrderIndex
+from order_journal import OrderJournal
+from profiling import SlowRequestProfiler, file_logger
+from ratelimit import Limit, RateLimiter, make_store, parse_limits
+from reservations import HoldSweeper
+from rollups import week_label
+from storage import JsonStorage, SqliteStorage, backfill_batch_ids, import_json
 
 app = Flask(__name__)
 app.secret_key = "secret123"
 
 # Resolve data paths relative to this file so the app works no matter the cwd
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Data files live next to app.py unless PHARMACY_DATA_DIR points elsewhere
+DATA_DIR = os.environ.get("PHARMACY_DATA_DIR", BASE_DIR)
 
 def resolve_path(path):
     if os.path.isabs(path):
         return path
-    return os.path.join(BASE_DIR, path)
+    return os.path.join(DATA_DIR, path)
 
 PRODUCTS_FILE = resolve_path("products.json")
 ORDERS_FILE = resolve_path("orders.json")
-IP_RATE_LIMIT_FILE = resolve_path("ip_rate_limit.json")
+RATE_LIMIT_DB = resolve_path(os.environ.get("PHARMACY_RATE_LIMIT_DB", "ratelimit.db"))
+JOBS_DB = resolve_path(os.environ.get("PHARMACY_JOBS_DB", "jobs.db"))
+EVENTS_DB = resolve_path(os.environ.get("PHARMACY_EVENTS_DB", "events.db"))
+ORDERS_JOURNAL_DIR = resolve_path("orders_journal")
+HOLDS_FILE = resolve_path("reservations.json")
+ROLLUPS_FILE = resolve_path("rollups.json")
 
 # Arabic font path
-AMIRI_FONT = resolve_path(os.path.join("static", "fonts", "Amiri-Regular.ttf"))
+AMIRI_FONT = os.path.join(BASE_DIR, "static", "fonts", "Amiri-Regular.ttf")
+# Product images: uploads named by content hash, resized/WebP variants + their manifest
+UPLOAD_DIR = os.path.join(BASE_DIR, "static", "uploads")
+IMAGE_MANIFEST = os.path.join(BASE_DIR, "static", "variants", "manifest.json")
+IMAGE_CACHE_SECONDS = 365 * 24 * 3600
+
+# Per-process timings and counters, served at /admin/metrics in Prometheus text format
+metrics = Registry()
+REQUEST_SECONDS = metrics.histogram("pharmacy_request_duration_seconds", "Time to handle a request",
+                                    ("endpoint", "method", "status"))
+DATA_LOAD_SECONDS = metrics.histogram("pharmacy_data_load_seconds", "load_data() calls, cache hits included",
+                                      ("file",))
+DATA_PARSE_SECONDS = metrics.histogram("pharmacy_data_parse_seconds", "Reading and json-parsing a data file",
+                                       ("file",))
+DATA_READ_BYTES = metrics.counter("pharmacy_data_read_bytes_total", "Bytes of data files parsed", ("file",))
+DATA_SAVE_SECONDS = metrics.histogram("pharmacy_data_save_seconds", "save_data(): encode, write, fsync, rename",
+                                      ("file",))
+DATA_WRITE_BYTES = metrics.counter("pharmacy_data_write_bytes_total", "Bytes of data files written", ("file",))
+TEMPLATE_SECONDS = metrics.histogram("pharmacy_template_render_seconds", "Jinja rendering of a template",
+                                     ("template",))
+INVOICE_SECONDS = metrics.histogram("pharmacy_invoice_render_seconds", "Building one PDF invoice")
+
+def record_data_read(path, nbytes, seconds):
+    name = os.path.basename(path)
+    DATA_PARSE_SECONDS.observe(seconds, file=name)
+    DATA_READ_BYTES.inc(nbytes, file=name)
+
+# Parsed JSON files shared by all requests in this process
+data_cache = DataCache(on_read=record_data_read)
+
+# Rendered PDF invoices, bounded by PHARMACY_INVOICE_CACHE_MB
+invoice_cache = InvoiceCache(int(os.environ.get("PHARMACY_INVOICE_CACHE_MB", 32)) << 20)
+# Rendered storefront pages (index, checkout form, order tracking, product grid pages)
+page_cache = PageCache(int(os.environ.get("PHARMACY_PAGE_CACHE_MB", 8)) << 20)
+
+# Files rewritten on every order are stored compactly; pharmacy.json stays hand-editable
+COMPACT_FILES = {PRODUCTS_FILE, ORDERS_FILE, HOLDS_FILE, ROLLUPS_FILE, IMAGE_MANIFEST}
+
+# Serializes read-modify-write sequences on the data files across threads and workers
+data_lock = FileLock(resolve_path(".data.lock"))
 
 def load_data(file_path):
+    """Load a JSON data file through the in-process cache.
+
+    The returned object is shared with the cache: mutate it only when the
+    change is persisted afterwards with save_data().
+    """
     full_path = resolve_path(file_path)
-    if os.path.exists(full_path):
-        with open(full_path, "r", encoding="utf-8") as f:
-            try:
-                return json.load(f)
-            except:
-                return {}
-    return {}
+    with DATA_LOAD_SECONDS.time(file=os.path.basename(full_path)):
+        return data_cache.load(full_path)
 
 def save_data(file_path, data):
+    """Atomically replace a data file: write a temp file, fsync, rename over.
+
+    Readers (and a crash at any point) see either the old or the new file,
+    never a truncated one.  Hold data_lock around the load/modify/save.
+    """
     full_path = resolve_path(file_path)
-    with open(full_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    start = time.perf_counter()
+    if full_path in COMPACT_FILES:
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    else:
+        payload = json.dumps(data, ensure_ascii=False, indent=4)
+    payload = payload.encode("utf-8")
+
+    tmp_path = f"{full_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    data_cache.store(full_path, data)
+    name = os.path.basename(full_path)
+    DATA_SAVE_SECONDS.observe(time.perf_counter() - start, file=name)
+    DATA_WRITE_BYTES.inc(len(payload), file=name)
+
+def data_version(file_path):
+    """Version number of a data file; changes with every save (see DataCache.version)."""
+    return data_cache.version(resolve_path(file_path))
+
+def invalidate_data_cache(file_path=None):
+    """Force the next load_data() to re-read ``file_path`` (or every file)."""
+    data_cache.invalidate(resolve_path(file_path) if file_path else None)
+
+# Products/batches/orders backend: "json" (default) or "sqlite"
+STORAGE_BACKEND = os.environ.get("PHARMACY_STORAGE", "json")
+SQLITE_DB_FILE = resolve_path(os.environ.get("PHARMACY_DB", "pharmacy.db"))
+
+def make_storage(backend=STORAGE_BACKEND):
+    if backend == "sqlite":
+        return SqliteStorage(SQLITE_DB_FILE)
+    journal = OrderJournal(ORDERS_JOURNAL_DIR, index=OrderIndex())
+    return JsonStorage(PRODUCTS_FILE, ORDERS_FILE, journal, load_data, save_data,
+                       lock=data_lock, invalidate=invalidate_data_cache, holds_file=HOLDS_FILE,
+                       rollups_file=ROLLUPS_FILE, version=data_version)
+
+storage = make_storage()
+
+# Units added to a cart stay reserved for HOLD_TTL seconds after the cart's last change
+HOLD_TTL = int(os.environ.get("PHARMACY_HOLD_TTL", 15 * 60))
+# Expired holds are deleted every HOLD_SWEEP_INTERVAL seconds (0 disables the sweeper)
+HOLD_SWEEP_INTERVAL = int(os.environ.get("PHARMACY_HOLD_SWEEP", 60))
+
+hold_sweeper = HoldSweeper(storage, HOLD_SWEEP_INTERVAL)
+
+# Side work runs as persistent jobs (jobs.db) on PHARMACY_JOB_THREADS threads per process;
+# 0 leaves them to a separate `flask run-jobs` process
+JOB_THREADS = int(os.environ.get("PHARMACY_JOB_THREADS", 2))
+job_queue = JobQueue(JOBS_DB, threads=JOB_THREADS)
+
+image_variants = ImageVariants(os.path.join(BASE_DIR, "static"), IMAGE_MANIFEST, load_data, save_data, data_lock)
+
+@job_queue.task("image_variants")
+def image_variants_job(payload):
+    """Thumbnails and WebP copies of one uploaded image."""
+    return image_variants.process(payload["image"])
+
+@job_queue.task("rebuild_rollups", max_attempts=1)
+def rebuild_rollups_job(payload):
+    store = storage.rebuild_rollups()
+    return {"days": len(store["day"]), "products": len(store["product"])}
+
+@job_queue.task("compact_orders", max_attempts=1)
+def compact_orders_job(payload):
+    if not isinstance(storage, JsonStorage):
+        return {"skipped": "order journal is only used by the json storage backend"}
+    storage.journal.compact()
+    return {"orders": len(storage.journal)}
+
+# Jobs an admin may queue from /admin/jobs
+ADMIN_JOBS = {"rebuild_rollups": "إعادة حساب تقارير الأرباح", "compact_orders": "ضغط سجل الطلبات"}
+
+def queue_image_variants(image):
+    return job_queue.submit("image_variants", {"image": image}, dedupe_key=image)
+
+def queue_missing_image_variants():
+    """Catch up on images that have no variants yet."""
+    for image in image_variants.missing(p.get("image") for p in storage.load_products().values()):
+        queue_image_variants(image)
+
+# Live updates (Server-Sent Events) for the admin dashboard and order tracking pages
+event_hub = EventHub(EVENTS_DB)
+# a stream is closed after this long; the browser reconnects and Last-Event-ID replays what it missed
+SSE_MAX_SECONDS = int(os.environ.get("PHARMACY_SSE_MAX_SECONDS", 300))
+EXPIRY_ALERT_DAYS = 30
+
+def publish_low_stock(taken, names):
+    """Alert admins about products that ``taken`` ({pid: units removed}) brought to LOW_STOCK or below."""
+    stocks = storage.get_stocks(taken)
+    for pid, units in taken.items():
+        qty = stocks[pid].total_qty if pid in stocks else 0
+        if units > 0 and qty <= LOW_STOCK < qty + units:
+            event_hub.publish("admin", "low_stock", {"pid": pid, "name": names.get(pid), "stock": qty})
+
+def batch_total(product):
+    return sum(int(b.get("quantity") or 0) for b in product.get("batches", []))
+
+def publish_expiring_count():
+    event_hub.publish("admin", "expiring", expiring_alert())
+
+def expiring_alert():
+    return {"count": storage.count_expiring(EXPIRY_ALERT_DAYS), "days": EXPIRY_ALERT_DAYS}
+
+def publish_new_order(order):
+    """Announce a placed order and the low-stock alerts it caused (deferred from the request)."""
+    event_hub.publish("admin", "new_order", {
+        "order_id": order["order_id"], "name": order["name"], "total_price": order["total_price"],
+        "status": order["status"], "created_at": order["created_at"],
+    })
+    items = order["items"]
+    publish_low_stock({pid: int(item["qty"]) for pid, item in items.items()},
+                      {pid: item.get("name") for pid, item in items.items()})
+
+def publish_status_change(order_id, old_status, new_status):
+    event_hub.publish(f"order:{order_id}", "status", {"status": new_status})
+    event_hub.publish("admin", "order_status", {"order_id": order_id, "status": new_status,
+                                                "old_status": old_status})
+def product_image(image):
+    """{"src", "srcset", "webp_srcset"} for a product image, None if it has none."""
+    return image_sources(image, load_data(IMAGE_MANIFEST) or {}, lambda path: url_for('static', filename=path))
+
+app.jinja_env.globals["product_image"] = product_image
+
+# PHARMACY_SLOW_REQUEST_MS > 0: sample request stacks, log those of slower requests
+SLOW_REQUEST_MS = float(os.environ.get("PHARMACY_SLOW_REQUEST_MS", 0))
+slow_profiler = None
+if SLOW_REQUEST_MS > 0:
+    slow_profiler = SlowRequestProfiler(
+        SLOW_REQUEST_MS / 1000, float(os.environ.get("PHARMACY_PROFILE_INTERVAL_MS", 5)) / 1000,
+        file_logger(resolve_path(os.environ.get("PHARMACY_SLOW_LOG", "slow_requests.log"))))
+
+# Background threads start with the first request, not at import: invoice export
+# workers (spawned processes) import this module too and must not run any of them
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background():
+    """Start this process's hold sweeper, job workers and profiler (once)."""
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    if HOLD_SWEEP_INTERVAL > 0:
+        hold_sweeper.start()
+    if JOB_THREADS > 0:
+        job_queue.start()
+    if slow_profiler is not None:
+        slow_profiler.start()
+    queue_missing_image_variants()
+
+@app.before_request
+def start_background_on_first_request():
+    if not _background_started:
+        start_background()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if slow_profiler is not None:
+        slow_profiler.begin()
+
+@app.after_request
+def remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request(exc):
+    start = g.pop("request_start", None)
+    if start is None:
+        return
+    duration = time.perf_counter() - start
+    endpoint = request.endpoint or "unmatched"
+    REQUEST_SECONDS.observe(duration, endpoint=endpoint, method=request.method,
+                            status=g.pop("response_status", 500))
+    if slow_profiler is not None:
+        slow_profiler.end(f"{request.method} {request.full_path.rstrip('?')}", duration)
+
+# قياس وقت رسم القوالب (Jinja) عبر إشارات Flask
+_template_starts = threading.local()
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    stack = getattr(_template_starts, "stack", None)
+    if stack is None:
+        stack = _template_starts.stack = []
+    stack.append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_template(sender, template, context, **extra):
+    stack = getattr(_template_starts, "stack", None)
+    if stack:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - stack.pop(), template=template.name or "string")
+
+@app.after_request
+def cache_immutable_images(response):
+    """Content-hashed uploads and variants never change: let browsers keep them."""
+    if (request.endpoint == "static" and response.status_code == 200
+            and IMMUTABLE_NAME.match((request.view_args or {}).get("filename", ""))):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMAGE_CACHE_SECONDS
+        response.cache_control.immutable = True
+    return response
+
+def save_uploaded_image(file_storage):
+    """Store an uploaded image under its content hash and queue its variants.
+
+    Returns the path under static/, or None if the file is not an image.
+    """
+    try:
+        image = "uploads/" + store_upload(file_storage.read(), UPLOAD_DIR)
+    except ValueError:
+        return None
+    queue_image_variants(image)
+    return image
+
+def get_cart_id(create=False):
+    """Id of this browser's cart, used to key its stock holds."""
+    if create and "cart_id" not in session:
+        session["cart_id"] = secrets.token_hex(8)
+    return session.get("cart_id")
 
 def generate_order_id():
     """Generate a random, secure order ID."""
@@ -47,318 +349,341 @@ def generate_order_id():
     random_part = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
     return f"ORD{random_part}"
 
-def ensure_purchase_price(batch):
-    """Guarantee a purchase_price key exists on a batch."""
-    if "purchase_price" not in batch:
-        batch["purchase_price"] = float(batch.get("price", 0))
-    return batch
-
-def rtl(text):
-    if not text:
-        return ""
-    reshaped = reshape(text)
-    return get_display(reshaped)
-
 def get_client_ip():
     """Get the client's IP address, handling proxies."""
     if request.headers.get('X-Forwarded-For'):
         return request.headers.get('X-Forwarded-For').split(',')[0].strip()
     return request.remote_addr
 
-def can_place_order(ip_address):
-    """Check if an IP address can place an order (one per hour)."""
-    ip_data = load_data(IP_RATE_LIMIT_FILE) or {}
-    
-    if ip_address not in ip_data:
-        return True, None
-    
-    last_order_time_str = ip_data[ip_address].get("last_order_time")
-    if not last_order_time_str:
-        return True, None
-    
-    try:
-        last_order_time = datetime.strptime(last_order_time_str, "%Y-%m-%d %H:%M:%S")
-        now = datetime.now()
-        time_diff = (now - last_order_time).total_seconds() / 3600  # Convert to hours
-        
-        if time_diff >= 1.0:
-            return True, None
-        else:
-            remaining_minutes = int((1.0 - time_diff) * 60)
-            return False, remaining_minutes
-    except:
-        return True, None
-
-def record_order_ip(ip_address):
-    """Record that an IP address has placed an order."""
-    ip_data = load_data(IP_RATE_LIMIT_FILE) or {}
-    ip_data[ip_address] = {
-        "last_order_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    save_data(IP_RATE_LIMIT_FILE, ip_data)
+# Per-IP limits by route; override with PHARMACY_RATE_LIMITS="add_to_cart=120/minute,track_order=5/minute:10"
+RATE_LIMITS = parse_limits(os.environ.get("PHARMACY_RATE_LIMITS"), {
+    "checkout": Limit(1, 3600),              # one order per hour
+    "add_to_cart": Limit(60, 60, burst=30),  # the cart re-syncs holds on every change
+    "cart_check": Limit(60, 60, burst=30),
+    "track_order": Limit(20, 60, burst=10),
+    "invoice": Limit(20, 60, burst=10),
+})
+# "sqlite" (default) shares the buckets between worker processes; "memory" keeps them per process
+rate_limiter = RateLimiter(make_store(os.environ.get("PHARMACY_RATE_LIMIT_BACKEND", "sqlite"), RATE_LIMIT_DB),
+                           RATE_LIMITS)
+
+def rate_limited(name, as_json=False):
+    """Answer 429 (with Retry-After) once this IP is over RATE_LIMITS[name]."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            allowed, retry_after = rate_limiter.hit(name, get_client_ip())
+            if allowed:
+                return view(*args, **kwargs)
+            seconds = max(int(retry_after + 0.999), 1)
+            message = f"⚠️ طلبات كثيرة، حاول مرة أخرى بعد {seconds} ثانية."
+            response = jsonify({"status": "error", "message": message}) if as_json else make_response(message)
+            response.status_code = 429
+            response.headers["Retry-After"] = str(seconds)
+            return response
+        return wrapper
+    return decorator
 
 @app.route('/invoice/<order_id>')
+@rate_limited("invoice")
 def invoice(order_id):
-    orders = load_data(ORDERS_FILE) or []
     settings = load_data("pharmacy.json") or {}
 
-    order = next((o for o in orders if o["order_id"] == order_id), None)
+    order = storage.get_order(order_id)
     if not order:
         return "❌ الطلب غير موجود", 404
 
     if order["status"] != "مكتمل":
         return "⚠️ الفاتورة متاحة فقط للطلبات المكتملة", 403
 
-    # إعداد PDF
-    pdf = FPDF()
-    pdf.add_page()
-
-    # إضافة خط عربي
-    try:
-        pdf.add_font("Amiri", "", AMIRI_FONT, uni=True)
-    except RuntimeError:
-        return f"❌ ملف الخط Amiri-Regular.ttf غير موجود. ضع الملف هنا: {AMIRI_FONT}", 500
-
-    pdf.set_font("Amiri", "", 16)
-
-    # -------------------------------
-    #   رأس الفاتورة
-    # -------------------------------
-    pdf.set_font("Amiri", "", 20)
-    pdf.cell(0, 10, rtl(settings.get("name", "")), ln=True, align="R")
-
-    pdf.set_font("Amiri", "", 12)
-    pdf.cell(0, 8, rtl(f"العنوان: {settings.get('address','')}"), ln=True, align="R")
-    pdf.cell(0, 8, rtl(f"هاتف: {settings.get('phone','')}"), ln=True, align="R")
-    pdf.cell(0, 8, rtl(f"ترخيص مهني: {settings.get('license','')}"), ln=True, align="R")
-    pdf.cell(0, 8, rtl(f"الرقم الضريبي: {settings.get('tax_number','')}"), ln=True, align="R")
-
-    pdf.ln(5)
-    pdf.set_font("Amiri", "", 16)
-    pdf.cell(0, 10, rtl("فاتورة بيع"), ln=True, align="C")
-
-    pdf.ln(5)
-    pdf.set_font("Amiri", "", 14)
-
-    # -------------------------------
-    #   تفاصيل الفاتورة
-    # -------------------------------
-    pdf.cell(0, 8, rtl(f"رقم الفاتورة: {order_id}"), ln=True, align="R")
-    pdf.cell(0, 8, rtl(f"العميل: {order['name']}"), ln=True, align="R")
-    pdf.cell(0, 8, rtl(f"الهاتف: {order['phone']}"), ln=True, align="R")
-    pdf.cell(0, 8, rtl(f"التاريخ: {datetime.now().strftime('%Y-%m-%d %H:%M')}"), ln=True, align="R")
-
-    pdf.ln(5)
-    pdf.cell(0, 8, rtl("-----------------------------------------"), ln=True, align="C")
-
-    # -------------------------------
-    #   جدول العناصر
-    # -------------------------------
-    pdf.set_font("Amiri", "", 14)
-    pdf.cell(60, 8, rtl("الإجمالي"), border=1, align="C")
-    pdf.cell(40, 8, rtl("السعر"), border=1, align="C")
-    pdf.cell(30, 8, rtl("الكمية"), border=1, align="C")
-    pdf.cell(60, 8, rtl("المنتج"), border=1, ln=True, align="C")
-
-    total = 0
-    for pid, item in order["items"].items():
-        qty = int(item["qty"])
-        price = float(item["price"])
-        subtotal = qty * price
-        total += subtotal
-
-        pdf.cell(60, 8, rtl(str(subtotal)), border=1, align="C")
-        pdf.cell(40, 8, rtl(str(price)), border=1, align="C")
-        pdf.cell(30, 8, rtl(str(qty)), border=1, align="C")
-        pdf.cell(60, 8, rtl(item["name"]), border=1, ln=True, align="C")
-
-    pdf.ln(5)
-    pdf.set_font("Amiri", "", 16)
-    pdf.cell(0, 10, rtl(f"الإجمالي الكلي: {total} جنيه"), ln=True, align="R")
-
-    # -------------------------------
-    #   QR Code
-    # -------------------------------
-    import qrcode
-    qr_text = f"Invoice: {order_id}\nTotal: {total}\nCustomer: {order['name']}"
-    qr = qrcode.make(qr_text)
-    qr_path = f"qr_{order_id}.png"
-    qr.save(qr_path)
-
-    pdf.image(qr_path, x=10, y=pdf.get_y() + 10, w=35)
-    os.remove(qr_path)
-
-    # -------------------------------
-    #   الفوتر
-    # -------------------------------
-    pdf.ln(40)
-    pdf.set_font("Amiri", "", 12)
-    pdf.cell(0, 10, rtl(settings.get("footer", "")), ln=True, align="C")
-
-    # إخراج PDF
-    pdf_bytes = bytes(pdf.output(dest="S"))
-
+    # الفاتورة ثابتة لنفس الطلب والإعدادات: ETag = بصمة المحتوى
+    etag = invoice_hash(order, settings)
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+
+    key = (order_id, etag)
+    pdf_bytes = invoice_cache.get(key)
+    if pdf_bytes is None:
+        preshape(settings)
+        try:
+            with INVOICE_SECONDS.time():
+                pdf_bytes = render_invoice(order, settings, AMIRI_FONT)
+        except (RuntimeError, FileNotFoundError):
+            return f"❌ ملف الخط Amiri-Regular.ttf غير موجود. ضع الملف هنا: {AMIRI_FONT}", 500
+        invoice_cache.put(key, pdf_bytes)
 
     response = make_response(pdf_bytes)
     response.headers['Content-Type'] = 'application/pdf'
     response.headers['Content-Disposition'] = f"inline; filename=invoice_{order_id}.pdf"
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# Export progress is published on the "export:<id>" event channel, so any worker
+# process can answer the progress poll; old exports go with the event log pruning
+EXPORT_PROGRESS_SECONDS = 0.5
+
+@app.route('/admin/invoices/export')
+def export_invoices():
+    """ZIP of the invoices of every order matching ?from=&to=&status=.
+
+    The X-Export-Id response header names the export; follow its progress
+    at /admin/invoices/export/<id>.
+    """
+    if 'admin' not in session:
+        return redirect(url_for('admin_login'))
+
+    settings = load_data("pharmacy.json") or {}
+    status = request.args.get("status", "مكتمل")
+    if status == "all":
+        orders = storage.load_orders()
+        status = None
+    else:
+        orders = storage.find_orders(status=status)
+    orders = select_orders(orders, request.args.get("from"), request.args.get("to"), status)
+
+    export_id = secrets.token_hex(8)
+    channel = f"export:{export_id}"
+    event_hub.publish(channel, "progress", {"done": 0, "total": len(orders)})
+    last_published = [time.monotonic()]
+
+    def progress(done, total):
+        if done == total or time.monotonic() - last_published[0] >= EXPORT_PROGRESS_SECONDS:
+            last_published[0] = time.monotonic()
+            event_hub.publish(channel, "progress", {"done": done, "total": total})
+
+    response = Response(
+        iter_invoice_zip(orders, settings, AMIRI_FONT, request.args.get("workers", type=int), progress),
+        mimetype="application/zip",
+    )
+    response.headers['Content-Disposition'] = f"attachment; filename=invoices_{export_id}.zip"
+    response.headers['X-Export-Id'] = export_id
+    response.headers['X-Invoice-Count'] = str(len(orders))
     return response
 
+@app.route('/admin/invoices/export/<export_id>')
+def export_invoices_progress(export_id):
+    if 'admin' not in session:
+        return redirect(url_for('admin_login'))
+    progress = event_hub.latest(f"export:{export_id}")
+    if progress is None:
+        return jsonify({"error": "unknown export"}), 404
+    return jsonify(progress)
+
+def cached_page(key, render, mimetype="text/html"):
+    """Serve ``render()`` through page_cache, with ETag/Last-Modified.
+
+    ``key`` must include the version of every input of the page.  A
+    matching If-None-Match / If-Modified-Since gets a 304 without a body.
+    """
+    page = page_cache.get(key)
+    if page is None:
+        page = page_cache.put(key, render())
+    response = Response(page.body, mimetype=mimetype)
+    response.set_etag(page.etag)
+    response.last_modified = page.last_modified
+    response.cache_control.no_cache = True  # revalidate every time: stock changes
+    return response.make_conditional(request)
+
 
 @app.route('/track/<order_id>')
+@rate_limited("track_order")
 def track_order(order_id):
-    orders = load_data(ORDERS_FILE) or []
-    pharmacy = load_data("pharmacy.json") or {}
-    order = next((o for o in orders if o.get("order_id") == order_id), None)
+    order = storage.get_order(order_id)
     if not order:
         return "الطلب غير موجود", 404
-    return render_template("track_order.html", order=order, pharmacy=pharmacy)
+    key = ("track", order_id, content_version(order), data_version("pharmacy.json"))
+    return cached_page(key, lambda: render_template(
+        "track_order.html", order=order, pharmacy=load_data("pharmacy.json") or {}))
 
 
 @app.route("/")
 def index():
-    products = load_data(PRODUCTS_FILE) or {}
-    pharmacy = load_data("pharmacy.json") or {}
-    return render_template("index.html", products=products, pharmacy=pharmacy)
+    # the product grid is filled page by page from /api/products
+    return cached_page(("index", data_version("pharmacy.json")), lambda: render_template(
+        "index.html", pharmacy=load_data("pharmacy.json") or {}, page_size=PRODUCTS_PAGE_SIZE))
+
+
+PRODUCTS_PAGE_SIZE = 24
+LOW_STOCK = 5
+
+
+def stock_status_matches(stock, status, today):
+    """The storefront filters: all / in (stock) / low / exp (within 30 days) / out."""
+    qty = stock.total_qty if stock else 0
+    if status == "in":
+        return qty > 0
+    if status == "low":
+        return 0 < qty <= LOW_STOCK
+    if status == "out":
+        return qty <= 0
+    if status == "exp":
+        expiry = expiry_ordinal(stock.nearest_expiry) if stock else None
+        return expiry is not None and 0 <= expiry - today <= 30
+    return True
+
+
+@app.route('/api/products')
+def api_products():
+    """Storefront grid page: ?q=&status=&in_stock=1&sort=name|price|stock&offset=&limit=."""
+    q = request.args.get("q", "")
+    status = "in" if request.args.get("in_stock") in ("1", "true") else request.args.get("status", "all")
+    sort = request.args.get("sort", "name")
+    offset = max(request.args.get("offset", default=0, type=int), 0)
+    limit = min(max(request.args.get("limit", default=PRODUCTS_PAGE_SIZE, type=int), 1), 100)
+
+    today = date.today().toordinal()
+    key = ("products", storage.catalog_version(), data_version(IMAGE_MANIFEST), today, q, status, sort, offset, limit)
+    return cached_page(key, lambda: app.json.dumps(product_page(q, status, sort, offset, limit, today)),
+                       mimetype="application/json")
+
+
+def product_page(q, status, sort, offset, limit, today):
+    names = storage.search_products(q)
+    levels = storage.stock_levels()
+    pids = [pid for pid in names if stock_status_matches(levels.get(pid), status, today)]
+
+    if sort == "price":
+        products = storage.get_products(pids)
+        pids.sort(key=lambda pid: float((products[pid].get("batches") or [{}])[0].get("price", 0)))
+    elif sort == "stock":
+        pids.sort(key=lambda pid: -(levels[pid].total_qty if pid in levels else 0))
+    else:
+        pids.sort(key=lambda pid: normalize(names[pid]))
+
+    page = pids[offset:offset + limit]
+    products = storage.get_products(page)
+    cards = []
+    for pid in page:
+        p = products[pid]
+        batches = p.get("batches") or []
+        stock = levels.get(pid)
+        nearest = stock.nearest_expiry if stock else ""
+        expiry = expiry_ordinal(nearest)
+        cards.append({
+            "pid": pid,
+            "name": p.get("name"),
+            "image": product_image(p.get("image")),
+            "price": batches[0].get("price", 0) if batches else 0,  # FEFO: the batch sold next
+            "stock": stock.total_qty if stock else 0,
+            "nearest_expiry": nearest,
+            "expired": expiry is not None and expiry < today,
+        })
+    next_offset = offset + limit if offset + limit < len(pids) else None
+    return {"products": cards, "total": len(pids), "next_offset": next_offset}
 
 @app.route('/checkout', methods=['GET', 'POST'])
 def checkout():
-    products = load_data(PRODUCTS_FILE) or {}
     pharmacy = load_data("pharmacy.json") or {}
 
     # ====== GET ======
     if request.method == "GET":
-        return render_template("checkout.html", order_id=None, products=products, pharmacy=pharmacy)
+        return cached_page(("checkout", data_version("pharmacy.json")), lambda: render_template(
+            "checkout.html", order_id=None, pharmacy=pharmacy))
 
     # ====== POST ======
-    # Check IP rate limiting
+    # One order per IP per hour: the token is taken up front, so parallel posts from
+    # one IP cannot all pass, and given back below if the order is not placed
     client_ip = get_client_ip()
-    can_order, remaining_minutes = can_place_order(client_ip)
-    
+    can_order, retry_after = rate_limiter.hit("checkout", client_ip)
+
     if not can_order:
+        remaining_minutes = max(int(retry_after // 60) + 1, 1)
         return render_template(
             "checkout.html",
             order_id=None,
-            products=products,
             pharmacy=pharmacy,
             message=f"⚠️ يمكنك تقديم طلب واحد فقط كل ساعة. يرجى المحاولة مرة أخرى بعد {remaining_minutes} دقيقة."
         )
     
-    cart_json = request.form.get("cart")
-    cart = json.loads(cart_json)
-
-    name = request.form.get("name", "").strip()
-    phone = request.form.get("phone", "").strip()
+    placed = False
+    try:
+        cart_json = request.form.get("cart")
+        cart = json.loads(cart_json)
 
-    if not name or not phone:
-        return render_template(
-            "checkout.html",
-            order_id=None,
-            products=products,
-            pharmacy=pharmacy,
-            message="❌ الرجاء إدخال جميع البيانات."
-        )
+        name = request.form.get("name", "").strip()
+        phone = request.form.get("phone", "").strip()
 
-    # ============================
-    #   1) التحقق من توفر المخزون
-    # ============================
-    for pid, item in cart.items():
-        requested = int(item["qty"])
-        product = products.get(pid)
-        if not product:
-            return render_template("checkout.html", order_id=None, products=products, message=f"⚠️ المنتج {pid} غير موجود.")
-        total_stock = sum(int(b.get("quantity",0)) for b in product.get("batches", []))
-
-        if requested > total_stock:
+        if not name or not phone:
             return render_template(
                 "checkout.html",
                 order_id=None,
-                products=products,
                 pharmacy=pharmacy,
-                message=f"⚠️ الكمية المطلوبة من {product.get('name')} غير متوفرة (المتاح: {total_stock})."
+                message="❌ الرجاء إدخال جميع البيانات."
             )
 
-    # ============================================
-    #   2) خصم المخزون من أقرب Batch (FEFO)
-    # ============================================
-    for pid, item in cart.items():
-        needed = int(item["qty"])
-        product = products[pid]
-
-        # رتّب ال batches حسب تاريخ الانتهاء (الأقرب أولاً)
-        batches = sorted(
-            product.get("batches", []),
-            key=lambda x: x.get("expiry_date","")
-        )
-
-        total_needed = needed
-        cost_sum = 0.0
-
-        for batch in batches:
-            ensure_purchase_price(batch)
-            if needed <= 0:
-                break
-
-            available = int(batch.get("quantity", 0))
-            purchase_price = float(batch.get("purchase_price", batch.get("price", 0)))
+        cart_id = get_cart_id()
 
-            if available >= needed:
-                cost_sum += needed * purchase_price
-                batch["quantity"] = available - needed
-                needed = 0
-            else:
-                cost_sum += available * purchase_price
-                needed -= available
-                batch["quantity"] = 0
+        with storage.transaction():
+            products = storage.get_products(cart.keys())
 
-        # حدّث الـ batches بعد الخصم
-        products[pid]["batches"] = batches
+            # ============================
+            #   1) التحقق من وجود المنتجات
+            # ============================
+            for pid in cart:
+                if pid not in products:
+                    return render_template("checkout.html", order_id=None, pharmacy=pharmacy, message=f"⚠️ المنتج {pid} غير موجود.")
 
-        # سجّل متوسط تكلفة الشراء لهذا المنتج ضمن بيانات الطلب (يُستخدم لحساب الأرباح)
-        avg_cost = (cost_sum / total_needed) if total_needed else 0
-        cart[pid]["cost"] = avg_cost
-
-    save_data(PRODUCTS_FILE, products)
-
-    # ============================
-    #   3) حفظ الطلب
-    # ============================
-    try:
-        orders = load_data(ORDERS_FILE) or []
-    except:
-        orders = []
-
-    # Generate random order ID and ensure it's unique
-    order_id = generate_order_id()
-    existing_ids = {o.get("order_id") for o in orders}
-    while order_id in existing_ids:
-        order_id = generate_order_id()
-
-    total_price = sum(
-        int(item["qty"]) * float(item["price"])
-        for item in cart.values()
-    )
-
-    order = {
-        "order_id": order_id,
-        "name": name,
-        "phone": phone,
-        "items": cart,
-        "total_price": total_price,
-        "status": "قيد الانتظار",
-        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
+            # ============================================
+            #   2) خصم المخزون من أقرب Batch (FEFO) للسلة كاملة
+            # ============================================
+            # الكميات المحجوزة لسلات أخرى لا تُباع؛ حجز هذه السلة نفسها يتحول إلى خصم فعلي
+            reserved = storage.reserved_qty(cart.keys(), exclude_cart=cart_id)
+            try:
+                allocated = allocate(products, {pid: int(item["qty"]) for pid, item in cart.items()}, reserved)
+            except InsufficientStock as e:
+                return render_template(
+                    "checkout.html",
+                    order_id=None,
+                    pharmacy=pharmacy,
+                    message=f"⚠️ الكمية المطلوبة من {products[e.pid].get('name')} غير متوفرة (المتاح: {e.available})."
+                )
+
+            # سجّل متوسط تكلفة الشراء والـ batches المستخدمة لكل منتج ضمن بيانات الطلب
+            for pid, line in allocated.items():
+                cart[pid].update(line)
+
+            storage.save_products(products)
+
+            # ============================
+            #   3) حفظ الطلب
+            # ============================
+            # Generate random order ID and ensure it's unique
+            order_id = generate_order_id()
+            while storage.order_exists(order_id):
+                order_id = generate_order_id()
+
+            total_price = sum(
+                int(item["qty"]) * float(item["price"])
+                for item in cart.values()
+            )
 
-    orders.append(order)
-    save_data(ORDERS_FILE, orders)
-    
-    # Record IP address for rate limiting
-    record_order_ip(client_ip)
+            order = {
+                "order_id": order_id,
+                "name": name,
+                "phone": phone,
+                "items": cart,
+                "total_price": total_price,
+                "status": "قيد الانتظار",
+                "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+            storage.add_order(order)
+            if cart_id:
+                storage.release_holds(cart_id)
+        placed = True
+    finally:
+        if not placed:
+            rate_limiter.refund("checkout", client_ip)
+
+    event_hub.defer(publish_new_order, order)
 
     return render_template(
         "checkout.html",
         order_id=order_id,
-        products=products,
         pharmacy=pharmacy
     )
 
@@ -366,49 +691,76 @@ def checkout():
 def admin_orders():
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
-    orders = load_data(ORDERS_FILE) or []
-    return render_template('admin_orders.html', orders=orders)
+    # the rows themselves are fetched page by page from /admin/api/orders
+    counts = storage.count_orders_by_status()
+    return render_template('admin_orders.html', counts=counts, total=sum(counts.values()))
+
+@app.route('/admin/api/orders')
+def admin_orders_api():
+    """Newest-first page of orders: ?status=&from=&to=&q=&cursor=&limit=."""
+    if 'admin' not in session:
+        return jsonify({"error": "unauthorized"}), 401
+
+    status = request.args.get("status", "").strip()
+    status = None if status in ("", "all") else status
+    q = request.args.get("q", "").strip() or None
+    limit = min(max(request.args.get("limit", default=50, type=int), 1), 200)
+    cursor = request.args.get("cursor", type=int)
+
+    dates = {}
+    for arg in ("from", "to"):
+        value = request.args.get(arg, "").strip()
+        if value:
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                return jsonify({"error": f"{arg} must be YYYY-MM-DD"}), 400
+        dates[arg] = value or None
+
+    orders, next_cursor = storage.page_orders(status, dates["from"], dates["to"], q, cursor, limit)
+    rows = [{
+        "order_id": o["order_id"],
+        "name": o.get("name"),
+        "phone": o.get("phone"),
+        "items": [{"name": item.get("name"), "qty": item.get("qty")} for item in o.get("items", {}).values()],
+        "total_price": o.get("total_price"),
+        "status": o.get("status"),
+        "created_at": o.get("created_at"),
+    } for o in orders]
+    return jsonify({"orders": rows, "next_cursor": next_cursor})
+
+@app.route('/admin/orders/lookup')
+def admin_orders_lookup():
+    if 'admin' not in session:
+        return redirect(url_for('admin_login'))
+    phone = request.args.get("phone", "").strip() or None
+    status = request.args.get("status", "").strip() or None
+    if not phone and not status:
+        return jsonify({"counts": storage.count_orders_by_status()})
+    return jsonify(storage.find_orders(phone=phone, status=status))
 
 @app.route('/admin/update_order/<order_id>', methods=['POST'])
 def update_order(order_id):
-    orders = load_data(ORDERS_FILE) or []
     data = request.get_json()
     new_status = data.get("status")
 
-    # load products
-    products = load_data(PRODUCTS_FILE) or {}
-
-    for order in orders:
-        if order["order_id"] == order_id:
+    with storage.transaction():
+        order = storage.get_order(order_id)
+        if order:
             old_status = order.get("status")
             order["status"] = new_status
 
             # if changing from non-canceled to canceled -> restore stock
             if old_status != "ملغي" and new_status == "ملغي":
-                for pid, item in order.get("items", {}).items():
-                    pid = str(pid)
-                    qty = int(item.get("qty", item.get("quantity", 0)))
-                    if pid in products:
-                        prod = products[pid]
-                        # restore into an empty-expiry batch if exists, else append new batch
-                        restored = False
-                        for b in prod.get("batches", []):
-                            if b.get("expiry_date", "") == "":
-                                b["quantity"] = int(b.get("quantity",0)) + qty
-                                restored = True
-                                break
-                        if not restored:
-                            prod.setdefault("batches", []).append({
-                                "price": float(item.get("price", 0)),
-                                "quantity": qty,
-                                "expiry_date": ""
-                            })
-                save_data(PRODUCTS_FILE, products)
-
-            break
-
-    save_data(ORDERS_FILE, orders)
+                products = storage.get_products(str(pid) for pid in order.get("items", {}))
+                # put the quantities back into the batches they were taken from
+                release(products, order.get("items", {}))
+                storage.save_products(products)
 
+            storage.save_order(order)
+
+    if order and old_status != new_status:
+        event_hub.defer(publish_status_change, order_id, old_status, new_status)
     return "Saved", 200
 
 @app.route('/admin', methods=['GET', 'POST'])
@@ -429,7 +781,8 @@ def admin_login():
 def admin_dashboard():
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
-    products = load_data(PRODUCTS_FILE) or {}
+    backfill_batch_ids(storage)  # the page addresses batches by id
+    products = storage.load_products()
     return render_template('admin_dashboard.html', products=products)
 
 @app.route('/admin/manual_order', methods=['GET', 'POST'])
@@ -437,7 +790,7 @@ def manual_order():
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
     
-    products = load_data(PRODUCTS_FILE) or {}
+    products = storage.load_products()
     
     if request.method == 'GET':
         return render_template('admin_manual_order.html', products=products)
@@ -471,80 +824,52 @@ def manual_order():
     if not items_data:
         return render_template('admin_manual_order.html', products=products, error="الرجاء إضافة منتجات على الأقل")
     
-    # Check stock availability
-    for pid, item in items_data.items():
-        product = products.get(pid)
-        if not product:
-            return render_template('admin_manual_order.html', products=products, error=f"المنتج {pid} غير موجود")
-        total_stock = sum(int(b.get("quantity", 0)) for b in product.get("batches", []))
-        if item["qty"] > total_stock:
-            return render_template('admin_manual_order.html', products=products, error=f"الكمية المطلوبة من {item['name']} غير متوفرة (المتاح: {total_stock})")
-    
-    # Deduct stock and calculate costs (same logic as checkout)
-    for pid, item in items_data.items():
-        needed = item["qty"]
-        product = products[pid]
-        
-        batches = sorted(
-            product.get("batches", []),
-            key=lambda x: x.get("expiry_date", "")
-        )
-        
-        total_needed = needed
-        cost_sum = 0.0
-        
-        for batch in batches:
-            ensure_purchase_price(batch)
-            if needed <= 0:
-                break
-            
-            available = int(batch.get("quantity", 0))
-            purchase_price = float(batch.get("purchase_price", batch.get("price", 0)))
-            
-            if available >= needed:
-                cost_sum += needed * purchase_price
-                batch["quantity"] = available - needed
-                needed = 0
-            else:
-                cost_sum += available * purchase_price
-                needed -= available
-                batch["quantity"] = 0
-        
-        products[pid]["batches"] = batches
-        avg_cost = (cost_sum / total_needed) if total_needed else 0
-        items_data[pid]["cost"] = avg_cost
-    
-    save_data(PRODUCTS_FILE, products)
+    with storage.transaction():
+        stock = storage.get_products(items_data.keys())
+
+        for pid in items_data:
+            if pid not in stock:
+                return render_template('admin_manual_order.html', products=products, error=f"المنتج {pid} غير موجود")
+
+        # Check availability and deduct stock for all items (same engine as checkout),
+        # leaving the units customers hold in their carts alone
+        reserved = storage.reserved_qty(items_data.keys())
+        try:
+            allocated = allocate(stock, {pid: item["qty"] for pid, item in items_data.items()}, reserved)
+        except InsufficientStock as e:
+            item = items_data[e.pid]
+            return render_template('admin_manual_order.html', products=products, error=f"الكمية المطلوبة من {item['name']} غير متوفرة (المتاح: {e.available})")
+
+        for pid, line in allocated.items():
+            items_data[pid].update(line)
+
+        storage.save_products(stock)
     
-    # Create order
-    orders = load_data(ORDERS_FILE) or []
-    order_id = generate_order_id()
-    existing_ids = {o.get("order_id") for o in orders}
-    while order_id in existing_ids:
+        # Create order
         order_id = generate_order_id()
+        while storage.order_exists(order_id):
+            order_id = generate_order_id()
     
-    total_price = sum(int(item["qty"]) * float(item["price"]) for item in items_data.values())
-    
-    order = {
-        "order_id": order_id,
-        "name": name,
-        "phone": phone or "غير محدد",
-        "items": items_data,
-        "total_price": total_price,
-        "status": "مكتمل",  # Already completed since sold in-store
-        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
+        total_price = sum(int(item["qty"]) * float(item["price"]) for item in items_data.values())
     
-    orders.append(order)
-    save_data(ORDERS_FILE, orders)
+        order = {
+            "order_id": order_id,
+            "name": name,
+            "phone": phone or "غير محدد",
+            "items": items_data,
+            "total_price": total_price,
+            "status": "مكتمل",  # Already completed since sold in-store
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
     
+        storage.add_order(order)
+
+    event_hub.defer(publish_new_order, order)
     # Use session flash for success message (if flash was imported, otherwise redirect)
     return redirect(url_for('admin_orders'))
 
 @app.route('/admin/add_product', methods=['POST'])
 def add_product():
-    products = load_data(PRODUCTS_FILE) or {}
-
     name = request.form.get("name")
     purchase_price = float(request.form.get("purchase_price", "0") or 0)
     sell_price = float(request.form.get("sell_price", "0") or 0)
@@ -555,90 +880,95 @@ def add_product():
     image_url = request.form.get("image") or ""
     image_file = request.files.get("image_file")
     if image_file and image_file.filename:
-        upload_dir = os.path.join("static", "uploads")
-        os.makedirs(upload_dir, exist_ok=True)
-        filename = f"{len(products)+1}_{image_file.filename}"
-        path = os.path.join(upload_dir, filename)
-        image_file.save(path)
-        image = f"uploads/{filename}"
+        image = save_uploaded_image(image_file)
+        if image is None:
+            return "❌ الملف المرفوع ليس صورة صالحة", 400
     elif image_url:
         image = image_url
 
-    if products:
-        new_id = str(max(int(pid) for pid in products.keys()) + 1)
-    else:
-        new_id = "1"
+    new_id = storage.next_product_id()
+
+    product = {
+        "name": name,
+        "image": image,
+        "batches": []
+    }
 
     # create initial batch using provided stock and price
-    batches = [{
+    insert_batch(product, {
         "price": float(sell_price),
         "purchase_price": float(purchase_price),
         "quantity": int(stock),
         "expiry_date": expiry_date
-    }]
-
-    products[new_id] = {
-        "name": name,
-        "image": image,
-        "batches": batches
-    }
+    })
 
-    with open(PRODUCTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(products, f, ensure_ascii=False, indent=4)
+    storage.save_product(new_id, product)
+    event_hub.defer(publish_expiring_count)
 
     return redirect("/admin")
 
 @app.route("/admin/edit_product/<pid>", methods=["POST"])
 def admin_edit_product(pid):
-    products = load_data(PRODUCTS_FILE) or {}
-
-    if pid not in products:
+    if storage.get_product(pid) is None:
         return "Product not found", 404
 
-    product = products[pid]
-
     # ---------- JSON request ----------
     if request.content_type == "application/json":
         data = request.get_json()
         action = data.get("action")
 
-        # edit main fields
-        if action == "edit_main":
-            field = data.get("field")
-            value = data.get("value")
-            product[field] = value
-
-        elif action == "edit_batch":
-            index = data.get("index")
-            if "batches" not in product:
-                product["batches"] = []
-
-            if 0 <= index < len(product["batches"]):
-                product["batches"][index]["price"] = float(data.get("price", 0))
-                product["batches"][index]["purchase_price"] = float(data.get("purchase_price", data.get("price", 0)))
-                product["batches"][index]["quantity"] = int(data.get("quantity", 0))
-                product["batches"][index]["expiry_date"] = data.get("expiry_date")
-
-        elif action == "add_batch":
-            if "batches" not in product:
-                product["batches"] = []
-
-            product["batches"].append({
-                "price": 0,
-                "purchase_price": 0,
-                "quantity": 0,
-                "expiry_date": ""
-            })
-
-        elif action == "delete_batch":
-            index = data.get("index")
-            if 0 <= index < len(product.get("batches", [])):
-                del product["batches"][index]
-
-        elif action == "delete_product":
-            del products[pid]
-
-        save_data(PRODUCTS_FILE, products)
+        if action == "delete_product":
+            storage.delete_product(pid)
+            return "OK"
+
+        # the edit works on a copy inside the transaction: if anything fails
+        # (a bad price, say) the cached product is left as it was
+        with storage.transaction():
+            product = copy.deepcopy(storage.get_product(pid))
+            if product is None:
+                return "Product not found", 404
+            qty_before = batch_total(product)
+
+            # edit main fields
+            if action == "edit_main":
+                field = data.get("field")
+                value = data.get("value")
+                product[field] = value
+
+            elif action == "edit_batch":
+                # batches are addressed by id: their positions change with every FEFO re-order
+                batch = find_batch(product, data.get("batch_id"))
+                if batch is None:
+                    return "BATCH_CHANGED", 409
+
+                batch["price"] = float(data.get("price", 0))
+                batch["purchase_price"] = float(data.get("purchase_price", data.get("price", 0)))
+                batch["quantity"] = int(data.get("quantity", 0))
+                batch["expiry_date"] = data.get("expiry_date")
+                order_batches(product)
+
+            elif action == "add_batch":
+                if "batches" not in product:
+                    product["batches"] = []
+
+                insert_batch(product, {
+                    "price": 0,
+                    "purchase_price": 0,
+                    "quantity": 0,
+                    "expiry_date": ""
+                })
+
+            elif action == "delete_batch":
+                batch = find_batch(product, data.get("batch_id"))
+                if batch is None:
+                    return "BATCH_CHANGED", 409
+                product["batches"].remove(batch)
+
+            storage.save_product(pid, product)
+
+        if action in ("edit_batch", "add_batch", "delete_batch"):
+            event_hub.defer(publish_low_stock, {pid: qty_before - batch_total(product)}, {pid: product.get("name")})
+            event_hub.defer(publish_expiring_count)
         return "OK"
 
     # ---------- image upload ----------
@@ -646,17 +976,16 @@ def admin_edit_product(pid):
         image = request.files["image"]
 
         if image.filename != "":
-            upload_dir = os.path.join("static", "uploads")
-            os.makedirs(upload_dir, exist_ok=True)
+            path = save_uploaded_image(image)
+            if path is None:
+                return "INVALID_IMAGE", 400
 
-            filename = f"{pid}_{image.filename}"
-            path = os.path.join(upload_dir, filename)
-
-            image.save(path)
-
-            product["image"] = f"uploads/{filename}"
-
-            save_data(PRODUCTS_FILE, products)
+            with storage.transaction():
+                product = copy.deepcopy(storage.get_product(pid))
+                if product is None:
+                    return "Product not found", 404
+                product["image"] = path
+                storage.save_product(pid, product)
 
         return "IMAGE_UPLOADED"
 
@@ -667,10 +996,7 @@ def delete_product(pid):
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
 
-    products = load_data(PRODUCTS_FILE) or {}
-    if pid in products:
-        del products[pid]
-        save_data(PRODUCTS_FILE, products)
+    storage.delete_product(pid)
     return redirect(url_for('admin_dashboard'))
 
 @app.route("/admin/products")
@@ -686,61 +1012,96 @@ def admin_logout():
     return redirect(url_for("admin_login"))
 
 @app.route("/add_to_cart/<product_id>", methods=["GET"])
+@rate_limited("add_to_cart", as_json=True)
 def add_to_cart(product_id):
-    products = load_data(PRODUCTS_FILE) or {}
-
-    if product_id not in products:
-        return {"status": "error", "message": "المنتج غير موجود"}, 404
-
-    product = products[product_id]
-
-    total_stock = 0
-    batches = product.get("batches", [])
-
-    for b in batches:
-        total_stock += int(b.get("quantity", 0))
-
-    requested_qty = request.args.get("qty", default=1, type=int)
-
-    print("Total Stock =", total_stock, "| Requested =", requested_qty)
-
-    if requested_qty > total_stock:
-        return {
-            "status": "error",
-            "message": f"⚠️ الكمية المطلوبة غير متوفرة، المتاح فقط: {total_stock}"
-        }
+    """Reserve ``qty`` units (the product's total in the cart) for this cart.
+
+    qty=0 drops the product's hold, e.g. when it is removed from the cart.
+    """
+    requested_qty = max(request.args.get("qty", default=1, type=int), 0)
+    cart_id = get_cart_id(create=True)
+
+    with storage.transaction():
+        stock = storage.get_stock(product_id)
+
+        if stock is None:
+            return {"status": "error", "message": "المنتج غير موجود"}, 404
+
+        # المتاح = المخزون ناقص ما تحجزه السلات الأخرى
+        held_by_others = storage.reserved_qty([product_id], exclude_cart=cart_id).get(product_id, 0)
+        total_stock = max(stock.total_qty - held_by_others, 0)
+
+        if requested_qty > total_stock:
+            return {
+                "status": "error",
+                "message": f"⚠️ الكمية المطلوبة غير متوفرة، المتاح فقط: {total_stock}"
+            }
+
+        expires_at = storage.hold(cart_id, product_id, requested_qty, HOLD_TTL)
+
+    return {"status": "success", "expires_at": int(expires_at)}
+
+MAX_CART_LINES = 100
+
+@app.route("/api/cart/check", methods=["POST"])
+@rate_limited("cart_check", as_json=True)
+def check_cart():
+    """Check (and by default hold) a whole cart in one request.
+
+    Body: {"items": {pid: qty}, "hold": true}.  Every line is answered from
+    the stock aggregates: {requested, available, ok}.  With hold, the lines
+    that fit are held for this cart, lines that do not keep their previous
+    hold, and held products missing from ``items`` are released, since
+    ``items`` is the whole cart.  stock_version changes whenever stock does.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("items")
+    if not isinstance(items, dict) or len(items) > MAX_CART_LINES:
+        return jsonify({"status": "error", "message": f"items must be an object of up to {MAX_CART_LINES} lines"}), 400
+    try:
+        wanted = {str(pid): max(int(qty), 0) for pid, qty in items.items()}
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "quantities must be integers"}), 400
+
+    hold = data.get("hold", True) is not False
+    cart_id = get_cart_id(create=hold)
+    lines = {}
+    expires_at = None
+    with storage.transaction():
+        stocks = storage.get_stocks(wanted)
+        # المتاح = المخزون ناقص ما تحجزه السلات الأخرى
+        reserved = storage.reserved_qty(wanted, exclude_cart=cart_id)
+        for pid, qty in wanted.items():
+            stock = stocks.get(pid)
+            available = max(stock.total_qty - reserved.get(pid, 0), 0) if stock else 0
+            lines[pid] = {"requested": qty, "available": available, "ok": stock is not None and qty <= available}
+
+        if hold:
+            changes = {pid: 0 for pid in storage.cart_holds(cart_id) if pid not in wanted}
+            changes.update({pid: line["requested"] for pid, line in lines.items() if line["ok"]})
+            if changes:
+                expires_at = int(storage.hold_many(cart_id, changes, HOLD_TTL))
 
-    return {"status": "success"}
+    return jsonify({
+        "status": "success" if all(line["ok"] for line in lines.values()) else "error",
+        "lines": lines,
+        "stock_version": storage.catalog_version(),
+        "expires_at": expires_at,
+    })
 
 @app.route('/admin/reports')
 def admin_reports():
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
 
-    orders = load_data(ORDERS_FILE) or []
-    total_orders = len(orders)
-    total_revenue = sum(float(o.get("total_price", 0)) for o in orders if o.get("status") != "ملغي")
-    counter = Counter()
-    for o in orders:
-        if o.get("status") == "ملغي":
-            continue
-        for pid, item in o.get("items", {}).items():
-            counter[item.get("name","unknown")] += int(item.get("qty", 0))
+    # aggregates maintained on every order write (see rollups.py)
+    rollups = storage.get_rollups()
+    totals = rollups["total"]
+    total_orders = totals.get("all", {}).get("orders", 0)
+    total_revenue = totals.get("active", {}).get("revenue", 0)
+    counter = Counter({name: row["qty"] for name, row in rollups["product"].items()})
     top_products = counter.most_common(10)
-    # compute expiring count
-    products = load_data(PRODUCTS_FILE) or {}
-    expiring_count = 0
-    now = datetime.now().date()
-    for pid,p in products.items():
-        for b in p.get("batches", []):
-            ed = b.get("expiry_date","")
-            if ed:
-                try:
-                    edd = datetime.strptime(ed, "%Y-%m-%d").date()
-                    if (edd - now).days <= 30:
-                        expiring_count += 1
-                except:
-                    continue
+    expiring_count = storage.count_expiring(30)
 
     return jsonify({
         "total_orders": total_orders,
@@ -749,98 +1110,146 @@ def admin_reports():
         "expiring_count": expiring_count
     })
 
-@app.route('/admin/profits')
-def admin_profits():
+@app.route('/admin/jobs')
+def admin_jobs():
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
+    status = request.args.get("status") if request.args.get("status") in JOB_STATUSES else None
+    jobs = job_queue.recent(status=status, limit=200)
+    for job in jobs:
+        for field in ("created_at", "started_at", "finished_at"):
+            job[field] = datetime.fromtimestamp(job[field]).strftime("%Y-%m-%d %H:%M:%S") if job[field] else ""
+    return render_template("admin_jobs.html", jobs=jobs, counts=job_queue.counts(), status=status,
+                           admin_jobs=ADMIN_JOBS)
+
+@app.route('/admin/jobs/submit', methods=['POST'])
+def admin_submit_job():
+    if 'admin' not in session:
+        return redirect(url_for('admin_login'))
+    kind = request.form.get("kind")
+    if kind not in ADMIN_JOBS:
+        return "Unknown job", 400
+    job_queue.submit(kind, dedupe_key=kind)
+    return redirect(url_for('admin_jobs'))
+
+@app.route('/admin/jobs/<int:job_id>/retry', methods=['POST'])
+def admin_retry_job(job_id):
+    if 'admin' not in session:
+        return redirect(url_for('admin_login'))
+    job_queue.retry(job_id)
+    return redirect(url_for('admin_jobs'))
 
-    orders = load_data(ORDERS_FILE) or []
-    completed_orders = [o for o in orders if o.get("status") == "مكتمل"]
-
-    def add_bucket(store, key, revenue, cost):
-        if key not in store:
-            store[key] = {"revenue": 0, "cost": 0}
-        store[key]["revenue"] += revenue
-        store[key]["cost"] += cost
+@app.route('/admin/cache_stats')
+def cache_stats():
+    if 'admin' not in session:
+        return redirect(url_for('admin_login'))
+    if request.args.get("invalidate"):
+        invalidate_data_cache()
+        invoice_cache.clear()
+        page_cache.clear()
+    return jsonify(dict(data_cache.stats(), invoices=invoice_cache.stats(), pages=page_cache.stats(),
+                        rtl=rtl_cache_stats()))
+
+# Lets a Prometheus scraper in without an admin session: Authorization: Bearer <token>
+METRICS_TOKEN = os.environ.get("PHARMACY_METRICS_TOKEN")
+
+@metrics.collector
+def collect_runtime_stats():
+    """Cache and rate limiter statistics, read at scrape time."""
+    caches = {"data": data_cache.stats(), "invoice": invoice_cache.stats(), "page": page_cache.stats(),
+              "rtl": rtl_cache_stats()}
+    limits = rate_limiter.stats()
+    families = [
+        ("pharmacy_cache_hits_total", "counter", "Cache lookups answered from memory",
+         [({"cache": name}, s["hits"]) for name, s in caches.items()]),
+        ("pharmacy_cache_misses_total", "counter", "Cache lookups that had to load or render",
+         [({"cache": name}, s["misses"]) for name, s in caches.items()]),
+        ("pharmacy_cache_entries", "gauge", "Entries held by each cache",
+         [({"cache": name}, s["entries"]) for name, s in caches.items()]),
+        ("pharmacy_cache_bytes", "gauge", "Memory held by the size-bounded caches",
+         [({"cache": name}, s["bytes"]) for name, s in caches.items() if "bytes" in s]),
+        ("pharmacy_rate_limit_requests_total", "counter", "Requests checked against each rate limit",
+         [({"limit": name, "result": result}, s[result]) for name, s in limits.items()
+          for result in ("allowed", "denied")]),
+    ]
+    events = event_hub.stats()
+    families.append(("pharmacy_sse_streams", "gauge", "Open Server-Sent Events streams",
+                     [({"channel": channel}, n) for channel, n in events["streams"].items()]))
+    families.append(("pharmacy_sse_events_total", "counter", "Events published / delivered / dropped",
+                     [({"result": result}, events[result]) for result in ("published", "delivered", "dropped")]))
+    families.append(("pharmacy_jobs", "gauge", "Background jobs by status",
+                     [({"status": status}, n) for status, n in job_queue.counts().items()]))
+    if slow_profiler is not None:
+        families.append(("pharmacy_slow_requests_total", "counter", "Requests logged by the slow-request profiler",
+                         [({}, slow_profiler.logged)]))
+    return families
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    """Metrics of this worker process in Prometheus text format."""
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if 'admin' not in session and not (METRICS_TOKEN and secrets.compare_digest(token, METRICS_TOKEN)):
+        if token:
+            return "Unauthorized", 401
+        return redirect(url_for('admin_login'))
+    return Response(metrics.exposition(), mimetype="text/plain; version=0.0.4")
 
-    daily = {}
-    weekly = {}
-    monthly = {}
+@app.route('/admin/profits')
+def admin_profits():
+    if 'admin' not in session:
+        return redirect(url_for('admin_login'))
 
-    total_revenue = 0
-    total_cost = 0
+    # aggregates maintained on every order write (see rollups.py)
+    rollups = storage.get_rollups()
 
-    for o in completed_orders:
-        try:
-            dt = datetime.strptime(o.get("created_at",""), "%Y-%m-%d %H:%M:%S")
-        except:
-            continue
-
-        revenue = 0
-        cost = 0
-        for pid, item in o.get("items", {}).items():
-            qty = int(item.get("qty", 0))
-            price = float(item.get("price", 0))
-            unit_cost = float(item.get("cost", item.get("price", 0)))
-            revenue += qty * price
-            cost += qty * unit_cost
-
-        total_revenue += revenue
-        total_cost += cost
-
-        day_key = dt.strftime("%Y-%m-%d")
-        month_key = dt.strftime("%Y-%m")
-        iso_year, iso_week, _ = dt.isocalendar()
-        week_key = f"الأسبوع {iso_week} من {iso_year}"
-
-        add_bucket(daily, day_key, revenue, cost)
-        add_bucket(weekly, week_key, revenue, cost)
-        add_bucket(monthly, month_key, revenue, cost)
-
-    def to_list(store):
+    def to_list(store, label=None):
         out = []
         for k,v in sorted(store.items()):
             profit = v["revenue"] - v["cost"]
-            out.append({"period": k, "revenue": v["revenue"], "cost": v["cost"], "profit": profit})
+            out.append({"period": label(k) if label else k, "revenue": v["revenue"], "cost": v["cost"], "profit": profit})
         return out
 
+    completed = rollups["total"].get("completed", {"revenue": 0, "cost": 0, "orders": 0})
+    total_revenue = completed["revenue"]
+    total_cost = completed["cost"]
+
     return render_template(
         "admin_profits.html",
-        daily=to_list(daily),
-        weekly=to_list(weekly),
-        monthly=to_list(monthly),
+        daily=to_list(rollups["day"]),
+        weekly=to_list(rollups["week"], week_label),
+        monthly=to_list(rollups["month"]),
         totals={
             "revenue": total_revenue,
             "cost": total_cost,
             "profit": total_revenue - total_cost
         },
-        completed_count=len(completed_orders)
+        completed_count=completed["orders"]
     )
 
+@app.route('/admin/analytics')
+def admin_analytics():
+    """Ad-hoc reports over the whole order history: ?report=hourly|margin|basket."""
+    if 'admin' not in session:
+        return redirect(url_for('admin_login'))
+
+    reports = {
+        "hourly": lambda cols: revenue_by_hour(cols).tolist(),
+        "margin": margin_by_product,
+        "basket": basket_sizes,
+    }
+    wanted = request.args.get("report")
+    if wanted and wanted not in reports:
+        return jsonify({"error": f"unknown report, use one of {', '.join(reports)}"}), 400
+
+    cols = OrderColumns.from_orders(storage.load_orders())
+    return jsonify({name: fn(cols) for name, fn in reports.items() if not wanted or name == wanted})
+
 @app.route('/admin/expiring')
 def admin_expiring():
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
     days = int(request.args.get("days", 30))
-    products = load_data(PRODUCTS_FILE) or {}
-    soon = []
-    now = datetime.now().date()
-    for pid, p in products.items():
-        for b in p.get("batches", []):
-            if not b.get("expiry_date"): continue
-            try:
-                ed = datetime.strptime(b["expiry_date"], "%Y-%m-%d").date()
-                delta = (ed - now).days
-                if delta <= days:
-                    soon.append({
-                        "pid": pid,
-                        "name": p.get("name"),
-                        "expiry_date": b["expiry_date"],
-                        "quantity": b.get("quantity",0),
-                        "days_left": delta
-                    })
-            except:
-                continue
+    soon = storage.expiring_batches(days)
     return jsonify(soon)
 
 
@@ -849,29 +1258,19 @@ def stock_overview():
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
 
-    products = load_data(PRODUCTS_FILE) or {}
+    products = storage.load_products()
+    levels = storage.stock_levels()
 
     stock_list = []
-    now = datetime.now().date()
+    today = date.today().toordinal()
 
     for pid, p in products.items():
-        batches = p.get("batches", [])
-
-        total_qty = sum(int(b.get("quantity", 0)) for b in batches)
-
-        # أقرب تاريخ انتهاء
-        expiry_dates = [
-            datetime.strptime(b["expiry_date"], "%Y-%m-%d").date()
-            for b in batches
-            if b.get("expiry_date")
-        ]
+        stock = levels[pid]
+        total_qty = stock.total_qty
 
-        if expiry_dates:
-            nearest_exp = min(expiry_dates)
-            days_left = (nearest_exp - now).days
-        else:
-            nearest_exp = None
-            days_left = None
+        # أقرب تاريخ انتهاء (التاريخ المحلَّل محفوظ في الكاش)
+        nearest_exp = expiry_ordinal(stock.nearest_expiry)
+        days_left = nearest_exp - today if nearest_exp is not None else None
 
         if total_qty == 0:
             status = "out"
@@ -884,11 +1283,18 @@ def stock_overview():
         else:
             status = "ok"
 
+        # هامش الوحدة: سعر البيع للـ batch التالي (FEFO) ناقص متوسط تكلفة الشراء للمخزون كله
+        next_batch = next((b for b in p.get("batches", []) if int(b.get("quantity") or 0) > 0), None)
+        unit_margin = float(next_batch.get("price") or 0) - stock.weighted_cost if next_batch else None
+
         stock_list.append({
             "pid": pid,
             "name": p.get("name"),
             "total_qty": total_qty,
-            "nearest_exp": nearest_exp.strftime("%Y-%m-%d") if nearest_exp else "-",
+            "weighted_cost": round(stock.weighted_cost, 2),
+            "unit_margin": round(unit_margin, 2) if unit_margin is not None else "-",
+            "cost_value": stock.cost_value,
+            "nearest_exp": stock.nearest_expiry if nearest_exp is not None else "-",
             "days_left": days_left if days_left is not None else "-",
             "status": status
         })
@@ -898,30 +1304,126 @@ def stock_overview():
 
 
 
+def sse_response(body):
+    response = Response(body, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # nginx: pass events through unbuffered
+    return response
+
+def last_event_id():
+    value = request.headers.get("Last-Event-ID", "")
+    return int(value) if value.isdigit() else None
+
+@app.route("/admin/events")
+def admin_events():
+    """SSE: new orders, status changes, low-stock and expiry alerts."""
+    if "admin" not in session:
+        return jsonify({"error": "unauthorized"}), 401
+    shown = {"day": date.today()}
+
+    def on_heartbeat():
+        # batches cross the alert window at midnight without any edit
+        if date.today() != shown["day"]:
+            shown["day"] = date.today()
+            return [("expiring", expiring_alert())]
+        return []
+
+    return sse_response(event_hub.stream("admin", last_event_id(), [("expiring", expiring_alert())],
+                                         SSE_MAX_SECONDS, on_heartbeat))
+
+@app.route("/track/<order_id>/events")
+@rate_limited("track_order")
+def track_order_events(order_id):
+    """SSE: the order's status whenever it changes."""
+    order = storage.get_order(order_id)
+    if not order:
+        return "الطلب غير موجود", 404
+    return sse_response(event_hub.stream(f"order:{order_id}", last_event_id(),
+                                         [("status", {"status": order["status"]})], SSE_MAX_SECONDS))
+
 @app.route("/admin/expiring_count")
 def expiring_count():
     if "admin" not in session:
         return jsonify({"count": 0})
 
-    products = load_data(PRODUCTS_FILE) or {}
-    now = datetime.now().date()
-    count = 0
-
-    for pid, p in products.items():
-        for b in p.get("batches", []):
-            exp = b.get("expiry_date", "")
-            if exp:
-                try:
-                    d = datetime.strptime(exp, "%Y-%m-%d").date()
-                    if (d - now).days <= 30:
-                        count += 1
-                except:
-                    pass
+    count = storage.count_expiring(30)
 
     return jsonify({"count": count})
 
 
 
+@app.cli.command("import-json")
+def import_json_command():
+    """Copy products.json and orders.json into the SQLite database."""
+    source = make_storage("json")
+    target = SqliteStorage(SQLITE_DB_FILE)
+    n_products, n_orders = import_json(target, source.load_products(), source.load_orders())
+    print(f"Imported {n_products} products and {n_orders} orders into {SQLITE_DB_FILE}")
+
+@app.cli.command("expire-holds")
+def expire_holds_command():
+    """Delete expired cart stock holds now instead of waiting for the sweeper."""
+    print(f"Dropped expired holds of {storage.expire_holds()} carts")
+
+@app.cli.command("export-invoices")
+@click.option("--from", "date_from", help="first day (YYYY-MM-DD), inclusive")
+@click.option("--to", "date_to", help="last day (YYYY-MM-DD), inclusive")
+@click.option("--status", default="مكتمل", show_default=True, help='order status, or "all"')
+@click.option("--out", default="invoices.zip", show_default=True, help="ZIP file to write")
+@click.option("--workers", type=int, help="render processes (default: CPU count)")
+def export_invoices_command(date_from, date_to, status, out, workers):
+    """Write the invoices of the matching orders into one ZIP file."""
+    status = None if status == "all" else status
+    orders = storage.find_orders(status=status) if status else storage.load_orders()
+    orders = select_orders(orders, date_from, date_to, status)
+    settings = load_data("pharmacy.json") or {}
+
+    def progress(done, total):
+        print(f"\r{done}/{total} invoices", end="", flush=True)
+
+    with open(out, "wb") as f:
+        for chunk in iter_invoice_zip(orders, settings, AMIRI_FONT, workers, progress):
+            f.write(chunk)
+    print(f"\nWrote {len(orders)} invoices to {out}")
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recompute the revenue/profit rollups from the whole order history."""
+    store = storage.rebuild_rollups()
+    print(f"Rebuilt rollups: {len(store['day'])} days, {len(store['product'])} products")
+
+@app.cli.command("build-image-variants")
+def build_image_variants_command():
+    """Make the thumbnails/WebP variants of every product image now."""
+    images = sorted({p["image"] for p in storage.load_products().values() if p.get("image")})
+    done = [image for image in images if image_variants.process(image)]
+    print(f"Built variants for {len(done)} of {len(images)} product images")
+
+@app.cli.command("compact-orders")
+def compact_orders_command():
+    """Rewrite the order journal keeping only the latest version of each order."""
+    if not isinstance(storage, JsonStorage):
+        print("Order journal is only used by the json storage backend")
+        return
+    storage.journal.compact()
+    print(f"Compacted {len(storage.journal)} orders in {ORDERS_JOURNAL_DIR}")
+
+@app.cli.command("run-jobs")
+@click.option("--once", is_flag=True, help="run the jobs that are due now, then exit")
+@click.option("--threads", type=int, default=2, show_default=True)
+def run_jobs_command(once, threads):
+    """Work the background job queue in this process (with PHARMACY_JOB_THREADS=0 in the web workers)."""
+    queue_missing_image_variants()
+    if once:
+        print(f"Ran {job_queue.run_pending()} jobs")
+        return
+    job_queue.start(threads)
+    print(f"Working jobs from {JOBS_DB} on {threads} threads, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        job_queue.stop(timeout=30)
 
 
 if __name__ == "__main__":
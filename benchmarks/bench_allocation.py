@@ -0,0 +1,93 @@
+"""Benchmark FEFO allocation: the shared engine vs. the old per-line loop.
+
+Carts with dozens of lines are allocated against products that each hold
+hundreds of small batches, so every line draws from several batches.
+
+    python benchmarks/bench_allocation.py --products 200 --batches 300 --lines 40
+"""
+import argparse
+import copy
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allocation import allocate  # noqa: E402
+from inventory import ensure_batch_id, order_batches  # noqa: E402
+
+
+def make_products(n_products, n_batches, rng):
+    products = {}
+    for pid in range(1, n_products + 1):
+        batches = [{
+            "price": 20,
+            "purchase_price": rng.randint(8, 15),
+            "quantity": rng.randint(1, 6),
+            "expiry_date": f"20{rng.randint(26, 35)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        } for _ in range(n_batches)]
+        products[str(pid)] = {"name": f"Product {pid}", "batches": batches}
+    return products
+
+
+def legacy_deduct(products, quantities):
+    """The loop checkout() and manual_order() used to run for each line."""
+    for pid, qty in quantities.items():
+        if qty > sum(int(b.get("quantity", 0)) for b in products[pid]["batches"]):
+            raise ValueError(pid)
+    for pid, needed in quantities.items():
+        batches = sorted(products[pid].get("batches", []), key=lambda x: x.get("expiry_date", ""))
+        for batch in batches:
+            if "purchase_price" not in batch:
+                batch["purchase_price"] = float(batch.get("price", 0))
+            if needed <= 0:
+                break
+            available = int(batch.get("quantity", 0))
+            if available >= needed:
+                batch["quantity"] = available - needed
+                needed = 0
+            else:
+                needed -= available
+                batch["quantity"] = 0
+        products[pid]["batches"] = batches
+
+
+def run(fn, base, carts):
+    timings = []
+    for cart in carts:
+        products = copy.deepcopy(base)
+        start = time.perf_counter()
+        fn(products, cart)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--batches", type=int, default=300)
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--carts", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    base = make_products(args.products, args.batches, rng)
+    for product in base.values():
+        # stored in FEFO order with batch ids, as the app keeps them
+        for batch in order_batches(product):
+            ensure_batch_id(product, batch)
+    pids = list(base)
+    carts = [{pid: rng.randint(5, 25) for pid in rng.sample(pids, args.lines)} for _ in range(args.carts)]
+
+    print(f"{args.carts} carts x {args.lines} lines, {args.products} products x {args.batches} batches")
+    for label, fn in (("legacy loop", legacy_deduct), ("allocate()", allocate)):
+        timings = run(fn, base, carts)
+        print(f"  {label:12s} median {statistics.median(timings) * 1e3:8.3f} ms"
+              f"   p95 {sorted(timings)[int(len(timings) * 0.95) - 1] * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark the columnar analytics engine against the per-order dict loops.
+
+Builds a synthetic order history (1M order lines by default) and times:
+
+  loops      what admin_profits + admin_reports computed per page view
+             before the rollups (strptime per order, dict buckets, Counter)
+  columns    loading the orders into OrderColumns (one pass, done once)
+  rollups    rollup_store() over the columns: the same aggregates, vectorized
+  reports    revenue_by_hour + margin_by_product + basket_sizes
+
+    python benchmarks/bench_analytics.py --lines 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import OrderColumns, basket_sizes, margin_by_product, revenue_by_hour, rollup_store  # noqa: E402
+
+STATUSES = ["مكتمل"] * 7 + ["ملغي", "قيد الانتظار"]
+
+
+def make_orders(n_lines, n_products, rng):
+    start = datetime(2024, 1, 1)
+    orders, lines = [], 0
+    while lines < n_lines:
+        n = min(rng.randint(1, 7), n_lines - lines)
+        items = {}
+        for pid in rng.sample(range(1, n_products + 1), n):
+            price = rng.choice([15, 25, 40, 75, 120])
+            items[str(pid)] = {"name": f"Product {pid}", "qty": rng.randint(1, 3), "price": price,
+                               "cost": round(price * rng.uniform(0.5, 0.8), 2)}
+        created = start + timedelta(seconds=rng.randint(0, 2 * 365 * 86400))
+        orders.append({
+            "order_id": f"ORD{len(orders):08d}",
+            "items": items,
+            "total_price": sum(i["qty"] * i["price"] for i in items.values()),
+            "status": rng.choice(STATUSES),
+            "created_at": created.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        lines += n
+    return orders
+
+
+def legacy_loops(orders):
+    """admin_profits and admin_reports as they were written before the rollups."""
+    daily, weekly, monthly = {}, {}, {}
+
+    def add_bucket(store, key, revenue, cost):
+        if key not in store:
+            store[key] = {"revenue": 0, "cost": 0}
+        store[key]["revenue"] += revenue
+        store[key]["cost"] += cost
+
+    for o in [o for o in orders if o.get("status") == "مكتمل"]:
+        try:
+            dt = datetime.strptime(o.get("created_at", ""), "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+        revenue = cost = 0
+        for item in o.get("items", {}).values():
+            qty = int(item.get("qty", 0))
+            revenue += qty * float(item.get("price", 0))
+            cost += qty * float(item.get("cost", item.get("price", 0)))
+        iso_year, iso_week, _ = dt.isocalendar()
+        add_bucket(daily, dt.strftime("%Y-%m-%d"), revenue, cost)
+        add_bucket(weekly, f"{iso_year}-{iso_week}", revenue, cost)
+        add_bucket(monthly, dt.strftime("%Y-%m"), revenue, cost)
+
+    total_revenue = sum(float(o.get("total_price", 0)) for o in orders if o.get("status") != "ملغي")
+    counter = Counter()
+    for o in orders:
+        if o.get("status") == "ملغي":
+            continue
+        for item in o.get("items", {}).values():
+            counter[item.get("name", "unknown")] += int(item.get("qty", 0))
+    return daily, weekly, monthly, total_revenue, counter.most_common(10)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args(argv)
+
+    orders = make_orders(args.lines, args.products, random.Random(args.seed))
+    print(f"{len(orders)} orders, {args.lines} lines, {args.products} products")
+
+    (daily, *_), t_loops = timed(legacy_loops, orders)
+    cols, t_cols = timed(OrderColumns, orders)
+    store, t_rollups = timed(rollup_store, cols)
+    _, t_reports = timed(lambda c: (revenue_by_hour(c), margin_by_product(c), basket_sizes(c)), cols)
+
+    assert len(store["day"]) == len(daily)
+    print(f"  loops            {t_loops:7.3f} s")
+    print(f"  columns (load)   {t_cols:7.3f} s")
+    print(f"  rollup_store     {t_rollups:7.3f} s   ({t_loops / t_rollups:.1f}x faster than the loops)")
+    print(f"  ad-hoc reports   {t_reports:7.3f} s")
+
+
+if __name__ == "__main__":
+    main()
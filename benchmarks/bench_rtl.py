@@ -0,0 +1,97 @@
+"""Benchmark invoice rendering with and without the memoized rtl() shaping.
+
+Renders the same set of invoices (shared settings, product names drawn from
+a small catalog, as in a real shop) with the uncached reshape + bidi call
+and with the LRU-cached one, and reports the time per invoice and the time
+spent shaping alone.
+
+    python benchmarks/bench_rtl.py --invoices 40 --lines 8
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import invoice  # noqa: E402
+from arabic_reshaper import reshape  # noqa: E402
+from bidi.algorithm import get_display  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FONT = os.path.join(ROOT, "static", "fonts", "Amiri-Regular.ttf")
+
+SETTINGS = {
+    "name": "صيدلية الشفاء",
+    "address": "١٢ شارع الجمهورية، القاهرة",
+    "phone": "01000000000",
+    "license": "ت م ١٢٣٤٥",
+    "tax_number": "٩٨٧-٦٥٤-٣٢١",
+    "footer": "شكراً لتعاملكم معنا — نتمنى لكم الشفاء العاجل",
+}
+NAMES = ["باراسيتامول ٥٠٠ مجم", "أموكسيسيلين ٢٥٠ مجم", "فيتامين سي فوار", "شراب كحة للأطفال",
+         "مرهم مضاد حيوي", "قطرة عين مرطبة", "أقراص حموضة", "بخاخ أنف ملحي"]
+
+
+def uncached_rtl(text):
+    if not text:
+        return ""
+    return get_display(reshape(text))
+
+
+def make_orders(n, lines, rng):
+    orders = []
+    for i in range(n):
+        items = {str(pid): {"name": NAMES[pid], "qty": rng.randint(1, 3), "price": rng.choice([15, 40, 75])}
+                 for pid in rng.sample(range(len(NAMES)), min(lines, len(NAMES)))}
+        orders.append({"order_id": f"ORDBENCH{i:04d}", "name": "عميل تجريبي", "phone": "01111111111",
+                       "items": items, "created_at": "2026-01-15 12:00:00", "status": "مكتمل"})
+    return orders
+
+
+def run(orders, shaper):
+    render, shaping = [], []
+    for order in orders:
+        calls = []
+
+        def timed(text):
+            start = time.perf_counter()
+            out = shaper(text)
+            calls.append(time.perf_counter() - start)
+            return out
+
+        invoice.rtl = timed
+        start = time.perf_counter()
+        invoice.render_invoice(order, SETTINGS, FONT)
+        render.append(time.perf_counter() - start)
+        shaping.append(sum(calls))
+    return render, shaping
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=40)
+    parser.add_argument("--lines", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    orders = make_orders(args.invoices, args.lines, random.Random(args.seed))
+    cached_rtl = invoice.rtl
+    invoice.render_invoice(orders[0], SETTINGS, FONT)  # warm imports and the font file
+
+    print(f"{args.invoices} invoices x {args.lines} lines")
+    for label, shaper in (("uncached", uncached_rtl), ("lru cache", cached_rtl)):
+        if shaper is cached_rtl:
+            invoice._shape.cache_clear()
+            invoice.preshape(SETTINGS)
+        render, shaping = run(orders, shaper)
+        print(f"  {label:10s} render median {statistics.median(render) * 1e3:7.2f} ms"
+              f"   shaping median {statistics.median(shaping) * 1e3:6.3f} ms per invoice")
+    invoice.rtl = cached_rtl
+    print("  cache:", invoice.rtl_cache_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Seeded synthetic pharmacy data at a configurable scale.
+
+Writes products.json (FEFO-ordered batches with ids, some already expired
+or close to expiry), orders.json (orders spread over ``days`` days, mixed
+statuses, line costs as checkout records them) and pharmacy.json into a
+data directory the app can be pointed at with PHARMACY_DATA_DIR.
+
+    python benchmarks/datagen.py /tmp/pharmacy-big --skus 10000 --batches 20 --orders 1000000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from inventory import fefo_key  # noqa: E402
+
+STATUSES = ["مكتمل"] * 6 + ["قيد الانتظار", "جاهز للاستلام", "ملغي"]
+WORDS = ["باراسيتامول", "أموكسيسيلين", "فيتامين", "شراب", "مرهم", "قطرة", "Adol", "Panadol", "Augmentin",
+         "Cetal", "Brufen", "Congestal", "Zyrtec", "Omega", "Zinc", "Calcium", "Otrivin", "Voltaren"]
+FORMS = ["أقراص", "كبسولات", "شراب", "tablets", "syrup", "cream", "drops"]
+
+
+def make_products(n_skus, n_batches, rng, today):
+    products = {}
+    for pid in range(1, n_skus + 1):
+        price = rng.choice([12, 18, 25, 40, 55, 75, 120, 180])
+        batches = []
+        for i in range(rng.randint(max(1, n_batches // 2), n_batches)):
+            batches.append({
+                "batch_id": f"{pid:x}-{i:x}",
+                "price": price,
+                "purchase_price": round(price * rng.uniform(0.55, 0.8), 2),
+                "quantity": rng.randint(0, 40),
+                # a few already expired, a few within the 30-day warning window
+                "expiry_date": (today + timedelta(days=rng.randint(-60, 3 * 365))).isoformat(),
+            })
+        batches.sort(key=fefo_key)
+        name = f"{rng.choice(WORDS)} {rng.choice([100, 250, 500, 625, 1000])} {rng.choice(FORMS)} {pid}"
+        products[str(pid)] = {"name": name, "image": None, "batches": batches}
+    return products
+
+
+def make_orders(n_orders, products, days, rng, today):
+    pids = list(products)
+    start = datetime.combine(today, datetime.min.time()) - timedelta(days=days)
+    orders = []
+    for i in range(n_orders):
+        items = {}
+        for pid in rng.sample(pids, min(rng.randint(1, 6), len(pids))):
+            product = products[pid]
+            batch = product["batches"][0] if product["batches"] else {"price": 10, "purchase_price": 7}
+            items[pid] = {"name": product["name"], "price": batch["price"], "qty": rng.randint(1, 2),
+                          "cost": batch["purchase_price"]}
+        created = start + timedelta(seconds=rng.randint(0, days * 86400))
+        orders.append({
+            "order_id": f"ORDB{i:09d}",
+            "name": f"عميل {rng.randint(1, n_orders // 3 + 1)}",
+            "phone": f"01{rng.randint(0, 2)}{rng.randint(10000000, 99999999)}",
+            "items": items,
+            "total_price": sum(item["qty"] * item["price"] for item in items.values()),
+            "status": rng.choice(STATUSES),
+            "created_at": created.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+    orders.sort(key=lambda o: o["created_at"])
+    return orders
+
+
+def generate(data_dir, skus=2000, batches=10, orders=50000, days=730, seed=7, today=None):
+    """Write the data files into ``data_dir``; returns (products, orders)."""
+    rng = random.Random(seed)
+    today = today or date.today()
+    os.makedirs(data_dir, exist_ok=True)
+    products = make_products(skus, batches, rng, today)
+    order_list = make_orders(orders, products, days, rng, today)
+    for name, data in (("products.json", products), ("orders.json", order_list)):
+        with open(os.path.join(data_dir, name), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    shutil.copy(os.path.join(ROOT, "pharmacy.json"), data_dir)
+    return products, order_list
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("data_dir")
+    parser.add_argument("--skus", type=int, default=2000)
+    parser.add_argument("--batches", type=int, default=10, help="max batches per SKU")
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--days", type=int, default=730, help="order history length")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    products, orders = generate(args.data_dir, args.skus, args.batches, args.orders, args.days, args.seed)
+    n_batches = sum(len(p["batches"]) for p in products.values())
+    print(f"{len(products)} SKUs, {n_batches} batches, {len(orders)} orders -> {args.data_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Benchmark suite for the app's hot paths, with results saved as JSON.
+
+Generates a seeded data set (benchmarks/datagen.py), points the app at it
+and times each case over several rounds:
+
+  load_data.cold / .warm   parse products.json / DataCache hit
+  save_data                atomic rewrite of products.json
+  allocate                 FEFO deduction of a cart (allocation.allocate)
+  checkout                 POST /checkout end to end
+  admin_profits            GET /admin/profits
+  admin_expiring           GET /admin/expiring?days=30
+  stock_overview           GET /admin/stock_overview
+  invoice.cold / .warm     GET /invoice/<id>, rendered / from the invoice cache
+  api_products             GET /api/products search, page cache cleared
+
+Results (min/median/mean/stdev per case plus commit, scale and backend)
+go to benchmarks/results/<commit>-<backend>.json; --compare prints the
+ratio against an earlier file and flags regressions.
+
+    python benchmarks/suite.py --skus 10000 --batches 20 --orders 1000000
+    python benchmarks/suite.py --compare benchmarks/results/abc1234-json.json --fail-above 1.25
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from datagen import generate  # noqa: E402  (benchmarks/ is on sys.path as the script's directory)
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def measure(fn, rounds, warmup=1, setup=None):
+    """Time ``fn`` (called with setup()'s result, if any) over ``rounds`` runs."""
+    times = []
+    for i in range(warmup + rounds):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    return {
+        "rounds": rounds,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "max": max(times),
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_app(data_dir, backend):
+    os.environ["PHARMACY_DATA_DIR"] = data_dir
+    os.environ["PHARMACY_STORAGE"] = backend
+    os.environ["PHARMACY_HOLD_SWEEP"] = "0"
+    # the suite hammers a few routes from one client: lift the per-IP limits
+    os.environ["PHARMACY_RATE_LIMIT_BACKEND"] = "memory"
+    os.environ["PHARMACY_RATE_LIMITS"] = ",".join(
+        f"{name}=1000000/second" for name in ("checkout", "add_to_cart", "cart_check", "track_order", "invoice"))
+    import app as pharmacy_app
+    return pharmacy_app
+
+
+def run_cases(pharmacy_app, products, orders, rounds, rng, only=None):
+    A = pharmacy_app
+    client = A.app.test_client()
+    with client.session_transaction() as session:
+        session["admin"] = True
+
+    def get(url):
+        def call():
+            resp = client.get(url)
+            if resp.status_code != 200:
+                raise RuntimeError(f"GET {url} returned {resp.status_code}")
+        return call
+
+    in_stock = [pid for pid, p in products.items() if sum(b["quantity"] for b in p["batches"]) >= 50]
+    completed = next(o["order_id"] for o in reversed(orders) if o["status"] == "مكتمل")
+    query = products[in_stock[0]]["name"].split()[0][:4]
+    checkout_seq = iter(range(10 ** 9))
+
+    def checkout():
+        n = next(checkout_seq)
+        cart = {pid: {"name": products[pid]["name"], "price": products[pid]["batches"][0]["price"], "qty": 1}
+                for pid in rng.sample(in_stock, 5)}
+        resp = client.post("/checkout", data={"cart": json.dumps(cart), "name": "Bench", "phone": "01000000000"},
+                           headers={"X-Forwarded-For": f"10.9.{n >> 8 & 255}.{n & 255}"})
+        if resp.status_code != 200 or "رقم الطلب".encode() not in resp.data:
+            raise RuntimeError("checkout was not accepted")
+
+    def cart_products():
+        cart = {pid: rng.randint(1, 3) for pid in rng.sample(in_stock, 20)}
+        return copy.deepcopy({pid: products[pid] for pid in cart}), cart
+
+    def cold(clear, fn):
+        """``fn`` timed after an untimed ``clear()``."""
+        return (lambda _: fn()), clear
+
+    # name -> (fn, setup or None); setup runs untimed before each round
+    cases = {
+        "load_data.cold": cold(lambda: A.invalidate_data_cache(A.PRODUCTS_FILE),
+                               lambda: A.load_data(A.PRODUCTS_FILE)),
+        "load_data.warm": (lambda: A.load_data(A.PRODUCTS_FILE), None),
+        "save_data": (lambda: A.save_data(A.PRODUCTS_FILE, A.load_data(A.PRODUCTS_FILE)), None),
+        "allocate": (lambda args: A.allocate(*args), cart_products),
+        "checkout": (checkout, None),
+        "admin_profits": (get("/admin/profits"), None),
+        "admin_expiring": (get("/admin/expiring?days=30"), None),
+        "stock_overview": (get("/admin/stock_overview"), None),
+        "invoice.cold": cold(A.invoice_cache.clear, get(f"/invoice/{completed}")),
+        "invoice.warm": (get(f"/invoice/{completed}"), None),
+        "api_products": cold(A.page_cache.clear, get(f"/api/products?q={query}&status=in")),
+    }
+    results = {}
+    for name, (fn, setup) in cases.items():
+        if only and not any(part in name for part in only):
+            continue
+        results[name] = measure(fn, rounds, setup=setup)
+        r = results[name]
+        print(f"  {name:18s} median {r['median'] * 1e3:9.3f} ms   min {r['min'] * 1e3:9.3f} ms")
+    return results
+
+
+def compare(results, meta, baseline_path, fail_above):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline['meta']['commit']}):")
+    for field in ("backend", "scale"):
+        if baseline["meta"].get(field) != meta[field]:
+            print(f"  warning: {field} differs ({baseline['meta'].get(field)} vs {meta[field]})")
+    regressions = []
+    for name, r in results.items():
+        old = baseline["results"].get(name)
+        if not old:
+            continue
+        ratio = r["median"] / old["median"] if old["median"] else float("inf")
+        flag = "  REGRESSION" if ratio > fail_above else ""
+        print(f"  {name:18s} {old['median'] * 1e3:9.3f} -> {r['median'] * 1e3:9.3f} ms  x{ratio:5.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skus", type=int, default=2000)
+    parser.add_argument("--batches", type=int, default=10)
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--rounds", type=int, default=15)
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--only", nargs="*", help="run only cases whose name contains one of these")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>-<backend>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--fail-above", type=float, default=1.2, help="median ratio counted as a regression")
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="pharmacy-bench-")
+    start = time.perf_counter()
+    products, orders = generate(data_dir, args.skus, args.batches, args.orders, seed=args.seed)
+    pharmacy_app = load_app(data_dir, args.backend)
+    if args.backend == "sqlite":
+        pharmacy_app.import_json(pharmacy_app.storage, products, orders)
+    print(f"{args.skus} SKUs x <={args.batches} batches, {args.orders} orders ({args.backend}), "
+          f"setup {time.perf_counter() - start:.1f} s, data in {data_dir}")
+
+    results = run_cases(pharmacy_app, products, orders, args.rounds, random.Random(args.seed), args.only)
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "backend": args.backend,
+            "scale": {"skus": args.skus, "batches": args.batches, "orders": args.orders, "seed": args.seed},
+            "rounds": args.rounds,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}-{args.backend}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        return 1 if compare(results, report["meta"], args.compare, args.fail_above) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
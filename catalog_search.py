@@ -0,0 +1,135 @@
+"""Product name search: normalized tokens in an inverted index with prefix matching.
+
+Names are folded before indexing so that the spellings customers actually
+type still match:
+
+  - case, Latin accents and Arabic diacritics (tashkeel, tatweel) are dropped
+  - hamza forms of alef/waw/yeh, alef maqsura and teh marbuta are unified
+  - Arabic-Indic digits become ASCII digits
+  - letters and digits are split ("500mg" -> "500", "mg")
+  - words starting with the article "ال" are also indexed without it
+
+A query matches a product when every query token is a prefix of one of the
+product's terms, so "بناد 500" finds "البنادول 500 مجم"-style names as the
+customer types.
+"""
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+_FOLD = str.maketrans({
+    "ٱ": "ا",
+    "ى": "ي",
+    "ة": "ه",
+    "ـ": None,  # tatweel
+    **{chr(0x0660 + d): str(d) for d in range(10)},  # Arabic-Indic digits
+    **{chr(0x06F0 + d): str(d) for d in range(10)},  # Eastern Arabic-Indic digits
+})
+_TOKEN = re.compile(r"[^\W\d_]+|\d+")
+_END = "\U0010ffff"
+
+
+def normalize(text):
+    """Folded form of ``text`` used for indexing, queries and sorting."""
+    # NFKD splits presentation forms and hamza/madda carriers (أ -> ا + hamza)
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.casefold().translate(_FOLD)
+
+
+def _strip_article(token):
+    return token[2:] if token.startswith("ال") and len(token) > 3 else token
+
+
+def index_terms(name):
+    """The set of terms a product name is indexed under."""
+    terms = set()
+    for token in _TOKEN.findall(normalize(name)):
+        terms.add(token)
+        terms.add(_strip_article(token))
+    return terms
+
+
+def query_tokens(query):
+    """Prefixes a name must all match for ``query`` (empty: match everything)."""
+    return [_strip_article(token) for token in _TOKEN.findall(normalize(query))]
+
+
+def prefix_range(prefix):
+    """(low, high) bounds of the terms starting with ``prefix``."""
+    return prefix, prefix + _END
+
+
+class CatalogIndex:
+    """Inverted index (term -> pids) over the names of an in-memory catalog.
+
+    Like Inventory it belongs to one catalog object: a different object
+    (the file was reloaded) rebuilds it, and writes made in this process
+    call update() for the products they changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self._terms = []      # sorted distinct terms, for prefix ranges
+        self._postings = {}   # term -> set of pids
+        self._by_pid = {}     # pid -> terms
+
+    def _add(self, pid, name, keep_sorted=True):
+        terms = index_terms(name)
+        self._by_pid[pid] = terms
+        for term in terms:
+            pids = self._postings.get(term)
+            if pids is None:
+                pids = self._postings[term] = set()
+                if keep_sorted:
+                    insort(self._terms, term)
+            pids.add(pid)
+
+    def _remove(self, pid):
+        for term in self._by_pid.pop(pid, ()):
+            pids = self._postings[term]
+            pids.discard(pid)
+            if not pids:
+                del self._postings[term]
+                del self._terms[bisect_left(self._terms, term)]
+
+    def _sync(self, products):
+        if products is not self._source:
+            self._postings, self._by_pid = {}, {}
+            for pid, product in products.items():
+                self._add(pid, product.get("name"), keep_sorted=False)
+            self._terms = sorted(self._postings)
+            self._source = products
+
+    def _prefixed(self, prefix):
+        low, high = prefix_range(prefix)
+        found = set()
+        for term in self._terms[bisect_left(self._terms, low):bisect_left(self._terms, high)]:
+            found |= self._postings[term]
+        return found
+
+    def search(self, products, query):
+        """pids whose name matches ``query``, in catalog order."""
+        tokens = query_tokens(query)
+        if not tokens:
+            return list(products)
+        with self._lock:
+            self._sync(products)
+            matches = None
+            for token in sorted(tokens, key=len, reverse=True):  # longest prefix: smallest set first
+                found = self._prefixed(token)
+                matches = found if matches is None else matches & found
+                if not matches:
+                    return []
+        return [pid for pid in products if pid in matches]
+
+    def update(self, products, pids):
+        with self._lock:
+            if products is not self._source:
+                return  # rebuilt on the next search anyway
+            for pid in pids:
+                self._remove(pid)
+                if pid in products:
+                    self._add(pid, products[pid].get("name"))
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+
+
+class DataFileError(ValueError):
+    """A data file exists but does not hold valid JSON."""
+
+
+class DataCache:
+    """Keep parsed JSON data files in memory, revalidated by mtime and size.
+
+    Every lookup costs one os.stat(); the file is only re-read and re-parsed
+    when its (inode, mtime, size) signature changed, e.g. because another
+    worker process wrote it.  Objects handed out are shared with the cache,
+    so callers that mutate them must persist the change through store().
+
+    ``on_read(path, nbytes, seconds)``, if given, is called after every
+    actual read and parse (cache misses), e.g. to record metrics.
+    """
+
+    def __init__(self, on_read=None):
+        self.on_read = on_read
+        self._entries = {}  # path -> (signature, data)
+        self._versions = {}  # path -> (signature, version number)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def load(self, path):
+        """Return the parsed contents of ``path`` ({} if it does not exist).
+
+        A file that exists but cannot be parsed raises DataFileError instead
+        of looking empty, so a caller never saves over data it failed to read.
+        """
+        sig = self._signature(path)
+        if sig is None:
+            with self._lock:
+                self._entries.pop(path, None)
+                self.misses += 1
+            return {}
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == sig:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        start = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                raise DataFileError(f"{path} is not valid JSON: {e}") from e
+        if self.on_read is not None:
+            self.on_read(path, sig[2], time.perf_counter() - start)
+
+        with self._lock:
+            self._entries[path] = (sig, data)
+        return data
+
+    def store(self, path, data):
+        """Record ``data`` as the current contents of ``path`` after a write."""
+        sig = self._signature(path)
+        with self._lock:
+            if sig is None:
+                self._entries.pop(path, None)
+            else:
+                self._entries[path] = (sig, data)
+
+    def version(self, path):
+        """Number that goes up whenever ``path`` changes on disk.
+
+        save_data() replaces the file, so every save (from any process)
+        gives it a new signature; the first lookup that sees it bumps the
+        number.  Costs one os.stat().
+        """
+        sig = self._signature(path)
+        with self._lock:
+            seen, number = self._versions.get(path, (None, 0))
+            if sig != seen:
+                number += 1
+                self._versions[path] = (sig, number)
+            return number
+
+    def invalidate(self, path=None):
+        """Drop one cached file, or everything when ``path`` is None.
+
+        Also moves the file's version on: the dropped object may have been
+        changed in memory without being saved.
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+            for p, (_, number) in self._versions.items():
+                if path is None or p == path:
+                    self._versions[p] = (None, number)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "entries": len(self._entries),
+            }
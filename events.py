@@ -0,0 +1,247 @@
+"""Server-Sent Events: an event log shared by the worker processes and a fan-out hub.
+
+publish() appends an event (channel, type, JSON data) to a table in its
+own SQLite file, so an order placed in one worker process reaches admin
+screens connected to another.  Each process runs one EventHub thread that
+reads the new rows (one indexed query per ``poll`` seconds, or right away
+after a local publish) and hands each event to the streams subscribed to
+its channel; an idle stream costs a blocked thread and a small queue, not
+a query of its own.
+
+Event ids are the row ids, so a browser that reconnects with
+Last-Event-ID gets what it missed replayed from the table.  A stream that
+falls ``queue_size`` events behind is closed instead of buffering without
+bound; the browser reconnects and catches up the same way.
+
+Requests hand their publishing to defer(): one publisher thread per
+process runs it (and any lookups it needs) after the response is on its
+way, in the order it was deferred.
+
+Channels: "admin" (new orders, status changes, stock and expiry alerts),
+"order:<order_id>" (that order's status, for the tracking page) and
+"export:<export_id>" (progress of a bulk invoice export, read with latest()).
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from storage import open_wal
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+REPLAY_LIMIT = 500
+
+
+def format_event(event_id, event_type, data):
+    """One SSE message."""
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class Subscriber:
+    """Events of one channel waiting to be written to one open stream."""
+
+    __slots__ = ("channel", "queue", "last_id", "overflowed")
+
+    def __init__(self, channel, last_id, queue_size):
+        self.channel = channel
+        self.queue = queue.Queue(queue_size)
+        self.last_id = last_id
+        self.overflowed = False
+
+    def offer(self, event):
+        if self.overflowed or event[0] <= self.last_id:
+            return
+        try:
+            self.queue.put_nowait(event)
+            self.last_id = event[0]
+        except queue.Full:
+            self.overflowed = True  # the stream closes on its next get()
+
+    def get(self, timeout):
+        """The next (id, type, data), or None after ``timeout`` seconds.  Raises EOFError once overflowed."""
+        if self.overflowed:
+            raise EOFError
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventHub:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel TEXT NOT NULL,
+        type TEXT NOT NULL,
+        data TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_events_channel ON events(channel, id);
+    """
+
+    def __init__(self, path, poll=0.5, keep=24 * 3600, queue_size=100):
+        self.path = path
+        self.poll = poll
+        self.keep = keep
+        self.queue_size = queue_size
+        self._local = threading.local()
+        self._subscribers = {}  # channel -> set of Subscriber
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._last_prune = 0.0
+        self._deferred = queue.SimpleQueue()
+        self._publisher = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+        self._last_id = self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = open_wal(self.path)
+            self._local.conn = conn
+        return conn
+
+    def publish(self, channel, event_type, data):
+        """Append an event for every process's subscribers of ``channel``; returns its id."""
+        cur = self._conn().execute(
+            "INSERT INTO events (channel, type, data, created_at) VALUES (?, ?, ?, ?)",
+            (channel, event_type, json.dumps(data, ensure_ascii=False), time.time()),
+        )
+        self.published += 1
+        self._wakeup.set()
+        if time.time() - self._last_prune > 3600:
+            self._last_prune = time.time()
+            self._conn().execute("DELETE FROM events WHERE created_at < ?", (time.time() - self.keep,))
+        return cur.lastrowid
+
+    def latest(self, channel):
+        """Data of the newest event on ``channel`` (any process), or None."""
+        row = self._conn().execute("SELECT data FROM events WHERE channel = ? ORDER BY id DESC LIMIT 1",
+                                   (channel,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def defer(self, fn, *args):
+        """Run ``fn(*args)`` (which publishes) on the publisher thread instead of the caller's."""
+        self._deferred.put((fn, args))
+        if self._publisher is None:
+            with self._lock:
+                if self._publisher is None:
+                    self._publisher = threading.Thread(target=self._publish_deferred, name="event-publisher",
+                                                       daemon=True)
+                    self._publisher.start()
+
+    def _publish_deferred(self):
+        while True:
+            fn, args = self._deferred.get()
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("Event publishing failed")
+
+    def subscribe(self, channel, last_event_id=None):
+        """Open a Subscriber; with ``last_event_id``, events after it are replayed first."""
+        # under the lock the hub cannot dispatch: events up to _last_id are replayed
+        # here, later ones reach the subscriber through the hub, none twice
+        with self._lock:
+            if last_event_id is None:
+                # a new stream starts at the newest event, dispatched or not
+                newest = self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+                sub = Subscriber(channel, max(newest, self._last_id), self.queue_size)
+            else:
+                sub = Subscriber(channel, last_event_id, self.queue_size)
+                rows = self._conn().execute(
+                    "SELECT id, type, data FROM events WHERE channel = ? AND id > ? AND id <= ? ORDER BY id LIMIT ?",
+                    (channel, last_event_id, self._last_id, REPLAY_LIMIT),
+                ).fetchall()
+                for event_id, event_type, data in rows:
+                    sub.offer((event_id, event_type, json.loads(data)))
+                sub.last_id = self._last_id
+            self._subscribers.setdefault(channel, set()).add(sub)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+                self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.channel)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.channel]
+
+    def _dispatch(self):
+        rows = self._conn().execute(
+            "SELECT id, channel, type, data FROM events WHERE id > ? ORDER BY id LIMIT 1000", (self._last_id,)
+        ).fetchall()
+        for event_id, channel, event_type, data in rows:
+            with self._lock:
+                self._last_id = event_id
+                subs = list(self._subscribers.get(channel, ()))
+            if not subs:
+                continue
+            event = (event_id, event_type, json.loads(data))
+            for sub in subs:
+                sub.offer(event)
+                if sub.overflowed:
+                    self.dropped += 1
+                    self.unsubscribe(sub)
+                else:
+                    self.delivered += 1
+        return len(rows)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll)
+            self._wakeup.clear()
+            try:
+                while self._dispatch() == 1000:
+                    pass
+            except Exception:
+                logger.exception("Event hub failed")
+
+    def stream(self, channel, last_event_id=None, initial=(), max_seconds=300, on_heartbeat=None):
+        """SSE body: ``initial`` [(type, data)], then the channel's events until ``max_seconds``.
+
+        ``on_heartbeat()`` may return extra [(type, data)] to send; it runs
+        whenever the stream has been idle for HEARTBEAT_SECONDS.
+        """
+        def generate():
+            sub = self.subscribe(channel, last_event_id)
+            try:
+                yield "retry: 5000\n\n"
+                for event_type, data in initial:
+                    yield f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                deadline = time.monotonic() + max_seconds
+                while time.monotonic() < deadline:
+                    try:
+                        event = sub.get(timeout=min(HEARTBEAT_SECONDS, max(deadline - time.monotonic(), 0.01)))
+                    except EOFError:
+                        return
+                    if event is not None:
+                        yield format_event(*event)
+                        continue
+                    for event_type, data in (on_heartbeat() if on_heartbeat else ()):
+                        yield f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    yield ": ping\n\n"
+            finally:
+                self.unsubscribe(sub)
+
+        return generate()
+
+    def stats(self):
+        with self._lock:
+            streams = {channel.split(":", 1)[0]: 0 for channel in self._subscribers}
+            for channel, subs in self._subscribers.items():
+                streams[channel.split(":", 1)[0]] += len(subs)
+        return {"streams": streams, "published": self.published, "delivered": self.delivered,
+                "dropped": self.dropped}
@@ -0,0 +1,168 @@
+"""Product image pipeline: content-hashed uploads, resized and WebP variants.
+
+Uploads are stored as static/uploads/<sha256 prefix>.<ext>, so the same
+picture uploaded twice is one file and a URL never changes meaning; those
+files and the variants are served with a long-lived immutable
+Cache-Control.
+
+Variants are made by ImageVariants, run as a background job: for every
+width in WIDTHS narrower than the source, a resized copy in the source
+format and a WebP copy, written as static/variants/<hash>-<width>.<ext>.  A manifest
+({image path: entry}) records what exists, so templates build srcset
+attributes from one cached JSON file instead of probing the disk.
+"""
+import hashlib
+import os
+import re
+import threading
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+WIDTHS = (160, 320, 640)
+HASH_LEN = 16
+EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+# uploads/<hash>.<ext> and variants/<hash>-<width>.<ext> never change once written
+IMMUTABLE_NAME = re.compile(r"^(uploads|variants)/[0-9a-f]{%d}(-\d+)?\.\w+$" % HASH_LEN)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LEN]
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_upload(data, upload_dir):
+    """Save uploaded image bytes as <hash>.<ext> in ``upload_dir``; return the file name.
+
+    Raises ValueError if ``data`` is not an image Pillow can read.
+    """
+    try:
+        with Image.open(BytesIO(data)) as im:
+            im.verify()
+            fmt = im.format
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise ValueError(f"not an image: {e}") from e
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"unsupported image format: {fmt}")
+
+    name = f"{content_hash(data)}.{EXTENSIONS[fmt]}"
+    path = os.path.join(upload_dir, name)
+    if not os.path.exists(path):  # same content already uploaded
+        os.makedirs(upload_dir, exist_ok=True)
+
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        _write_atomic(path, write)
+    return name
+
+
+def _save_variant(im, path, ext):
+    if ext == "jpg":
+        options = {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True}
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+    elif ext == "webp":
+        options = {"format": "WEBP", "quality": 80, "method": 4}
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA")
+    else:
+        options = {"format": "PNG" if ext == "png" else ext.upper(), "optimize": True}
+    _write_atomic(path, lambda tmp_path: im.save(tmp_path, **options))
+
+
+def make_variants(source_path, variants_dir):
+    """Write the variants of one image and return its manifest entry.
+
+    Entry: {"hash", "ext", "width", "widths"}; the resized copies exist for
+    every width in "widths", WebP copies for those and the full "width".
+    """
+    with open(source_path, "rb") as f:
+        data = f.read()
+    key = content_hash(data)
+    os.makedirs(variants_dir, exist_ok=True)
+
+    with Image.open(BytesIO(data)) as source:
+        ext = EXTENSIONS.get(source.format, "png")
+        im = ImageOps.exif_transpose(source)  # phone photos carry their rotation in EXIF
+        width, height = im.size
+        widths = [w for w in WIDTHS if w < width]
+        for w in widths + [width]:
+            small = im if w == width else im.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+            targets = ["webp"] if w == width else [ext, "webp"]
+            for target in targets:
+                path = os.path.join(variants_dir, f"{key}-{w}.{target}")
+                if not os.path.exists(path):
+                    _save_variant(small, path, target)
+    return {"hash": key, "ext": ext, "width": width, "widths": widths}
+
+
+def image_sources(image, manifest, url):
+    """{"src", "srcset", "webp_srcset"} for a product image.
+
+    ``url(path)`` turns a path under static/ into a URL.  The srcsets are
+    empty until the worker has made the variants.
+    """
+    if not image:
+        return None
+    if image.startswith(("http://", "https://")):
+        return {"src": image, "srcset": "", "webp_srcset": ""}
+    src = url(image)
+    entry = manifest.get(image)
+    if not entry:
+        return {"src": src, "srcset": "", "webp_srcset": ""}
+    stem, ext = f"variants/{entry['hash']}", entry["ext"]
+    srcset = [f"{url(f'{stem}-{w}.{ext}')} {w}w" for w in entry["widths"]]
+    srcset.append(f"{src} {entry['width']}w")
+    webp = [f"{url(f'{stem}-{w}.webp')} {w}w" for w in entry["widths"] + [entry["width"]]]
+    return {"src": src, "srcset": ", ".join(srcset), "webp_srcset": ", ".join(webp)}
+
+
+class ImageVariants:
+    """Makes the variants of product images and records them in the manifest.
+
+    The manifest is a JSON data file read and written through ``load`` /
+    ``save`` under ``lock`` (the app's DataCache and data_lock), so several
+    job workers, in any process, can update it.
+    """
+
+    def __init__(self, static_dir, manifest_file, load, save, lock):
+        self.static_dir = static_dir
+        self.variants_dir = os.path.join(static_dir, "variants")
+        self.manifest_file = manifest_file
+        self._load = load
+        self._save = save
+        self._lock = lock
+        self.processed = 0
+
+    @staticmethod
+    def local(image):
+        return bool(image) and not image.startswith(("http://", "https://"))
+
+    def missing(self, images):
+        """The local images that have no manifest entry yet."""
+        manifest = self._load(self.manifest_file) or {}
+        return sorted({image for image in images if self.local(image)} - set(manifest))
+
+    def process(self, image):
+        """Make the variants of ``image`` (path under static/); its manifest entry, None if it is gone."""
+        source = os.path.join(self.static_dir, image)
+        if not os.path.isfile(source):
+            return None
+        entry = make_variants(source, self.variants_dir)
+        with self._lock:
+            manifest = self._load(self.manifest_file) or {}
+            manifest[image] = entry
+            self._save(self.manifest_file, manifest)
+        self.processed += 1
+        return entry
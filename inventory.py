@@ -0,0 +1,184 @@
+import bisect
+import secrets
+import threading
+from datetime import date
+from functools import lru_cache
+
+
+def ensure_purchase_price(batch):
+    """Guarantee a purchase_price key exists on a batch."""
+    if "purchase_price" not in batch:
+        batch["purchase_price"] = float(batch.get("price", 0))
+    return batch
+
+
+def ensure_batch_id(product, batch):
+    """Give ``batch`` a batch_id unique within ``product`` and return it."""
+    if not batch.get("batch_id"):
+        taken = {b.get("batch_id") for b in product.get("batches", [])}
+        batch_id = secrets.token_hex(4)
+        while batch_id in taken:
+            batch_id = secrets.token_hex(4)
+        batch["batch_id"] = batch_id
+    return batch["batch_id"]
+
+
+def find_batch(product, batch_id):
+    return next((b for b in product.get("batches", []) if b.get("batch_id") == batch_id), None)
+
+
+def fefo_key(batch):
+    """First-Expiry-First-Out sort key (batches without a date sort first)."""
+    return batch.get("expiry_date") or ""
+
+
+def order_batches(product):
+    """Keep a product's batches in FEFO order, in place.
+
+    The batches are stored in FEFO order, so this is a single comparison
+    pass and only sorts (stably) data that was edited out of order by hand.
+    """
+    batches = product.setdefault("batches", [])
+    keys = [fefo_key(b) for b in batches]
+    if any(a > b for a, b in zip(keys, keys[1:])):
+        batches.sort(key=fefo_key)
+    return batches
+
+
+@lru_cache(maxsize=8192)
+def expiry_ordinal(expiry_date):
+    """Parsed expiry date (YYYY-MM-DD) as a day ordinal, or None if missing/invalid."""
+    try:
+        return date.fromisoformat(expiry_date).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def insert_batch(product, batch):
+    """Insert ``batch`` at its FEFO position and return that index."""
+    batches = order_batches(product)
+    ensure_batch_id(product, batch)
+    index = bisect.bisect_right(batches, fefo_key(batch), key=fefo_key)
+    batches.insert(index, batch)
+    return index
+
+
+class StockSummary:
+    """Running stock totals for one product."""
+
+    __slots__ = ("total_qty", "nearest_expiry", "cost_value")
+
+    def __init__(self, total_qty=0, nearest_expiry="", cost_value=0.0):
+        self.total_qty = total_qty
+        self.nearest_expiry = nearest_expiry
+        self.cost_value = cost_value
+
+    @classmethod
+    def of(cls, product):
+        total_qty, nearest, cost_value = 0, "", 0.0
+        for b in product.get("batches", []):
+            qty = int(b.get("quantity", 0))
+            total_qty += qty
+            cost_value += qty * float(b.get("purchase_price", b.get("price", 0)))
+            expiry = b.get("expiry_date") or ""
+            if expiry and (not nearest or expiry < nearest):
+                nearest = expiry
+        return cls(total_qty, nearest, cost_value)
+
+    @property
+    def weighted_cost(self):
+        """Average purchase price of the units in stock."""
+        return self.cost_value / self.total_qty if self.total_qty else 0.0
+
+
+class ExpiryIndex:
+    """Every dated batch of a catalog, ordered by expiry date.
+
+    Entries are (expiry ordinal, pid, batch position) tuples in one sorted
+    list, so "expiring on or before day X" is a bisect and a slice.
+    Replacing one product's entries is a bisect per batch.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._by_pid = {}  # pid -> its entries
+
+    def rebuild(self, products):
+        self._by_pid = {pid: self._entries_of(pid, p) for pid, p in products.items()}
+        self._entries = sorted(e for entries in self._by_pid.values() for e in entries)
+
+    @staticmethod
+    def _entries_of(pid, product):
+        entries = []
+        for position, batch in enumerate(product.get("batches", [])):
+            ordinal = expiry_ordinal(batch.get("expiry_date"))
+            if ordinal is not None:
+                entries.append((ordinal, pid, position))
+        return entries
+
+    def update(self, pid, product):
+        """Re-index one product (``product`` None when it was deleted)."""
+        for entry in self._by_pid.pop(pid, []):
+            del self._entries[bisect.bisect_left(self._entries, entry)]
+        if product is not None:
+            entries = self._entries_of(pid, product)
+            for entry in entries:
+                bisect.insort(self._entries, entry)
+            self._by_pid[pid] = entries
+
+    def until(self, last_ordinal):
+        """Entries expiring on or before ``last_ordinal``, soonest first."""
+        return self._entries[:bisect.bisect_left(self._entries, (last_ordinal + 1,))]
+
+
+class Inventory:
+    """StockSummary per product and an ExpiryIndex, kept in step with an
+    in-memory catalog.
+
+    Both belong to one catalog object (the cached products dict).  When the
+    cache hands out a different object, because another worker rewrote the
+    file, they are rebuilt once (and every product's batches are put in
+    FEFO order); writes made in this process call update() for just the
+    products they changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self._levels = {}
+        self._expiry = ExpiryIndex()
+
+    def _sync(self, products):
+        if products is not self._source:
+            for p in products.values():
+                order_batches(p)
+            self._levels = {pid: StockSummary.of(p) for pid, p in products.items()}
+            self._expiry.rebuild(products)
+            self._source = products
+
+    def levels(self, products):
+        with self._lock:
+            self._sync(products)
+            return self._levels
+
+    def expiring(self, products, last_ordinal):
+        """[(pid, batch, expiry ordinal)] for batches expiring on or before ``last_ordinal``."""
+        with self._lock:
+            self._sync(products)
+            found = []
+            for ordinal, pid, position in self._expiry.until(last_ordinal):
+                batches = products[pid].get("batches", [])
+                if position < len(batches):  # skip a product being edited in place
+                    found.append((pid, batches[position], ordinal))
+            return found
+
+    def update(self, products, pids):
+        with self._lock:
+            if products is not self._source:
+                return  # rebuilt on the next levels() call anyway
+            for pid in pids:
+                if pid in products:
+                    self._levels[pid] = StockSummary.of(products[pid])
+                else:
+                    self._levels.pop(pid, None)
+                self._expiry.update(pid, products.get(pid))
@@ -0,0 +1,209 @@
+"""PDF invoices: rendering plus a size-bounded cache of finished files.
+
+A completed order never changes, so its invoice is rendered once and the
+bytes are kept, keyed by order_id and a hash of everything printed on it
+(the order, the pharmacy settings and RENDER_VERSION).  The same hash is
+the response ETag, so a browser that already has the file gets a 304
+without the PDF being rendered or even looked up.
+"""
+import hashlib
+import json
+from datetime import datetime, timezone
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+from arabic_reshaper import reshape
+from bidi.algorithm import get_display
+from fpdf import FPDF
+
+from lru import BoundedLRU
+
+# Bump when the layout below changes so cached invoices and ETags are refreshed
+RENDER_VERSION = 1
+
+SETTINGS_FIELDS = ("name", "address", "phone", "license", "tax_number", "footer")
+
+# Fixed labels printed on every invoice
+TITLE = "فاتورة بيع"
+SEPARATOR = "-----------------------------------------"
+COLUMN_HEADERS = ("الإجمالي", "السعر", "الكمية", "المنتج")
+
+# Distinct strings kept shaped; product names and settings repeat across invoices
+RTL_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=RTL_CACHE_SIZE)
+def _shape(text):
+    return get_display(reshape(text))
+
+
+def rtl(text):
+    """Shape Arabic ``text`` for the PDF (joined letters, visual RTL order)."""
+    if not text:
+        return ""
+    return _shape(text)
+
+
+def rtl_cache_stats():
+    info = _shape.cache_info()
+    total = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": (info.hits / total) if total else 0.0,
+        "entries": info.currsize,
+        "max_entries": info.maxsize,
+    }
+
+
+def header_lines(settings):
+    """The pharmacy lines at the top of every invoice, before shaping."""
+    return [
+        settings.get("name", ""),
+        f"العنوان: {settings.get('address','')}",
+        f"هاتف: {settings.get('phone','')}",
+        f"ترخيص مهني: {settings.get('license','')}",
+        f"الرقم الضريبي: {settings.get('tax_number','')}",
+    ]
+
+
+_preshaped_settings = None
+
+
+def preshape(settings):
+    """Shape the fixed labels and the settings lines ahead of the first render.
+
+    Cheap to call on every request: it only does work when ``settings`` is
+    a different object, i.e. pharmacy.json was (re)loaded.
+    """
+    global _preshaped_settings
+    if settings is _preshaped_settings:
+        return
+    for text in (TITLE, SEPARATOR, *COLUMN_HEADERS, *header_lines(settings), settings.get("footer", "")):
+        rtl(text)
+    _preshaped_settings = settings
+
+
+def invoice_hash(order, settings):
+    """Hash of every input that ends up in the rendered PDF."""
+    payload = json.dumps(
+        [RENDER_VERSION, order, {k: settings.get(k, "") for k in SETTINGS_FIELDS}],
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def qr_png(text):
+    """QR code for ``text`` as an in-memory PNG."""
+    buf = BytesIO()
+    qrcode.make(text).save(buf)
+    buf.seek(0)
+    return buf
+
+
+def render_invoice(order, settings, font_path):
+    """Return the invoice PDF for ``order`` as bytes.
+
+    Everything printed comes from ``order`` and ``settings`` (the date is
+    the order's created_at), so the same inputs always give the same file.
+    Raises RuntimeError/FileNotFoundError if the Arabic font is missing.
+    """
+    order_id = order["order_id"]
+
+    # إعداد PDF
+    pdf = FPDF()
+    pdf.add_page()
+
+    # إضافة خط عربي
+    pdf.add_font("Amiri", "", font_path)
+
+    pdf.set_font("Amiri", "", 16)
+
+    # -------------------------------
+    #   رأس الفاتورة
+    # -------------------------------
+    name_line, *detail_lines = header_lines(settings)
+    pdf.set_font("Amiri", "", 20)
+    pdf.cell(0, 10, rtl(name_line), ln=True, align="R")
+
+    pdf.set_font("Amiri", "", 12)
+    for line in detail_lines:
+        pdf.cell(0, 8, rtl(line), ln=True, align="R")
+
+    pdf.ln(5)
+    pdf.set_font("Amiri", "", 16)
+    pdf.cell(0, 10, rtl(TITLE), ln=True, align="C")
+
+    pdf.ln(5)
+    pdf.set_font("Amiri", "", 14)
+
+    # -------------------------------
+    #   تفاصيل الفاتورة
+    # -------------------------------
+    pdf.cell(0, 8, rtl(f"رقم الفاتورة: {order_id}"), ln=True, align="R")
+    pdf.cell(0, 8, rtl(f"العميل: {order['name']}"), ln=True, align="R")
+    pdf.cell(0, 8, rtl(f"الهاتف: {order['phone']}"), ln=True, align="R")
+    pdf.cell(0, 8, rtl(f"التاريخ: {order.get('created_at', '')[:16]}"), ln=True, align="R")
+
+    pdf.ln(5)
+    pdf.cell(0, 8, rtl(SEPARATOR), ln=True, align="C")
+
+    # -------------------------------
+    #   جدول العناصر
+    # -------------------------------
+    pdf.set_font("Amiri", "", 14)
+    for width, header in zip((60, 40, 30, 60), COLUMN_HEADERS):
+        pdf.cell(width, 8, rtl(header), border=1, ln=(header == COLUMN_HEADERS[-1]), align="C")
+
+    total = 0
+    for pid, item in order["items"].items():
+        qty = int(item["qty"])
+        price = float(item["price"])
+        subtotal = qty * price
+        total += subtotal
+
+        pdf.cell(60, 8, rtl(str(subtotal)), border=1, align="C")
+        pdf.cell(40, 8, rtl(str(price)), border=1, align="C")
+        pdf.cell(30, 8, rtl(str(qty)), border=1, align="C")
+        pdf.cell(60, 8, rtl(item["name"]), border=1, ln=True, align="C")
+
+    pdf.ln(5)
+    pdf.set_font("Amiri", "", 16)
+    pdf.cell(0, 10, rtl(f"الإجمالي الكلي: {total} جنيه"), ln=True, align="R")
+
+    # -------------------------------
+    #   QR Code
+    # -------------------------------
+    qr_text = f"Invoice: {order_id}\nTotal: {total}\nCustomer: {order['name']}"
+    pdf.image(qr_png(qr_text), x=10, y=pdf.get_y() + 10, w=35)
+
+    # -------------------------------
+    #   الفوتر
+    # -------------------------------
+    pdf.ln(40)
+    pdf.set_font("Amiri", "", 12)
+    pdf.cell(0, 10, rtl(settings.get("footer", "")), ln=True, align="C")
+
+    # date the file with the order itself so identical inputs give identical bytes
+    pdf.set_creation_date(_order_date(order))
+    return bytes(pdf.output())
+
+
+def _order_date(order):
+    try:
+        created = datetime.strptime(order.get("created_at", ""), "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        created = datetime(2000, 1, 1)
+    return created.replace(tzinfo=timezone.utc)
+
+
+class InvoiceCache(BoundedLRU):
+    """In-memory LRU of rendered invoices, bounded by total size in bytes.
+
+    Keys are (order_id, invoice_hash); a changed order or changed settings
+    produce a new key and the stale entry ages out.
+    """
+
+    def __init__(self, max_bytes=32 << 20):
+        super().__init__(max_bytes)
@@ -0,0 +1,100 @@
+"""Bulk invoice export: render many invoices in a process pool and stream a ZIP.
+
+Rendering is CPU-bound (font subsetting, Arabic shaping), so the PDFs are
+made by worker processes with the same render_invoice() the /invoice route
+uses.  Only a small window of PDFs is in flight at any time and each one is
+written to the archive and handed to the caller as soon as it arrives, so
+memory use does not grow with the number of invoices.
+"""
+import io
+import multiprocessing
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from invoice import render_invoice
+
+
+def select_orders(orders, date_from=None, date_to=None, status=None):
+    """Orders created within [date_from, date_to] (YYYY-MM-DD, inclusive)."""
+    selected = []
+    for order in orders:
+        day = (order.get("created_at") or "")[:10]
+        if date_from and day < date_from:
+            continue
+        if date_to and day > date_to:
+            continue
+        if status is not None and order.get("status") != status:
+            continue
+        selected.append(order)
+    selected.sort(key=lambda o: o.get("created_at") or "")
+    return selected
+
+
+def _render(args):
+    order, settings, font_path = args
+    return render_invoice(order, settings, font_path)
+
+
+def render_many(orders, settings, font_path, workers=None):
+    """Yield (order, pdf bytes) in order, rendering up to ``workers`` (at most one per CPU) at a time."""
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(workers or cpus, cpus))
+    if workers == 1 or len(orders) <= 1:
+        for order in orders:
+            yield order, render_invoice(order, settings, font_path)
+        return
+
+    # spawn, not fork: the web process has threads (sweeper, request threads) running
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        pending = deque()
+        todo = iter(orders)
+        for order in todo:
+            pending.append((order, pool.submit(_render, (order, settings, font_path))))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            order, future = pending.popleft()
+            pdf = future.result()
+            nxt = next(todo, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(_render, (nxt, settings, font_path))))
+            yield order, pdf
+
+
+class _Chunks(io.RawIOBase):
+    """Write-only sink that collects what zipfile writes until take() is called."""
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_invoice_zip(orders, settings, font_path, workers=None, progress=None):
+    """Yield the bytes of a ZIP holding invoice_<order_id>.pdf for each order.
+
+    ``progress(done, total)`` is called after every invoice written.
+    """
+    sink = _Chunks()
+    total = len(orders)
+    # PDFs are already compressed (deflated streams): store them as-is
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+        for done, (order, pdf) in enumerate(render_many(orders, settings, font_path, workers), 1):
+            archive.writestr(f"invoice_{order['order_id']}.pdf", pdf)
+            if progress is not None:
+                progress(done, total)
+            yield sink.take()
+    yield sink.take()
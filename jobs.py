@@ -0,0 +1,312 @@
+"""Persistent background jobs: a SQLite job table worked by a pool of threads.
+
+Side work that should not hold up a request (image variants, rollup
+rebuilds, journal compaction) is submitted as a job: a row with a kind, a
+JSON payload and a status.  Worker threads claim due jobs, run the handler
+registered for the kind and record the outcome:
+
+    queued -> running -> done
+                      -> queued again after a failure, retried with exponential backoff
+                      -> failed once max_attempts are used up
+
+The table lives in its own database file, so queued work survives a
+restart and several processes can work the same queue: a job is claimed
+in a BEGIN IMMEDIATE transaction and holds a lease of ``lease`` seconds.
+While the handler runs, a heartbeat thread renews the lease of every job
+this process is running, so a long rollup rebuild is never claimed twice;
+a job whose lease ran out (its process died) is claimed again.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+from storage import open_wal
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("queued", "running", "done", "failed")
+
+
+class JobQueue:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        dedupe_key TEXT,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        run_after REAL NOT NULL,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        heartbeat_at REAL,
+        finished_at REAL,
+        worker TEXT,
+        last_error TEXT,
+        result TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(status, run_after);
+    CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(kind, dedupe_key);
+    """
+
+    def __init__(self, path, threads=2, poll=1.0, lease=120, backoff=5, keep_finished=7 * 86400):
+        self.path = path
+        self.threads = threads
+        self.poll = poll
+        self.lease = lease
+        self.backoff = backoff
+        self.keep_finished = keep_finished
+        self._handlers = {}  # kind -> (fn, max_attempts)
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._stop_event = threading.Event()
+        self._workers = []
+        self._running = {}  # job id -> worker, for the jobs this process is running
+        self._running_lock = threading.Lock()
+        self._heartbeat = None
+        self._last_purge = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = open_wal(self.path, row_factory=sqlite3.Row)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, run):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = run(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    # ---------- producers ----------
+    def task(self, kind, max_attempts=3):
+        """Register the decorated ``fn(payload)`` as the handler of ``kind`` jobs."""
+        def decorator(fn):
+            self._handlers[kind] = (fn, max_attempts)
+            return fn
+        return decorator
+
+    def submit(self, kind, payload=None, dedupe_key=None, delay=0, max_attempts=None):
+        """Queue a job; returns its id.
+
+        With ``dedupe_key``, a job of the same kind and key that is still
+        queued or running is returned instead of queueing a second one.
+        """
+        if max_attempts is None:
+            max_attempts = self._handlers.get(kind, (None, 3))[1]
+        now = time.time()
+
+        def insert(conn):
+            if dedupe_key is not None:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE kind = ? AND dedupe_key = ? AND status IN ('queued', 'running')",
+                    (kind, dedupe_key),
+                ).fetchone()
+                if row:
+                    return row["id"]
+            cur = conn.execute(
+                "INSERT INTO jobs (kind, payload, dedupe_key, status, max_attempts, run_after, created_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (kind, json.dumps(payload or {}, ensure_ascii=False), dedupe_key, max_attempts, now + delay, now),
+            )
+            return cur.lastrowid
+
+        job_id = self._transaction(insert)
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def retry(self, job_id):
+        """Queue a failed job again with a fresh set of attempts."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = 'queued', attempts = 0, run_after = ?, last_error = NULL "
+            "WHERE id = ? AND status = 'failed'",
+            (time.time(), job_id),
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return cur.rowcount == 1
+
+    # ---------- workers ----------
+    def _claim(self, worker):
+        """Mark the next due job running for ``worker``; (id, kind, payload) or None."""
+        now = time.time()
+
+        def claim(conn):
+            while True:
+                row = conn.execute(
+                    "SELECT id, kind, payload, status, attempts, max_attempts FROM jobs "
+                    "WHERE (status = 'queued' AND run_after <= ?) OR (status = 'running' AND heartbeat_at <= ?) "
+                    "ORDER BY run_after, id LIMIT 1",
+                    (now, now - self.lease),
+                ).fetchone()
+                if row is None:
+                    return None
+                if row["status"] == "running" and row["attempts"] >= row["max_attempts"]:
+                    conn.execute("UPDATE jobs SET status = 'failed', finished_at = ?, last_error = ? WHERE id = ?",
+                                 (now, "worker stopped while running the job", row["id"]))
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, heartbeat_at = ?, "
+                    "worker = ? WHERE id = ?",
+                    (now, now, worker, row["id"]),
+                )
+                return row["id"], row["kind"], json.loads(row["payload"])
+
+        return self._transaction(claim)
+
+    def _beat(self):
+        """Renew the lease of the running jobs every lease / 4 seconds."""
+        while not self._stop_event.wait(self.lease / 4):
+            with self._running_lock:
+                running = list(self._running.items())
+            if not running:
+                continue
+            try:
+                now = time.time()
+                self._conn().executemany(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                    [(now, job_id, worker) for job_id, worker in running],
+                )
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+    def _run(self, worker, job_id, kind, payload):
+        with self._running_lock:
+            self._running[job_id] = worker
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+                self._heartbeat.start()
+        try:
+            return self._execute(worker, job_id, kind, payload)
+        finally:
+            with self._running_lock:
+                self._running.pop(job_id, None)
+
+    def _execute(self, worker, job_id, kind, payload):
+        """Run the handler and record the outcome, unless the job was claimed by another worker meanwhile."""
+        handler = self._handlers.get(kind)
+        try:
+            if handler is None:
+                raise LookupError(f"no handler for job kind {kind!r}")
+            result = handler[0](payload)
+        except Exception:
+            error = traceback.format_exc(limit=6)
+            now = time.time()
+
+            def record_failure(conn):
+                row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = 'running' "
+                                   "AND worker = ?", (job_id, worker)).fetchone()
+                if row is None:
+                    return 0
+                if handler is not None and row["attempts"] < row["max_attempts"]:
+                    cur = conn.execute(
+                        "UPDATE jobs SET status = 'queued', run_after = ?, last_error = ? WHERE id = ?",
+                        (now + self.backoff * 2 ** (row["attempts"] - 1), error, job_id),
+                    )
+                else:
+                    cur = conn.execute("UPDATE jobs SET status = 'failed', finished_at = ?, last_error = ? "
+                                       "WHERE id = ?", (now, error, job_id))
+                return cur.rowcount
+            if not self._transaction(record_failure):
+                logger.warning("Job %s failed in %s after its lease was taken over; outcome not recorded",
+                               job_id, worker)
+            return False
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = 'done', finished_at = ?, result = ? "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time(), json.dumps(result, ensure_ascii=False, default=str), job_id, worker),
+        )
+        if cur.rowcount == 0:
+            logger.warning("Job %s finished in %s after its lease was taken over; result not recorded",
+                           job_id, worker)
+        return True
+
+    def run_pending(self, worker=None):
+        """Run every due job in the calling thread; returns how many ran."""
+        worker = worker or f"{os.getpid()}-{threading.get_ident()}"
+        ran = 0
+        while (job := self._claim(worker)) is not None:
+            self._run(worker, *job)
+            ran += 1
+        return ran
+
+    def _work(self):
+        worker = f"{os.getpid()}-{threading.current_thread().name}"
+        while not self._stop_event.is_set():
+            try:
+                job = self._claim(worker)
+                if job is not None:
+                    self._run(worker, *job)
+                    continue
+                if time.time() - self._last_purge > 3600:
+                    self._last_purge = time.time()
+                    self.purge()
+            except Exception:
+                logger.exception("Job worker failed")
+            with self._wakeup:
+                self._wakeup.wait(self.poll)
+
+    def start(self, threads=None):
+        """Run ``threads`` (default self.threads) worker threads in all; extra calls add the difference."""
+        for i in range(len(self._workers), self.threads if threads is None else threads):
+            t = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for t in self._workers:
+            t.join(timeout)
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout)
+
+    def wait_idle(self, timeout=30):
+        """Block until nothing is queued or running (tests, CLI)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            counts = self.counts()
+            if not counts["queued"] and not counts["running"]:
+                return True
+            time.sleep(0.05)
+        return False
+
+    # ---------- admin ----------
+    def counts(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(dict.fromkeys(STATUSES, 0), **{status: n for status, n in rows})
+
+    def recent(self, status=None, limit=100):
+        """Newest jobs first, as dicts."""
+        if status:
+            rows = self._conn().execute("SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?",
+                                        (status, limit))
+        else:
+            rows = self._conn().execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        return [dict(row) for row in rows]
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def purge(self, older_than=None):
+        """Delete finished jobs older than ``older_than`` seconds (default keep_finished)."""
+        cutoff = time.time() - (self.keep_finished if older_than is None else older_than)
+        cur = self._conn().execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                                   (cutoff,))
+        return cur.rowcount
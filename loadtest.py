@@ -0,0 +1,368 @@
+"""Drive the whole app with concurrent shoppers and an admin; report latency per route.
+
+Each virtual customer runs shopping sessions until the time is up: open the
+storefront, page or search the catalog, hold items with /add_to_cart and
+/api/cart/check, and often check out, then track the order or open the
+invoice of a completed one.  Every session comes from its own client IP, so
+the real rate limits apply.  Admins meanwhile complete or cancel fresh
+orders, edit batches and list orders.
+
+Requests go through the Flask test client (in this process) or, with
+--server, over HTTP to a threaded werkzeug server started on a free local
+port.  The data is a seeded scratch copy (benchmarks/datagen.py).
+
+The report gives requests, req/s, p50/p95/p99 latency, 429s and errors
+(5xx or exceptions) per route.  Afterwards the data is checked: every
+accepted order stored exactly once, no negative batch, stock down by what
+the accepted (and not cancelled) orders took for every product the admin
+did not edit, and rollups equal to a rebuild.
+
+    python loadtest.py --users 16 --duration 30
+    python loadtest.py --server --backend sqlite --admins 2 --json report.json
+"""
+import argparse
+import http.cookiejar
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from benchmarks.datagen import generate  # noqa: E402
+from stress_checkout import ORDER_ID_RE  # noqa: E402
+
+SEARCH_TERMS = ["بارا", "فيتامين", "شراب", "Adol", "pan", "zinc", "500", "قطرة"]
+
+
+class ClientTransport:
+    """Requests through the Flask test client (keeps its own cookies)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers=None, form=None, json_body=None):
+        resp = self.client.open(path, method=method, headers=headers, data=form, json=json_body)
+        return resp.status_code, resp.get_data()
+
+
+class HttpTransport:
+    """Requests over HTTP to ``base_url`` with a cookie jar per virtual user."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, headers=None, form=None, json_body=None):
+        headers = dict(headers or {})
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class Recorder:
+    """Latencies and status codes per route for one virtual user."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def call(self, transport, route, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, body = transport.request(method, path, **kwargs)
+        except Exception as e:
+            self.latencies[route].append(time.perf_counter() - start)
+            self.statuses[route][f"exception {type(e).__name__}"] += 1
+            return None, b""
+        self.latencies[route].append(time.perf_counter() - start)
+        self.statuses[route][status] += 1
+        return status, body
+
+
+class Shared:
+    """What the virtual users learn from each other during the run."""
+
+    def __init__(self, pids, completed):
+        self.lock = threading.Lock()
+        self.pids = pids
+        self.placed = {}          # order_id -> cart, accepted checkouts
+        self.fresh = []           # order ids the admin has not looked at yet
+        self.completed = list(completed)
+        self.cancelled = set()
+        self.edited = set()       # products whose batch quantities the admin rewrote
+        self.ips = itertools.count(1)
+
+    def next_ip(self):
+        with self.lock:
+            n = next(self.ips)
+        return f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+
+
+def customer(transport, rec, shared, deadline, rng, think):
+    def pause():
+        if think:
+            time.sleep(rng.uniform(0, think))
+
+    while time.monotonic() < deadline:
+        headers = {"X-Forwarded-For": shared.next_ip()}
+        rec.call(transport, "GET /", "GET", "/", headers=headers)
+        pause()
+        if rng.random() < 0.4:
+            query = f"/api/products?q={urllib.parse.quote(rng.choice(SEARCH_TERMS))}&in_stock=1"
+        else:
+            query = f"/api/products?in_stock=1&offset={rng.choice([0, 0, 24, 48])}"
+        status, body = rec.call(transport, "GET /api/products", "GET", query, headers=headers)
+        cards = json.loads(body)["products"] if status == 200 else []
+        cards = [c for c in cards if c["stock"] > 0 and c["price"] is not None]
+        pause()
+
+        if cards:
+            picked = rng.sample(cards, min(rng.randint(1, 3), len(cards)))
+            cart = {c["pid"]: {"name": c["name"], "price": c["price"], "qty": rng.randint(1, 2)} for c in picked}
+            for pid, item in cart.items():
+                rec.call(transport, "GET /add_to_cart", "GET", f"/add_to_cart/{pid}?qty={item['qty']}",
+                         headers=headers)
+            status, body = rec.call(transport, "POST /api/cart/check", "POST", "/api/cart/check", headers=headers,
+                                    json_body={"items": {pid: item["qty"] for pid, item in cart.items()}})
+            pause()
+            if rng.random() < 0.6:
+                status, body = rec.call(transport, "POST /checkout", "POST", "/checkout", headers=headers, form={
+                    "cart": json.dumps(cart), "name": "Load test", "phone": "01000000000"})
+                match = ORDER_ID_RE.search(body.decode("utf-8", "replace")) if status == 200 else None
+                if match:
+                    with shared.lock:
+                        shared.placed[match.group(1)] = cart
+                        shared.fresh.append(match.group(1))
+                    rec.call(transport, "GET /track", "GET", f"/track/{match.group(1)}", headers=headers)
+            else:
+                # abandoned cart: most shoppers empty it, some just leave the holds to expire
+                if rng.random() < 0.7:
+                    rec.call(transport, "POST /api/cart/check", "POST", "/api/cart/check", headers=headers,
+                             json_body={"items": {}})
+
+        if rng.random() < 0.3:
+            with shared.lock:
+                order_id = rng.choice(shared.completed) if shared.completed else None
+            if order_id:
+                rec.call(transport, "GET /invoice", "GET", f"/invoice/{order_id}", headers=headers)
+        pause()
+
+
+def admin(transport, rec, shared, deadline, rng, think, storage):
+    rec.call(transport, "POST /admin", "POST", "/admin", form={"username": "admin", "password": "123"})
+    while time.monotonic() < deadline:
+        with shared.lock:
+            batch, shared.fresh = shared.fresh[:5], shared.fresh[5:]
+        for order_id in batch:
+            new_status = "ملغي" if rng.random() < 0.15 else "مكتمل"
+            status, _ = rec.call(transport, "POST /admin/update_order", "POST", f"/admin/update_order/{order_id}",
+                                 json_body={"status": new_status})
+            if status == 200:
+                with shared.lock:
+                    if new_status == "ملغي":
+                        shared.cancelled.add(order_id)
+                    else:
+                        shared.completed.append(order_id)
+
+        # re-price a batch, sending back the quantity as it is now (what the dashboard form does)
+        pid = rng.choice(shared.pids)
+        product = storage.get_product(pid)
+        if product and product["batches"]:
+            b = rng.choice(product["batches"])
+            with shared.lock:
+                shared.edited.add(pid)
+            rec.call(transport, "POST /admin/edit_product", "POST", f"/admin/edit_product/{pid}", json_body={
+                "action": "edit_batch", "batch_id": b["batch_id"], "price": b["price"],
+                "purchase_price": b["purchase_price"],
+                "quantity": b["quantity"], "expiry_date": b["expiry_date"]})
+
+        rec.call(transport, "GET /admin/api/orders", "GET", "/admin/api/orders?limit=50")
+        time.sleep(think or 0.05)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(recorders, elapsed):
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    for rec in recorders:
+        for route, values in rec.latencies.items():
+            latencies[route].extend(values)
+        for route, counts in rec.statuses.items():
+            statuses[route].update(counts)
+    report = {}
+    for route in sorted(latencies):
+        values = sorted(latencies[route])
+        counts = statuses[route]
+        report[route] = {
+            "requests": len(values),
+            "rps": len(values) / elapsed,
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1],
+            "limited": counts.get(429, 0),
+            "errors": sum(n for s, n in counts.items() if not isinstance(s, int) or s >= 500),
+            "statuses": {str(s): n for s, n in counts.items()},
+        }
+    return report
+
+
+def check_consistency(storage, initial, history_ids, shared):
+    import rollups
+
+    errors = []
+    orders = storage.load_orders()
+    products = storage.load_products()
+    stored = Counter(o["order_id"] for o in orders)
+    new_ids = set(stored) - history_ids
+    if new_ids != set(shared.placed):
+        errors.append(f"{len(set(shared.placed) - new_ids)} accepted orders missing, "
+                      f"{len(new_ids - set(shared.placed))} unexpected orders stored")
+    duplicates = [oid for oid, n in stored.items() if n > 1]
+    if duplicates:
+        errors.append(f"{len(duplicates)} order ids stored more than once")
+
+    consumed = Counter()
+    for order_id, cart in shared.placed.items():
+        if order_id not in shared.cancelled:
+            for pid, item in cart.items():
+                consumed[pid] += item["qty"]
+    for pid, product in initial.items():
+        batches = products.get(pid, {}).get("batches", [])
+        if any(int(b["quantity"]) < 0 for b in batches):
+            errors.append(f"product {pid}: negative batch quantity")
+        if pid in shared.edited:
+            continue
+        before = sum(b["quantity"] for b in product["batches"])
+        after = sum(int(b["quantity"]) for b in batches)
+        if before - after != consumed[pid]:
+            errors.append(f"product {pid}: stock dropped by {before - after}, orders took {consumed[pid]}")
+
+    if storage.get_rollups() != rollups.build(orders):
+        errors.append("rollups differ from a rebuild over the stored orders")
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=8, help="concurrent customers")
+    parser.add_argument("--admins", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--think", type=float, default=0, help="max pause between a customer's steps, seconds")
+    parser.add_argument("--server", action="store_true", help="go over HTTP to a local threaded server")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--skus", type=int, default=500)
+    parser.add_argument("--history", type=int, default=2000, help="orders already in the data")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="pharmacy-load-")
+    initial, history = generate(data_dir, args.skus, 6, args.history, seed=args.seed)
+    os.environ["PHARMACY_DATA_DIR"] = data_dir
+    os.environ["PHARMACY_STORAGE"] = args.backend
+    import app as pharmacy_app
+
+    if args.backend == "sqlite":
+        pharmacy_app.import_json(pharmacy_app.storage, initial, history)
+
+    server = None
+    if args.server:
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no access log line per request
+        server = make_server("127.0.0.1", 0, pharmacy_app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        def transport():
+            return HttpTransport(base_url)
+    else:
+        def transport():
+            return ClientTransport(pharmacy_app.app)
+
+    shared = Shared(list(initial), (o["order_id"] for o in history if o["status"] == "مكتمل"))
+    deadline = time.monotonic() + args.duration
+    recorders, threads = [], []
+    for i in range(args.users + args.admins):
+        rec = Recorder()
+        rng = random.Random(args.seed * 1000 + i)
+        if i < args.users:
+            target, extra = customer, ()
+        else:
+            target, extra = admin, (pharmacy_app.storage,)
+        recorders.append(rec)
+        threads.append(threading.Thread(target=target, args=(transport(), rec, shared, deadline, rng, args.think,
+                                                             *extra)))
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if server is not None:
+        server.shutdown()
+
+    report = summarize(recorders, elapsed)
+    total = sum(r["requests"] for r in report.values())
+    mode = "HTTP server" if args.server else "test client"
+    print(f"{args.users} customers + {args.admins} admins for {elapsed:.1f} s via {mode} ({args.backend}): "
+          f"{total} requests, {total / elapsed:.1f} req/s, {len(shared.placed)} orders placed")
+    print(f"{'route':28s} {'reqs':>7s} {'req/s':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} "
+          f"{'429':>5s} {'errors':>6s}")
+    for route, r in report.items():
+        print(f"{route:28s} {r['requests']:7d} {r['rps']:7.1f} {r['p50'] * 1e3:8.1f} {r['p95'] * 1e3:8.1f} "
+              f"{r['p99'] * 1e3:8.1f} {r['limited']:5d} {r['errors']:6d}")
+
+    pharmacy_app.invalidate_data_cache()
+    storage = pharmacy_app.make_storage(args.backend)
+    errors = check_consistency(storage, initial, {o["order_id"] for o in history}, shared)
+    errors += [f"{route}: {r['errors']} errors {r['statuses']}" for route, r in report.items() if r["errors"]]
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"users": args.users, "admins": args.admins, "duration": elapsed, "mode": mode,
+                       "backend": args.backend, "orders_placed": len(shared.placed), "routes": report,
+                       "consistency_errors": errors}, f, ensure_ascii=False, indent=2)
+
+    for e in errors:
+        print("FAIL:", e)
+    if not errors:
+        print(f"OK: no lost orders, no negative stock ({len(shared.edited)} products re-priced by the admin "
+              f"left out of the stock balance)")
+        shutil.rmtree(data_dir, ignore_errors=True)
+    else:
+        print("data left in", data_dir)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
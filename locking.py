@@ -0,0 +1,54 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to an in-process lock only
+    fcntl = None
+
+
+class FileLock:
+    """Exclusive advisory lock shared by threads and worker processes.
+
+    Threads of one process serialize on an RLock; the first acquisition in a
+    thread also takes flock() on ``path`` so other processes (e.g. gunicorn
+    workers) wait as well.  Re-entering from the same thread is allowed, so
+    a storage method can lock while already inside a transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._rlock.acquire()
+        self._depth += 1
+        if self._depth == 1 and fcntl is not None:
+            fd = None
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                if fd is not None:
+                    os.close(fd)
+                self._depth -= 1
+                self._rlock.release()
+                raise
+            self._fd = fd
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
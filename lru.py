@@ -0,0 +1,61 @@
+"""Byte-bounded LRU shared by the invoice and page caches."""
+import threading
+from collections import OrderedDict
+
+
+class BoundedLRU:
+    """In-memory LRU bounded by the total size in bytes of its values.
+
+    ``size(value)`` gives a value's size (len() by default); a value larger
+    than ``max_bytes`` on its own is not stored.
+    """
+
+    def __init__(self, max_bytes, size=len):
+        self.max_bytes = max_bytes
+        self._value_size = size
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self._value_size(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= self._value_size(old)
+            self._entries[key] = value
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self._value_size(evicted)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
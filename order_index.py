@@ -0,0 +1,118 @@
+import bisect
+import threading
+
+
+class OrderIndex:
+    """Secondary in-memory indexes over orders: phone -> ids, status -> ids.
+
+    Only ids and the few fields the admin list filters on are kept (the
+    order bodies stay on disk), so the index stays small for hundreds of
+    thousands of orders.  put() is called with every new order version and
+    moves the id between buckets when the phone or status changed; each
+    bucket lists ids in the order they joined it.
+
+    Every order also gets a sequence number the first time it is seen, i.e.
+    in the order orders were placed; page() walks those newest first, per
+    status from a list of sequence numbers kept sorted as orders move.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._keys = {}       # order_id -> (phone, status)
+        self._by_phone = {}   # phone -> {order_id: None}
+        self._by_status = {}  # status -> {order_id: None}
+        self._status_seqs = {}  # status -> sorted sequence numbers
+        self._seq = {}        # order_id -> sequence number
+        self._placed = []     # sequence number -> order_id
+        self._listing = {}    # order_id -> (created_at, search text)
+
+    def put(self, order):
+        order_id = order["order_id"]
+        phone, status = order.get("phone"), order.get("status")
+        with self._lock:
+            if order_id not in self._seq:
+                self._seq[order_id] = len(self._placed)
+                self._placed.append(order_id)
+            self._listing[order_id] = (
+                order.get("created_at") or "",
+                f"{order_id}\n{order.get('name') or ''}\n{phone or ''}".lower(),
+            )
+            old = self._keys.get(order_id)
+            if old == (phone, status):
+                return
+            seq = self._seq[order_id]
+            if old is not None:
+                self._discard(self._by_phone, old[0], order_id)
+                self._discard(self._by_status, old[1], order_id)
+                if old[1] != status:
+                    seqs = self._status_seqs[old[1]]
+                    del seqs[bisect.bisect_left(seqs, seq)]
+                    if not seqs:
+                        del self._status_seqs[old[1]]
+            self._keys[order_id] = (phone, status)
+            self._by_phone.setdefault(phone, {})[order_id] = None
+            self._by_status.setdefault(status, {})[order_id] = None
+            if old is None or old[1] != status:
+                bisect.insort(self._status_seqs.setdefault(status, []), seq)
+
+    @staticmethod
+    def _discard(buckets, key, order_id):
+        bucket = buckets.get(key)
+        if bucket is not None:
+            bucket.pop(order_id, None)
+            if not bucket:
+                del buckets[key]
+
+    def ids_by_phone(self, phone):
+        with self._lock:
+            return list(self._by_phone.get(phone, ()))
+
+    def ids_by_status(self, status):
+        with self._lock:
+            return list(self._by_status.get(status, ()))
+
+    def count_by_status(self):
+        with self._lock:
+            return {status: len(ids) for status, ids in self._by_status.items()}
+
+    def page(self, status=None, date_from=None, date_to=None, q=None, before=None, limit=50):
+        """Newest-first order ids matching the filters, and the cursor for the next page.
+
+        ``before`` is the cursor returned by the previous call (a sequence
+        number); dates compare on created_at's YYYY-MM-DD prefix and ``q``
+        is a case-insensitive substring of the order id, name or phone.
+        """
+        q = q.lower() if q else None
+        with self._lock:
+            if status is not None:
+                seqs = self._status_seqs.get(status, ())
+                end = bisect.bisect_left(seqs, before) if before is not None else len(seqs)
+                candidates = (seqs[i] for i in range(end - 1, -1, -1))
+            else:
+                end = min(before, len(self._placed)) if before is not None else len(self._placed)
+                candidates = range(end - 1, -1, -1)
+
+            ids, last = [], None
+            for seq in candidates:
+                order_id = self._placed[seq]
+                created_at, text = self._listing[order_id]
+                if date_from and created_at[:10] < date_from:
+                    continue
+                if date_to and created_at[:10] > date_to:
+                    continue
+                if q and q not in text:
+                    continue
+                if len(ids) == limit:
+                    return ids, last  # at least one more match: there is a next page
+                ids.append(order_id)
+                last = seq
+            return ids, None
+
+    def __contains__(self, order_id):
+        return order_id in self._keys
+
+    def __len__(self):
+        return len(self._keys)
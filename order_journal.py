@@ -0,0 +1,284 @@
+import json
+import os
+import threading
+
+MANIFEST = "manifest.json"
+
+
+def _complete_lines(data):
+    """Yield the newline-terminated lines of ``data``; a torn tail is skipped."""
+    start = 0
+    while True:
+        end = data.find(b"\n", start)
+        if end < 0:
+            return
+        yield data[start:end + 1]
+        start = end + 1
+
+
+class OrderJournal:
+    """Append-only order store: JSONL segments plus an order_id -> offset index.
+
+    Placing or updating an order appends one line to the active segment and
+    the newest line for an order_id wins, so a write never touches older
+    orders.  The in-memory index maps each order_id to (segment, offset,
+    length) and a lookup is a single seek.  Appends made by other worker
+    processes are picked up by reading only the bytes added since the last
+    refresh: a refresh stats the manifest and the active segment (segments
+    that are no longer last in the manifest never grow again, so once fully
+    scanned they are not even stat'ed), and opens a segment only when it
+    grew.  Once superseded lines outweigh live ones, compact() rewrites
+    the live records into a new generation of segments.
+
+    manifest.json names the current generation and its segments and is
+    replaced atomically.  Writers must hold the shared data lock.
+
+    An optional ``index`` (see order_index.OrderIndex) is fed every record
+    as it is scanned, so secondary indexes follow the journal incrementally.
+    """
+
+    def __init__(self, directory, segment_bytes=4 << 20, compact_min_bytes=1 << 20, index=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.compact_min_bytes = compact_min_bytes
+        self.index = index
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._reset()
+
+    def _reset(self):
+        self._manifest_sig = None
+        self._generation = None
+        self._segments = []
+        self._scanned = {}  # segment -> bytes indexed so far
+        self._sealed = set()  # segments fully scanned that no writer appends to any more
+        self._index = {}    # order_id -> (segment, offset, length), in first-seen order
+        self._live_bytes = 0
+        self._dead_bytes = 0
+        self._all_cache = (None, None)
+        if self.index is not None:
+            self.index.clear()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def exists(self):
+        return os.path.exists(self._path(MANIFEST))
+
+    # ---------- reading ----------
+    def refresh(self):
+        """Bring the index up to date with the manifest and segment files."""
+        with self._lock:
+            for attempt in (0, 1):
+                try:
+                    self._refresh()
+                    return
+                except FileNotFoundError:
+                    if attempt:
+                        raise
+                    self._manifest_sig = None  # compacted under us: reload and retry
+
+    def _refresh(self):
+        try:
+            st = os.stat(self._path(MANIFEST))
+        except FileNotFoundError:
+            return
+        sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if sig != self._manifest_sig:
+            with open(self._path(MANIFEST), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["generation"] != self._generation:
+                self._reset()
+                self._generation = manifest["generation"]
+            self._segments = manifest["segments"]
+            self._manifest_sig = sig
+        last = self._segments[-1] if self._segments else None
+        for segment in self._segments:
+            if segment in self._sealed:
+                continue
+            if os.stat(self._path(segment)).st_size > self._scanned.get(segment, 0):
+                self._scan(segment)
+            if segment != last:
+                self._sealed.add(segment)  # appends only ever go to the last segment
+
+    def _scan(self, segment):
+        start = self._scanned.get(segment, 0)
+        with open(self._path(segment), "rb") as f:
+            f.seek(start)
+            chunk = f.read()
+        offset = start
+        for line in _complete_lines(chunk):
+            record = json.loads(line)
+            order_id = record["order_id"]
+            if self.index is not None:
+                self.index.put(record)
+            prev = self._index.get(order_id)
+            if prev is not None:
+                self._live_bytes -= prev[2]
+                self._dead_bytes += prev[2]
+            self._index[order_id] = (segment, offset, len(line))
+            self._live_bytes += len(line)
+            offset += len(line)
+        self._scanned[segment] = offset
+
+    def _live_lines(self):
+        """Raw lines of the latest version of every order, in index order."""
+        by_location = {}
+        for segment in self._segments:
+            with open(self._path(segment), "rb") as f:
+                data = f.read(self._scanned.get(segment, 0))
+            offset = 0
+            for line in _complete_lines(data):
+                by_location[(segment, offset)] = line
+                offset += len(line)
+        return [by_location[(seg, off)] for seg, off, _ in self._index.values()]
+
+    def _read_at(self, location):
+        segment, offset, length = location
+        with open(self._path(segment), "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def get(self, order_id):
+        """Return the latest version of one order, or None."""
+        with self._lock:
+            for attempt in (0, 1):
+                self.refresh()
+                location = self._index.get(order_id)
+                if location is None:
+                    return None
+                try:
+                    return self._read_at(location)
+                except FileNotFoundError:
+                    if attempt:
+                        raise
+                    self._manifest_sig = None  # compacted under us: reload and retry
+
+    def get_many(self, order_ids):
+        """Return the latest versions of several orders, skipping unknown ids."""
+        with self._lock:
+            self.refresh()
+            locations = [self._index[oid] for oid in order_ids if oid in self._index]
+            try:
+                return [self._read_at(loc) for loc in locations]
+            except FileNotFoundError:
+                self._manifest_sig = None
+                self.refresh()
+                return [self._read_at(self._index[oid]) for oid in order_ids if oid in self._index]
+
+    def contains(self, order_id):
+        with self._lock:
+            self.refresh()
+            return order_id in self._index
+
+    def load_all(self):
+        """Return every order (latest versions) in the order they were placed.
+
+        The list is rebuilt only when the journal grew and is shared between
+        callers, so treat it as read-only.
+        """
+        with self._lock:
+            self.refresh()
+            key = (self._generation, tuple(self._scanned.get(s, 0) for s in self._segments))
+            if self._all_cache[0] == key:
+                return self._all_cache[1]
+            orders = [json.loads(line) for line in self._live_lines()]
+            self._all_cache = (key, orders)
+            return orders
+
+    def __len__(self):
+        with self._lock:
+            self.refresh()
+            return len(self._index)
+
+    # ---------- writing (caller holds the data lock) ----------
+    def _write_manifest(self, generation, segments):
+        path = self._path(MANIFEST)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "segments": segments}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _segment_name(self, generation, seq):
+        return f"{generation:06d}-{seq:06d}.jsonl"
+
+    @staticmethod
+    def _encode(order):
+        return json.dumps(order, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def append(self, order):
+        """Append a new order, or a new version of an existing one."""
+        line = self._encode(order)
+        with self._lock:
+            self.refresh()
+            if not self._segments:
+                self._write_generation(1, [])
+                self.refresh()
+
+            segment = self._segments[-1]
+            if self._scanned.get(segment, 0) >= self.segment_bytes:
+                seq = int(segment.split("-")[1].split(".")[0]) + 1
+                segment = self._segment_name(self._generation, seq)
+                open(self._path(segment), "ab").close()
+                self._write_manifest(self._generation, self._segments + [segment])
+                self.refresh()
+
+            path = self._path(segment)
+            offset = self._scanned.get(segment, 0)
+            with open(path, "ab") as f:
+                if f.tell() > offset:
+                    f.truncate(offset)  # drop a line torn by an earlier crash
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._scan(segment)
+
+            if self._dead_bytes > self._live_bytes and self._dead_bytes >= self.compact_min_bytes:
+                self.compact()
+
+    def _write_generation(self, generation, records):
+        """Write ``records`` as the segments of ``generation`` and switch to it."""
+        segments, seq, size, f = [], 0, 0, None
+        try:
+            for record in records:
+                if f is None or size >= self.segment_bytes:
+                    if f is not None:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        f.close()
+                    seq += 1
+                    segments.append(self._segment_name(generation, seq))
+                    f = open(self._path(segments[-1]), "wb")
+                    size = 0
+                size += f.write(record if isinstance(record, bytes) else self._encode(record))
+            if f is None:
+                segments.append(self._segment_name(generation, 1))
+                f = open(self._path(segments[-1]), "wb")
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            if f is not None:
+                f.close()
+
+        self._write_manifest(generation, segments)
+        for name in os.listdir(self.directory):
+            if name.endswith(".jsonl") and name not in segments:
+                os.remove(self._path(name))
+
+    def compact(self):
+        """Rewrite only the live records into a fresh generation."""
+        with self._lock:
+            self.refresh()
+            records = self._live_lines()
+            self._write_generation((self._generation or 0) + 1, records)
+            self._reset()
+            self.refresh()
+
+    def import_orders(self, orders):
+        """Start the journal from an existing list of orders (orders.json)."""
+        with self._lock:
+            self._write_generation(1, list(orders))
+            self._reset()
+            self.refresh()
@@ -0,0 +1,41 @@
+"""Rendered storefront pages, cached per data version.
+
+A page is cached under a key that includes the version of everything it
+was rendered from (catalog, settings file, the order being tracked), so a
+change anywhere produces a new key and nothing has to be invalidated: the
+stale entry simply ages out of the LRU.  Each entry carries a content ETag
+and the time it was rendered for conditional GETs.
+"""
+import hashlib
+import json
+import time
+
+from lru import BoundedLRU
+
+
+def content_version(data):
+    """Stable short digest of JSON-serializable ``data``."""
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class CachedPage:
+    __slots__ = ("body", "etag", "last_modified")
+
+    def __init__(self, body, etag, last_modified):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class PageCache(BoundedLRU):
+    """In-memory LRU of rendered pages, bounded by total size in bytes."""
+
+    def __init__(self, max_bytes=8 << 20):
+        super().__init__(max_bytes, size=lambda page: len(page.body))
+
+    def put(self, key, body):
+        """Store ``body`` (str or bytes) under ``key`` and return its CachedPage."""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        return super().put(key, CachedPage(body, hashlib.sha256(body).hexdigest()[:32], int(time.time())))
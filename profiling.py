@@ -0,0 +1,97 @@
+"""Sampling profiler for slow requests.
+
+While enabled, a background thread wakes every ``interval`` seconds and
+records the Python stack of every thread that is inside a request
+(sys._current_frames(), no tracing hooks, so the requests themselves run
+at full speed).  When a request finishes above ``threshold`` seconds its
+samples are written to the log, most frequent stacks first: where a slow
+checkout or invoice actually spent its time.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# frames from these files are bookkeeping, not the request's own work
+_SKIP_FILES = (os.path.abspath(__file__),)
+
+
+def _stack(frame, limit=40):
+    """Innermost-last tuple of "file:line function" for ``frame``."""
+    entries = []
+    while frame is not None and len(entries) < limit:
+        code = frame.f_code
+        if code.co_filename not in _SKIP_FILES:
+            entries.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+        frame = frame.f_back
+    return tuple(reversed(entries))
+
+
+class SlowRequestProfiler(threading.Thread):
+    """Samples request threads; logs the stacks of requests slower than ``threshold``."""
+
+    def __init__(self, threshold, interval=0.005, logger=None, top=10):
+        super().__init__(name="slow-request-profiler", daemon=True)
+        self.threshold = threshold
+        self.interval = interval
+        self.logger = logger or logging.getLogger("pharmacy.slow")
+        self.top = top
+        self._active = {}  # thread id -> Counter of stacks
+        self._lock = threading.Lock()
+        self.logged = 0
+
+    def begin(self):
+        """Start sampling the calling thread (call when a request starts)."""
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    def end(self, label, duration):
+        """Stop sampling the calling thread; log its samples if ``duration`` was slow."""
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if samples is None or duration < self.threshold:
+            return
+        self.logged += 1
+        total = sum(samples.values())
+        lines = [f"slow request {label}: {duration * 1000:.0f} ms, {total} samples every "
+                 f"{self.interval * 1000:g} ms"]
+        # self time: the innermost frame of each sample, line numbers dropped
+        leaves = Counter()
+        for stack, count in samples.items():
+            if stack:
+                where, _, function = stack[-1].partition(" ")
+                leaves[f"{function} ({where.split(':')[0]})"] += count
+        lines.append("  innermost functions:")
+        for name, count in leaves.most_common(self.top):
+            lines.append(f"  {count:5d} ({count / total:.0%})  {name}")
+        lines.append("  stacks:")
+        for stack, count in samples.most_common(self.top):
+            lines.append(f"  {count:5d} ({count / total:.0%})  " + " > ".join(stack[-12:]))
+        self.logger.warning("\n".join(lines))
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_stack(frame)] += 1
+
+
+def file_logger(path):
+    """Logger writing slow-request reports to ``path``."""
+    logger = logging.getLogger("pharmacy.slow")
+    if not any(isinstance(h, logging.FileHandler) and h.baseFilename == os.path.abspath(path)
+               for h in logger.handlers):
+        handler = logging.FileHandler(path, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s pid %(process)d %(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
@@ -0,0 +1,210 @@
+"""Per-client rate limits (token buckets) shared by every worker process.
+
+Each limited route has a Limit: ``rate`` requests per ``per`` seconds with
+bursts of up to ``burst``.  A client's bucket is two numbers (tokens left,
+time of the last update) and is refilled lazily on the next request, so a
+bucket that has been idle long enough to be full again carries no
+information: it is stored with that time as its expiry and dropped by the
+periodic sweep (TTL eviction) instead of being kept forever.
+
+Stores:
+    MemoryStore   dict in this process (tests, single-worker runs)
+    SqliteStore   one small table in its own database file, updated in a
+                  BEGIN IMMEDIATE transaction, so limits hold across workers
+"""
+import os
+import threading
+import time
+
+from storage import open_wal
+
+UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class Limit:
+    """``rate`` requests per ``per`` seconds, bursts of up to ``burst``."""
+
+    __slots__ = ("rate", "per", "burst")
+
+    def __init__(self, rate, per, burst=None):
+        self.rate = rate
+        self.per = per
+        self.burst = burst if burst is not None else rate
+
+    @classmethod
+    def parse(cls, spec):
+        """'60/minute', '1/3600' or '120/minute:40' (burst after the colon)."""
+        spec, _, burst = spec.partition(":")
+        rate, _, per = spec.partition("/")
+        per = per.strip() or "second"
+        per = UNITS[per] if per in UNITS else float(per)
+        return cls(float(rate), per, float(burst) if burst else None)
+
+    def __repr__(self):
+        return f"Limit({self.rate:g}/{self.per:g}s, burst={self.burst:g})"
+
+
+def take(limit, state, cost, now, peek=False):
+    """Apply one request to a bucket.
+
+    ``state`` is (tokens, updated_at) or None for a full bucket.  Returns
+    (allowed, retry_after seconds, new state, expires_at); the new state is
+    the one to store (unchanged tokens when ``peek``).
+    """
+    per_token = limit.per / limit.rate
+    tokens = limit.burst
+    if state is not None:
+        tokens = min(limit.burst, state[0] + (now - state[1]) / per_token)
+    allowed = tokens >= cost
+    if allowed and not peek:
+        tokens = min(limit.burst, tokens - cost)  # a negative cost gives tokens back
+    retry_after = 0.0 if allowed else (cost - tokens) * per_token
+    expires_at = now + (limit.burst - tokens) * per_token
+    return allowed, retry_after, (tokens, now), expires_at
+
+
+class MemoryStore:
+    """Buckets in a dict; expired ones are swept every ``sweep_every`` requests."""
+
+    def __init__(self, sweep_every=1000):
+        self._buckets = {}  # key -> (tokens, updated_at, expires_at)
+        self._lock = threading.Lock()
+        self._sweep_every = sweep_every
+        self._calls = 0
+
+    def take(self, key, limit, cost, now, peek=False):
+        with self._lock:
+            entry = self._buckets.get(key)
+            allowed, retry_after, state, expires_at = take(limit, entry and entry[:2], cost, now, peek)
+            if not peek:
+                self._buckets[key] = (*state, expires_at)
+            self._calls += 1
+            if self._calls % self._sweep_every == 0:
+                self._sweep(now)
+            return allowed, retry_after
+
+    def _sweep(self, now):
+        for key in [k for k, entry in self._buckets.items() if entry[2] <= now]:
+            del self._buckets[key]
+
+    def sweep(self, now=None):
+        with self._lock:
+            before = len(self._buckets)
+            self._sweep(time.time() if now is None else now)
+            return before - len(self._buckets)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SqliteStore:
+    """Buckets in a SQLite table shared by every worker process."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS buckets (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_buckets_expiry ON buckets(expires_at);
+    """
+
+    def __init__(self, path, sweep_every=1000):
+        self.path = path
+        self._local = threading.local()
+        self._sweep_every = sweep_every
+        self._calls = 0
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = open_wal(self.path)
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, limit, cost, now, peek=False):
+        conn = self._conn()
+        if peek:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            return take(limit, row, cost, now, peek=True)[:2]
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            allowed, retry_after, (tokens, updated_at), expires_at = take(limit, row, cost, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, tokens, updated_at, expires_at),
+            )
+            self._calls += 1
+            if self._calls % self._sweep_every == 0:
+                conn.execute("DELETE FROM buckets WHERE expires_at <= ?", (now,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        return allowed, retry_after
+
+    def sweep(self, now=None):
+        cur = self._conn().execute("DELETE FROM buckets WHERE expires_at <= ?", (time.time() if now is None else now,))
+        return cur.rowcount
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+
+class RateLimiter:
+    """Named limits ({route name: Limit}) applied per client over one store."""
+
+    def __init__(self, store, limits):
+        self.store = store
+        self.limits = dict(limits)
+        self.allowed = {name: 0 for name in self.limits}
+        self.denied = {name: 0 for name in self.limits}
+
+    def hit(self, name, client, cost=1):
+        """Count a request; (allowed, retry_after seconds).  Unknown names are not limited."""
+        limit = self.limits.get(name)
+        if limit is None:
+            return True, 0.0
+        allowed, retry_after = self.store.take(f"{name}:{client}", limit, cost, time.time())
+        (self.allowed if allowed else self.denied)[name] += 1
+        return allowed, retry_after
+
+    def refund(self, name, client, cost=1):
+        """Give back tokens taken by hit() for a request that did not go through."""
+        limit = self.limits.get(name)
+        if limit is not None:
+            self.store.take(f"{name}:{client}", limit, -cost, time.time())
+
+    def check(self, name, client, cost=1):
+        """Would a request be allowed now?  Does not use up a token."""
+        limit = self.limits.get(name)
+        if limit is None:
+            return True, 0.0
+        return self.store.take(f"{name}:{client}", limit, cost, time.time(), peek=True)
+
+    def stats(self):
+        return {
+            name: {"limit": repr(limit), "allowed": self.allowed[name], "denied": self.denied[name]}
+            for name, limit in self.limits.items()
+        }
+
+
+def parse_limits(spec, defaults):
+    """``defaults`` overridden by 'name=60/minute,other=5/second:10'."""
+    limits = dict(defaults)
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        name, _, value = part.partition("=")
+        limits[name.strip()] = Limit.parse(value.strip())
+    return limits
+
+
+def make_store(backend, path):
+    if backend == "memory":
+        return MemoryStore()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return SqliteStore(path)
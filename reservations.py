@@ -0,0 +1,30 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class HoldSweeper(threading.Thread):
+    """Background thread that deletes expired stock holds every ``interval`` seconds.
+
+    Reads already ignore expired holds, so the sweeper only keeps the hold
+    store small; running one per worker process is harmless because
+    expire_holds() runs inside a storage transaction.
+    """
+
+    def __init__(self, storage, interval=60):
+        super().__init__(name="hold-sweeper", daemon=True)
+        self.storage = storage
+        self.interval = interval
+        self.swept = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.swept += self.storage.expire_holds()
+            except Exception:
+                logger.exception("Hold sweeper failed")
+
+    def stop(self):
+        self._stop_event.set()
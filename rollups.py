@@ -0,0 +1,117 @@
+"""Materialized revenue/profit aggregates, maintained incrementally per order.
+
+Every order contributes fixed amounts to a few rollup rows, keyed by
+(kind, key):
+
+    day / week / month   completed orders: revenue, cost, orders
+    product              non-cancelled order lines (by product name): qty, revenue, orders
+    total                "all" (every order), "active" (not cancelled: the
+                         order's total_price), "completed" (revenue and
+                         cost of the dated ones; orders counts every
+                         completed order, dated or not)
+
+Each row has the same four fields (revenue, cost, orders, qty).  When an
+order is created or changes status, the backend applies order_delta(old,
+new) to its stored rows, so the report pages read a handful of rows
+instead of scanning the order history.  build() recomputes everything from
+scratch for a backfill.
+"""
+from datetime import date
+
+KINDS = ("day", "week", "month", "product", "total")
+FIELDS = ("revenue", "cost", "orders", "qty")
+
+COMPLETED = "مكتمل"
+CANCELLED = "ملغي"
+
+
+def week_key(day):
+    iso_year, iso_week, _ = day.isocalendar()
+    return f"{iso_year}-W{iso_week:02d}"
+
+
+def week_label(key):
+    """'2026-W03' -> the label the profits page shows."""
+    year, week = key.split("-W")
+    return f"الأسبوع {int(week)} من {year}"
+
+
+def contributions(order):
+    """The (kind, key, row) amounts ``order`` adds to the rollups."""
+    if order is None:
+        return []
+    status = order.get("status")
+    items = order.get("items", {}).values()
+    rows = [("total", "all", {"orders": 1})]
+
+    if status != CANCELLED:
+        rows.append(("total", "active", {"revenue": float(order.get("total_price", 0)), "orders": 1}))
+        for item in items:
+            qty = int(item.get("qty", 0))
+            rows.append(("product", item.get("name", "unknown"),
+                         {"qty": qty, "revenue": qty * float(item.get("price", 0)), "orders": 1}))
+
+    if status == COMPLETED:
+        created_at = order.get("created_at") or ""
+        try:
+            day = date.fromisoformat(created_at[:10])
+        except ValueError:
+            # undated orders never showed up in the profit buckets, only in the completed count
+            rows.append(("total", "completed", {"orders": 1}))
+            return rows
+        revenue = cost = 0.0
+        for item in items:
+            qty = int(item.get("qty", 0))
+            revenue += qty * float(item.get("price", 0))
+            cost += qty * float(item.get("cost", item.get("price", 0)))
+        amounts = {"revenue": revenue, "cost": cost, "orders": 1}
+        rows += [
+            ("day", created_at[:10], amounts),
+            ("week", week_key(day), amounts),
+            ("month", created_at[:7], amounts),
+            ("total", "completed", amounts),
+        ]
+    return rows
+
+
+def order_delta(old, new):
+    """{(kind, key): row} to add to the rollups when ``old`` becomes ``new``.
+
+    Either side may be None (order created / removed).  Rows whose change
+    nets out to zero are left out.
+    """
+    delta = {}
+    for sign, order in ((-1, old), (1, new)):
+        for kind, key, amounts in contributions(order):
+            row = delta.setdefault((kind, key), dict.fromkeys(FIELDS, 0))
+            for field, value in amounts.items():
+                row[field] += sign * value
+    return {k: row for k, row in delta.items() if any(row.values())}
+
+
+def empty():
+    return {kind: {} for kind in KINDS}
+
+
+def apply(store, delta):
+    """Add ``delta`` to ``store`` ({kind: {key: row}}) in place.
+
+    Money is kept rounded to 2 decimals so repeated add/subtract does not
+    drift; a row is dropped once no order contributes to it any more.
+    """
+    for (kind, key), change in delta.items():
+        rows = store.setdefault(kind, {})
+        row = rows.setdefault(key, dict.fromkeys(FIELDS, 0))
+        for field, value in change.items():
+            row[field] = round(row[field] + value, 2)
+        if not row["orders"]:
+            del rows[key]
+    return store
+
+
+def build(orders):
+    """Rollups for a whole order history (rebuild / backfill)."""
+    store = empty()
+    for order in orders:
+        apply(store, order_delta(None, order))
+    return store
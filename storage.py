@@ -0,0 +1,845 @@
+"""Storage backends for products, batches and orders.
+
+The routes only talk to a backend through the methods below, so the JSON
+files and the SQLite database are interchangeable.  Products are returned in
+the same shape as products.json ({pid: {"name", "image", "batches": [...]}})
+and orders in the same shape as the entries of orders.json.
+
+Both backends also keep stock holds: a cart reserves units of a product
+until the hold expires (or the cart checks out), and those units are not
+available to other carts in the meantime.  Holds only reserve, they never
+touch the batches; an expired hold is ignored by every read even before
+expire_holds() removes it.
+
+Every order write also applies the order's change to the revenue/profit
+rollups (see rollups.py) in the same transaction; rebuild_rollups()
+recomputes them from the order history with the columnar engine in
+analytics.py.
+"""
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import rollups
+from analytics import OrderColumns, rollup_store
+from catalog_search import CatalogIndex, index_terms, prefix_range, query_tokens
+from inventory import Inventory, StockSummary, ensure_batch_id, expiry_ordinal, order_batches
+
+PRODUCT_FIELDS = ("name", "image")
+BATCH_FIELDS = ("price", "purchase_price", "quantity", "expiry_date")
+ORDER_FIELDS = ("order_id", "name", "phone", "total_price", "status", "created_at")
+ITEM_FIELDS = ("name", "qty", "price", "cost")
+
+
+def open_wal(path, row_factory=None):
+    """A connection to ``path`` in WAL mode, autocommit, waiting up to 30 s for locks.
+
+    One per thread: every SQLite file here (storage, rate limits, jobs,
+    events) keeps it in a threading.local.
+    """
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if row_factory is not None:
+        conn.row_factory = row_factory
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class JsonStorage:
+    """Backend that keeps products in products.json and orders in an OrderJournal.
+
+    transaction() holds ``lock`` (a FileLock shared by all workers) for the
+    whole read-modify-write.  If the block fails, the cached products are
+    dropped so half-applied in-memory changes never reach the next request.
+    The journal is seeded once from the legacy orders.json.  Stock totals
+    come from an Inventory over the cached catalog.  Like the SQLite
+    backend, it hands out products with their batches in FEFO order.
+    Holds live in ``holds_file`` as {cart_id: {"expires_at", "items"}} and
+    the rollups in ``rollups_file`` as {kind: {key: row}}.
+    """
+
+    def __init__(self, products_file, orders_file, journal, load, save, lock, invalidate,
+                 holds_file=None, rollups_file=None, version=None):
+        self.products_file = products_file
+        self.orders_file = orders_file
+        self.holds_file = holds_file
+        self.rollups_file = rollups_file
+        self.journal = journal
+        self._load = load
+        self._save = save
+        self._lock = lock
+        self._invalidate = invalidate
+        self._version = version
+        self.inventory = Inventory()
+        self.catalog = CatalogIndex()
+        if not journal.exists():
+            with self._lock:
+                if not journal.exists():
+                    journal.import_orders(self._load(orders_file) or [])
+        if rollups_file and not self._load(rollups_file):
+            self.rebuild_rollups()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            try:
+                yield self
+            except BaseException:
+                self._invalidate(self.products_file)
+                raise
+
+    # ---------- products ----------
+    def load_products(self):
+        products = self._load(self.products_file) or {}
+        self.inventory.levels(products)  # no-op unless the file was reloaded
+        return products
+
+    def get_products(self, pids):
+        products = self.load_products()
+        return {pid: products[pid] for pid in pids if pid in products}
+
+    def get_product(self, pid):
+        return self.load_products().get(pid)
+
+    def save_product(self, pid, product):
+        self.save_products({pid: product})
+
+    def save_products(self, changed):
+        """Persist several products at once ({pid: product})."""
+        with self.transaction():
+            products = self.load_products()
+            products.update(changed)
+            self._save(self.products_file, products)
+            self.inventory.update(products, changed)
+            self.catalog.update(products, changed)
+
+    def delete_product(self, pid):
+        with self.transaction():
+            products = self.load_products()
+            if pid in products:
+                del products[pid]
+                self._save(self.products_file, products)
+                self.inventory.update(products, [pid])
+                self.catalog.update(products, [pid])
+
+    def catalog_version(self):
+        """Changes whenever a product or its stock changes (products.json is rewritten)."""
+        return self._version(self.products_file)
+
+    def search_products(self, query):
+        """{pid: name} of the products whose name matches ``query`` (see
+        catalog_search), in catalog order."""
+        products = self.load_products()
+        return {pid: products[pid].get("name") for pid in self.catalog.search(products, query)}
+
+    def next_product_id(self):
+        products = self.load_products()
+        return str(max(int(pid) for pid in products) + 1) if products else "1"
+
+    def get_stock(self, pid):
+        """StockSummary for one product, or None if it does not exist."""
+        return self.inventory.levels(self.load_products()).get(pid)
+
+    def get_stocks(self, pids):
+        """{pid: StockSummary} for the products in ``pids`` that exist."""
+        levels = self.stock_levels()
+        return {pid: levels[pid] for pid in pids if pid in levels}
+
+    def stock_levels(self):
+        """{pid: StockSummary} for the whole catalog."""
+        return self.inventory.levels(self.load_products())
+
+    def expiring_batches(self, days, today=None):
+        """Batches expiring within ``days`` days (or already expired), soonest first."""
+        today = (today or date.today()).toordinal()
+        products = self.load_products()
+        return [_expiring_row(pid, products[pid].get("name"), batch, ordinal - today)
+                for pid, batch, ordinal in self.inventory.expiring(products, today + days)]
+
+    def count_expiring(self, days, today=None):
+        today = (today or date.today()).toordinal()
+        return len(self.inventory.expiring(self.load_products(), today + days))
+
+    # ---------- orders ----------
+    def load_orders(self):
+        return self.journal.load_all()
+
+    def get_order(self, order_id):
+        return self.journal.get(order_id)
+
+    def order_exists(self, order_id):
+        return self.journal.contains(order_id)
+
+    def add_order(self, order):
+        with self._lock:
+            self.journal.append(order)
+            self._apply_rollups(None, order)
+
+    def save_order(self, order):
+        with self._lock:
+            old = self.journal.get(order["order_id"])
+            self.journal.append(order)
+            self._apply_rollups(old, order)
+
+    def find_orders(self, phone=None, status=None):
+        """Orders with the given phone and/or status, in the order they were indexed."""
+        self.journal.refresh()
+        index = self.journal.index
+        if phone is not None:
+            ids = index.ids_by_phone(phone)
+            if status is not None:
+                wanted = set(index.ids_by_status(status))
+                ids = [oid for oid in ids if oid in wanted]
+        elif status is not None:
+            ids = index.ids_by_status(status)
+        else:
+            return list(self.load_orders())
+        return self.journal.get_many(ids)
+
+    def count_orders_by_status(self):
+        self.journal.refresh()
+        return self.journal.index.count_by_status()
+
+    def page_orders(self, status=None, date_from=None, date_to=None, q=None, cursor=None, limit=50):
+        """One page of orders, newest first, and the cursor of the next page (None at the end)."""
+        self.journal.refresh()
+        ids, next_cursor = self.journal.index.page(status, date_from, date_to, q, cursor, limit)
+        return self.journal.get_many(ids), next_cursor
+
+    # ---------- rollups ----------
+    def _apply_rollups(self, old, new):
+        delta = rollups.order_delta(old, new)
+        if self.rollups_file and delta:
+            self._save(self.rollups_file, rollups.apply(self._load(self.rollups_file) or rollups.empty(), delta))
+
+    def get_rollups(self):
+        """{kind: {key: row}}; shared with the cache, treat as read-only."""
+        return self._load(self.rollups_file) or rollups.empty()
+
+    def rebuild_rollups(self):
+        with self._lock:
+            store = rollup_store(OrderColumns(self.load_orders()))
+            self._save(self.rollups_file, store)
+            return store
+
+    # ---------- stock holds ----------
+    def _active_holds(self):
+        now = time.time()
+        holds = self._load(self.holds_file) or {}
+        return {cart_id: h for cart_id, h in holds.items() if h["expires_at"] > now}
+
+    def hold(self, cart_id, pid, qty, ttl):
+        """Set the cart's hold on ``pid`` to ``qty`` (0 drops it) and extend all
+        of the cart's holds by ``ttl`` seconds.  Returns the new expiry time."""
+        return self.hold_many(cart_id, {pid: qty}, ttl)
+
+    def hold_many(self, cart_id, quantities, ttl):
+        """hold() for several products at once ({pid: qty}), in one write."""
+        expires_at = time.time() + ttl
+        with self.transaction():
+            holds = self._load(self.holds_file) or {}
+            cart = holds.setdefault(cart_id, {"expires_at": expires_at, "items": {}})
+            if cart["expires_at"] <= time.time():
+                cart["items"] = {}  # expired but not swept yet: start over
+            cart["expires_at"] = expires_at
+            for pid, qty in quantities.items():
+                if qty > 0:
+                    cart["items"][pid] = qty
+                else:
+                    cart["items"].pop(pid, None)
+            if not cart["items"]:
+                del holds[cart_id]
+            self._save(self.holds_file, holds)
+        return expires_at
+
+    def cart_holds(self, cart_id):
+        """{pid: qty} currently held by one cart."""
+        cart = self._active_holds().get(cart_id)
+        return dict(cart["items"]) if cart else {}
+
+    def reserved_qty(self, pids, exclude_cart=None):
+        """{pid: units held by carts other than ``exclude_cart``} for ``pids``."""
+        wanted = set(pids)
+        reserved = {}
+        for cart_id, cart in self._active_holds().items():
+            if cart_id == exclude_cart:
+                continue
+            for pid, qty in cart["items"].items():
+                if pid in wanted:
+                    reserved[pid] = reserved.get(pid, 0) + qty
+        return reserved
+
+    def release_holds(self, cart_id):
+        with self.transaction():
+            holds = self._load(self.holds_file) or {}
+            if holds.pop(cart_id, None) is not None:
+                self._save(self.holds_file, holds)
+
+    def expire_holds(self):
+        """Delete expired holds; returns how many carts were dropped."""
+        with self.transaction():
+            holds = self._load(self.holds_file) or {}
+            active = self._active_holds()
+            if len(active) == len(holds):
+                return 0
+            self._save(self.holds_file, active)
+            return len(holds) - len(active)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    image TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id TEXT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    price NUMERIC,
+    purchase_price NUMERIC,
+    quantity INTEGER,
+    expiry_date TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_batches_product ON batches(product_id, position);
+CREATE TABLE IF NOT EXISTS product_stock (
+    product_id TEXT PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    total_qty INTEGER NOT NULL,
+    nearest_expiry TEXT NOT NULL,
+    cost_value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_batches_expiry ON batches(expiry_date);
+CREATE TABLE IF NOT EXISTS product_terms (
+    term TEXT NOT NULL,
+    product_id TEXT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    PRIMARY KEY (term, product_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0);
+CREATE INDEX IF NOT EXISTS idx_product_terms_product ON product_terms(product_id);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    name TEXT,
+    phone TEXT,
+    total_price NUMERIC,
+    status TEXT,
+    created_at TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_orders_phone ON orders(phone);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at);
+CREATE TABLE IF NOT EXISTS order_items (
+    order_id TEXT NOT NULL REFERENCES orders(order_id) ON DELETE CASCADE,
+    product_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    qty INTEGER,
+    price NUMERIC,
+    cost NUMERIC,
+    extra TEXT,
+    PRIMARY KEY (order_id, product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items(product_id);
+CREATE TABLE IF NOT EXISTS stock_holds (
+    cart_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (cart_id, product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_stock_holds_product ON stock_holds(product_id, expires_at);
+CREATE INDEX IF NOT EXISTS idx_stock_holds_expiry ON stock_holds(expires_at);
+CREATE TABLE IF NOT EXISTS rollups (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    revenue REAL NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    orders INTEGER NOT NULL DEFAULT 0,
+    qty INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, key)
+);
+"""
+
+
+def _split(record, fields):
+    """Split a dict into its known column values and a JSON blob of the rest."""
+    extra = {k: v for k, v in record.items() if k not in fields}
+    return [record.get(f) for f in fields], (json.dumps(extra, ensure_ascii=False) if extra else None)
+
+
+def _expiring_row(pid, name, batch, days_left):
+    return {
+        "pid": pid,
+        "name": name,
+        "expiry_date": batch["expiry_date"],
+        "quantity": batch.get("quantity", 0),
+        "days_left": days_left,
+    }
+
+
+def _join(row, fields, extra):
+    record = json.loads(extra) if extra else {}
+    for f, v in zip(fields, row):
+        if v is not None:
+            record[f] = v
+    return record
+
+
+class SqliteStorage:
+    """Backend with normalized products/batches/orders/order_items tables.
+
+    Each thread gets its own connection; the database runs in WAL mode so
+    readers never block the single writer.  Writes inside transaction()
+    take the write lock up front (BEGIN IMMEDIATE), which serializes
+    read-modify-write sequences across threads and worker processes.
+    product_stock holds each product's stock totals, rewritten together
+    with its batches, and the rollups table the order aggregates.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+        with self.transaction() as conn:
+            missing = conn.execute(
+                "SELECT id FROM products WHERE id NOT IN (SELECT product_id FROM product_stock)"
+            ).fetchall()
+            if missing:
+                products = self.get_products(pid for (pid,) in missing)
+                for pid, product in products.items():
+                    self._write_stock(conn, pid, product)
+            unindexed = conn.execute(
+                "SELECT id, name FROM products WHERE id NOT IN (SELECT product_id FROM product_terms)"
+            ).fetchall()
+            for pid, name in unindexed:
+                self._write_terms(conn, pid, name)
+            if (not conn.execute("SELECT 1 FROM rollups LIMIT 1").fetchone()
+                    and conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone()):
+                self.rebuild_rollups()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = open_wal(self.path)
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._conn()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    # ---------- products ----------
+    def _read_products(self, pids=None):
+        conn = self._conn()
+        where, params = "", ()
+        if pids is not None:
+            params = tuple(str(p) for p in pids)
+            if not params:
+                return {}
+            where = f"IN ({','.join('?' * len(params))})"
+
+        products = {}
+        for pid, name, image, extra in conn.execute(
+            f"SELECT id, name, image, extra FROM products {'WHERE id ' + where if where else ''} ORDER BY rowid",
+            params,
+        ):
+            product = _join((name, image), PRODUCT_FIELDS, extra)
+            product["batches"] = []
+            products[pid] = product
+        if not products:
+            return products
+
+        for row in conn.execute(
+            f"SELECT product_id, price, purchase_price, quantity, expiry_date, extra FROM batches "
+            f"{'WHERE product_id ' + where if where else ''} ORDER BY product_id, position",
+            params,
+        ):
+            batch = _join(row[1:5], BATCH_FIELDS, row[5])
+            batch.setdefault("expiry_date", "")
+            products[row[0]]["batches"].append(batch)
+        for product in products.values():
+            order_batches(product)  # rows saved before FEFO ordering was enforced
+        return products
+
+    def load_products(self):
+        return self._read_products()
+
+    def get_products(self, pids):
+        return self._read_products(pids)
+
+    def get_product(self, pid):
+        return self._read_products([pid]).get(pid)
+
+    def save_product(self, pid, product):
+        fields = {k: v for k, v in product.items() if k != "batches"}
+        values, extra = _split(fields, PRODUCT_FIELDS)
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO products (id, name, image, extra) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name=excluded.name, image=excluded.image, extra=excluded.extra",
+                (pid, *values, extra),
+            )
+            conn.execute("DELETE FROM batches WHERE product_id = ?", (pid,))
+            conn.executemany(
+                "INSERT INTO batches (product_id, position, price, purchase_price, quantity, expiry_date, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(pid, pos, *vals, ex) for pos, (vals, ex) in
+                 enumerate(_split(b, BATCH_FIELDS) for b in product.get("batches", []))],
+            )
+            self._write_stock(conn, pid, product)
+            self._write_terms(conn, pid, product.get("name"))
+            self._bump_catalog(conn)
+
+    @staticmethod
+    def _bump_catalog(conn):
+        conn.execute("UPDATE catalog_version SET version = version + 1")
+
+    @staticmethod
+    def _write_terms(conn, pid, name):
+        conn.execute("DELETE FROM product_terms WHERE product_id = ?", (pid,))
+        conn.executemany(
+            "INSERT INTO product_terms (term, product_id) VALUES (?, ?)",
+            [(term, pid) for term in index_terms(name)],
+        )
+
+    @staticmethod
+    def _write_stock(conn, pid, product):
+        stock = StockSummary.of(product)
+        conn.execute(
+            "INSERT OR REPLACE INTO product_stock (product_id, total_qty, nearest_expiry, cost_value) "
+            "VALUES (?, ?, ?, ?)",
+            (pid, stock.total_qty, stock.nearest_expiry, stock.cost_value),
+        )
+
+    def save_products(self, changed):
+        with self.transaction():
+            for pid, product in changed.items():
+                self.save_product(pid, product)
+
+    def delete_product(self, pid):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM products WHERE id = ?", (pid,))
+            self._bump_catalog(conn)
+
+    def catalog_version(self):
+        return self._conn().execute("SELECT version FROM catalog_version").fetchone()[0]
+
+    def search_products(self, query):
+        """Each query token is a range scan on the product_terms primary key."""
+        tokens = query_tokens(query)
+        if not tokens:
+            return dict(self._conn().execute("SELECT id, name FROM products ORDER BY rowid"))
+        subqueries = " INTERSECT ".join(
+            ["SELECT product_id FROM product_terms WHERE term >= ? AND term < ?"] * len(tokens)
+        )
+        rows = self._conn().execute(
+            f"SELECT id, name FROM products WHERE id IN ({subqueries}) ORDER BY rowid",
+            [bound for token in tokens for bound in prefix_range(token)],
+        )
+        return dict(rows)
+
+    def next_product_id(self):
+        row = self._conn().execute("SELECT MAX(CAST(id AS INTEGER)) FROM products").fetchone()
+        return str((row[0] or 0) + 1)
+
+    def get_stock(self, pid):
+        row = self._conn().execute(
+            "SELECT total_qty, nearest_expiry, cost_value FROM product_stock WHERE product_id = ?", (pid,)
+        ).fetchone()
+        return StockSummary(*row) if row else None
+
+    def get_stocks(self, pids):
+        params = tuple(str(p) for p in pids)
+        if not params:
+            return {}
+        rows = self._conn().execute(
+            f"SELECT product_id, total_qty, nearest_expiry, cost_value FROM product_stock "
+            f"WHERE product_id IN ({','.join('?' * len(params))})",
+            params,
+        )
+        return {pid: StockSummary(*vals) for pid, *vals in rows}
+
+    def stock_levels(self):
+        rows = self._conn().execute(
+            "SELECT product_id, total_qty, nearest_expiry, cost_value FROM product_stock"
+        )
+        return {pid: StockSummary(*vals) for pid, *vals in rows}
+
+    def _expiring_rows(self, days, today):
+        """(row, ordinal) for dated batches up to today + days, via idx_batches_expiry.
+
+        ISO dates sort as strings; the parse drops malformed dates that a
+        string comparison would let through.
+        """
+        cutoff = date.fromordinal(today + days).isoformat()
+        rows = self._conn().execute(
+            "SELECT b.product_id, p.name, b.expiry_date, b.quantity FROM batches b "
+            "JOIN products p ON p.id = b.product_id "
+            "WHERE b.expiry_date != '' AND b.expiry_date <= ? ORDER BY b.expiry_date, b.product_id",
+            (cutoff,),
+        )
+        for row in rows:
+            ordinal = expiry_ordinal(row[2])
+            if ordinal is not None and ordinal <= today + days:
+                yield row, ordinal
+
+    def expiring_batches(self, days, today=None):
+        today = (today or date.today()).toordinal()
+        return [_expiring_row(pid, name, {"expiry_date": expiry, "quantity": qty}, ordinal - today)
+                for (pid, name, expiry, qty), ordinal in self._expiring_rows(days, today)]
+
+    def count_expiring(self, days, today=None):
+        today = (today or date.today()).toordinal()
+        return sum(1 for _ in self._expiring_rows(days, today))
+
+    # ---------- orders ----------
+    def _read_orders(self, ids=None, **filters):
+        """Orders matching column=value filters (order_id, phone, status), or the given ids."""
+        conn = self._conn()
+        clauses = [f"{column} = ?" for column in filters]
+        params = tuple(filters.values())
+        if ids is not None:
+            if not ids:
+                return []
+            clauses.append(f"order_id IN ({','.join('?' * len(ids))})")
+            params += tuple(ids)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        orders = {}
+        for row in conn.execute(
+            f"SELECT order_id, name, phone, total_price, status, created_at, extra "
+            f"FROM orders {where} ORDER BY rowid",
+            params,
+        ):
+            order = _join(row[:6], ORDER_FIELDS, row[6])
+            order["items"] = {}
+            orders[row[0]] = order
+        if not orders:
+            return []
+
+        item_where = f"WHERE order_id IN (SELECT order_id FROM orders {where})" if where else ""
+        for row in conn.execute(
+            f"SELECT order_id, product_id, name, qty, price, cost, extra "
+            f"FROM order_items {item_where} ORDER BY order_id, position",
+            params,
+        ):
+            orders[row[0]]["items"][row[1]] = _join(row[2:6], ITEM_FIELDS, row[6])
+        return list(orders.values())
+
+    def load_orders(self):
+        return self._read_orders()
+
+    def get_order(self, order_id):
+        found = self._read_orders(order_id=order_id)
+        return found[0] if found else None
+
+    def order_exists(self, order_id):
+        row = self._conn().execute("SELECT 1 FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+        return row is not None
+
+    def _write_order(self, conn, order):
+        fields = {k: v for k, v in order.items() if k != "items"}
+        values, extra = _split(fields, ORDER_FIELDS)
+        conn.execute(
+            "INSERT INTO orders (order_id, name, phone, total_price, status, created_at, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(order_id) DO UPDATE SET name=excluded.name, phone=excluded.phone, "
+            "total_price=excluded.total_price, status=excluded.status, "
+            "created_at=excluded.created_at, extra=excluded.extra",
+            (*values, extra),
+        )
+        conn.execute("DELETE FROM order_items WHERE order_id = ?", (order["order_id"],))
+        conn.executemany(
+            "INSERT INTO order_items (order_id, product_id, position, name, qty, price, cost, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(order["order_id"], str(pid), pos, *vals, ex) for pos, (pid, (vals, ex)) in
+             enumerate((pid, _split(item, ITEM_FIELDS)) for pid, item in order.get("items", {}).items())],
+        )
+
+    def add_order(self, order):
+        with self.transaction() as conn:
+            self._write_order(conn, order)
+            self._apply_rollups(conn, rollups.order_delta(None, order))
+
+    def save_order(self, order):
+        with self.transaction() as conn:
+            old = self.get_order(order["order_id"])
+            self._write_order(conn, order)
+            self._apply_rollups(conn, rollups.order_delta(old, order))
+
+    def find_orders(self, phone=None, status=None):
+        filters = {k: v for k, v in (("phone", phone), ("status", status)) if v is not None}
+        return self._read_orders(**filters)
+
+    def count_orders_by_status(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM orders GROUP BY status")
+        return dict(rows.fetchall())
+
+    def page_orders(self, status=None, date_from=None, date_to=None, q=None, cursor=None, limit=50):
+        """Keyset pagination on rowid (placement order); the cursor is the last rowid returned."""
+        clauses, params = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if date_from:
+            clauses.append("created_at >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("created_at < ?")
+            params.append((date.fromisoformat(date_to) + timedelta(days=1)).isoformat())
+        if q:
+            pattern = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            clauses.append("(order_id LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\' OR phone LIKE ? ESCAPE '\\')")
+            params += [pattern] * 3
+        if cursor is not None:
+            clauses.append("rowid < ?")
+            params.append(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT rowid, order_id FROM orders {where} ORDER BY rowid DESC LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        ids = [order_id for _, order_id in rows[:limit]]
+        by_id = {o["order_id"]: o for o in self._read_orders(ids=ids)}
+        return [by_id[i] for i in ids], next_cursor
+
+    # ---------- rollups ----------
+    @staticmethod
+    def _apply_rollups(conn, delta):
+        conn.executemany(
+            "INSERT INTO rollups (kind, key, revenue, cost, orders, qty) VALUES (?, ?, round(?, 2), round(?, 2), ?, ?) "
+            "ON CONFLICT(kind, key) DO UPDATE SET revenue=round(revenue + excluded.revenue, 2), "
+            "cost=round(cost + excluded.cost, 2), orders=orders + excluded.orders, qty=qty + excluded.qty",
+            [(kind, key, *(row[f] for f in rollups.FIELDS)) for (kind, key), row in delta.items()],
+        )
+        conn.execute("DELETE FROM rollups WHERE orders = 0")
+
+    def get_rollups(self):
+        store = rollups.empty()
+        for kind, key, *values in self._conn().execute(
+            "SELECT kind, key, revenue, cost, orders, qty FROM rollups"
+        ):
+            store.setdefault(kind, {})[key] = dict(zip(rollups.FIELDS, values))
+        return store
+
+    def rebuild_rollups(self):
+        with self.transaction() as conn:
+            store = rollup_store(OrderColumns(self.load_orders()))
+            conn.execute("DELETE FROM rollups")
+            self._apply_rollups(conn, {(kind, key): row for kind, rows in store.items() for key, row in rows.items()})
+        return store
+
+    # ---------- stock holds ----------
+    def hold(self, cart_id, pid, qty, ttl):
+        return self.hold_many(cart_id, {pid: qty}, ttl)
+
+    def hold_many(self, cart_id, quantities, ttl):
+        now = time.time()
+        expires_at = now + ttl
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM stock_holds WHERE cart_id = ? AND expires_at <= ?", (cart_id, now))
+            conn.executemany(
+                "INSERT OR REPLACE INTO stock_holds (cart_id, product_id, quantity, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(cart_id, pid, qty, expires_at) for pid, qty in quantities.items() if qty > 0],
+            )
+            conn.executemany(
+                "DELETE FROM stock_holds WHERE cart_id = ? AND product_id = ?",
+                [(cart_id, pid) for pid, qty in quantities.items() if qty <= 0],
+            )
+            conn.execute("UPDATE stock_holds SET expires_at = ? WHERE cart_id = ?", (expires_at, cart_id))
+        return expires_at
+
+    def cart_holds(self, cart_id):
+        rows = self._conn().execute(
+            "SELECT product_id, quantity FROM stock_holds WHERE cart_id = ? AND expires_at > ?",
+            (cart_id, time.time()),
+        )
+        return dict(rows.fetchall())
+
+    def reserved_qty(self, pids, exclude_cart=None):
+        params = tuple(str(p) for p in pids)
+        if not params:
+            return {}
+        rows = self._conn().execute(
+            f"SELECT product_id, SUM(quantity) FROM stock_holds "
+            f"WHERE product_id IN ({','.join('?' * len(params))}) AND expires_at > ? AND cart_id IS NOT ? "
+            f"GROUP BY product_id",
+            (*params, time.time(), exclude_cart),
+        )
+        return dict(rows.fetchall())
+
+    def release_holds(self, cart_id):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM stock_holds WHERE cart_id = ?", (cart_id,))
+
+    def expire_holds(self):
+        with self.transaction() as conn:
+            before = conn.execute("SELECT COUNT(DISTINCT cart_id) FROM stock_holds").fetchone()[0]
+            conn.execute("DELETE FROM stock_holds WHERE expires_at <= ?", (time.time(),))
+            after = conn.execute("SELECT COUNT(DISTINCT cart_id) FROM stock_holds").fetchone()[0]
+        return before - after
+
+
+def backfill_batch_ids(target):
+    """Give every stored batch without one a batch_id; returns how many were added.
+
+    Batches written before ids existed (or added to products.json by hand)
+    get theirs here, so the admin pages can address a batch by id.
+    """
+    def missing(products):
+        return {pid: p for pid, p in products.items() if any(not b.get("batch_id") for b in p.get("batches", []))}
+
+    if not missing(target.load_products()):
+        return 0
+    added = 0
+    with target.transaction():
+        changed = missing(target.load_products())  # again under the lock: another worker may have done it
+        for product in changed.values():
+            for batch in product["batches"]:
+                if not batch.get("batch_id"):
+                    ensure_batch_id(product, batch)
+                    added += 1
+        if changed:
+            target.save_products(changed)
+    return added
+
+
+def import_json(target, products, orders):
+    """One-shot copy of products.json / orders.json data into ``target``."""
+    with target.transaction():
+        for pid, product in products.items():
+            target.save_product(str(pid), product)
+        for order in orders:
+            target.save_order(order)
+    return len(products), len(orders)
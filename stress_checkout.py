@@ -0,0 +1,177 @@
+"""Fire hundreds of parallel checkouts at the app and verify nothing was lost.
+
+Several worker processes (standing in for gunicorn workers), each running a
+pool of threads, post /checkout through the Flask test client against a
+scratch copy of the data.  Afterwards every accepted order must be stored
+exactly once, every product's stock must have dropped by exactly the
+quantity those orders consumed, without any batch going negative, and the
+rollups must match a rebuild over the stored orders.
+
+    python stress_checkout.py --processes 4 --threads 8 --orders 400
+    python stress_checkout.py --backend sqlite
+    python stress_checkout.py --holds   # reserve via /add_to_cart before checking out
+
+Besides one checkout per client IP, ``--same-ip`` checkouts come from a
+single IP at the same moment; the one-order-per-hour limit must let at
+most one of them through.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ORDER_ID_RE = re.compile(r"<strong>(ORD[A-Z0-9]+)</strong>")
+SAME_IP = "10.255.255.255"
+
+
+def seed_data(data_dir, n_products, stock):
+    products = {}
+    for i in range(1, n_products + 1):
+        products[str(i)] = {
+            "name": f"Stress product {i}",
+            "image": None,
+            "batches": [
+                {"price": 10, "purchase_price": 6, "quantity": stock // 2, "expiry_date": "2031-01-01"},
+                {"price": 10, "purchase_price": 5, "quantity": stock - stock // 2, "expiry_date": "2030-01-01"},
+            ],
+        }
+    for name, data in (("products.json", products), ("orders.json", [])):
+        with open(os.path.join(data_dir, name), "w", encoding="utf-8") as f:
+            json.dump(data, f)
+    shutil.copy(os.path.join(HERE, "pharmacy.json"), data_dir)
+    return products
+
+
+def make_jobs(n_orders, n_products, seed, same_ip=0):
+    """(ip, cart) pairs: the ``same_ip`` checkouts from SAME_IP first, then one per IP."""
+    rng = random.Random(seed)
+    jobs = []
+    for i in range(same_ip + n_orders):
+        pids = rng.sample(range(1, n_products + 1), rng.randint(1, min(3, n_products)))
+        cart = {str(pid): {"name": f"Stress product {pid}", "price": 10, "qty": rng.randint(1, 3)} for pid in pids}
+        ip = SAME_IP if i < same_ip else f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+        jobs.append((ip, cart))
+    return jobs
+
+
+def run_worker(jobs, threads, holds=False):
+    """Post the given checkouts from one process; return the accepted ones."""
+    sys.path.insert(0, HERE)
+    import app as pharmacy_app
+
+    def place(job):
+        ip, cart = job
+        client = pharmacy_app.app.test_client()
+        if holds:
+            for pid, item in cart.items():
+                resp = client.get(f"/add_to_cart/{pid}?qty={item['qty']}", headers={"X-Forwarded-For": ip})
+                if resp.get_json()["status"] != "success":
+                    return None
+        resp = client.post(
+            "/checkout",
+            data={"cart": json.dumps(cart), "name": "Stress", "phone": "01000000000"},
+            headers={"X-Forwarded-For": ip},
+        )
+        if resp.status_code != 200:
+            raise RuntimeError(f"checkout returned HTTP {resp.status_code}")
+        match = ORDER_ID_RE.search(resp.get_data(as_text=True))
+        return (match.group(1), ip, cart) if match else None
+
+    with ThreadPoolExecutor(threads) as pool:
+        return [r for r in pool.map(place, jobs) if r]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--orders", type=int, default=400)
+    parser.add_argument("--products", type=int, default=5)
+    parser.add_argument("--stock", type=int, default=200, help="initial units per product")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--holds", action="store_true", help="hold stock with /add_to_cart first")
+    parser.add_argument("--same-ip", type=int, default=8, help="extra simultaneous checkouts from one IP")
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="pharmacy-stress-")
+    initial = seed_data(data_dir, args.products, args.stock)
+    os.environ["PHARMACY_DATA_DIR"] = data_dir
+    os.environ["PHARMACY_STORAGE"] = args.backend
+    sys.path.insert(0, HERE)
+    import app as pharmacy_app
+    import rollups
+
+    if args.backend == "sqlite":
+        pharmacy_app.import_json(pharmacy_app.storage, initial, [])
+
+    jobs = make_jobs(args.orders, args.products, args.seed, args.same_ip)
+    chunks = [jobs[i::args.processes] for i in range(args.processes)]
+    with multiprocessing.get_context("spawn").Pool(args.processes) as pool:
+        accepted = [r for part in pool.starmap(run_worker, [(c, args.threads, args.holds) for c in chunks]) for r in part]
+
+    storage = pharmacy_app.make_storage(args.backend)
+    pharmacy_app.invalidate_data_cache()
+    orders = storage.load_orders()
+    products = storage.load_products()
+
+    errors = []
+    stored_ids = Counter(o["order_id"] for o in orders)
+    accepted_ids = {order_id for order_id, _, _ in accepted}
+    if set(stored_ids) != accepted_ids:
+        errors.append(f"{len(accepted_ids - set(stored_ids))} accepted orders missing, "
+                      f"{len(set(stored_ids) - accepted_ids)} unexpected orders stored")
+    duplicates = [oid for oid, n in stored_ids.items() if n > 1]
+    if duplicates:
+        errors.append(f"{len(duplicates)} order ids stored more than once")
+
+    consumed = Counter()
+    for _, _, cart in accepted:
+        for pid, item in cart.items():
+            consumed[pid] += item["qty"]
+    for pid, product in initial.items():
+        before = sum(b["quantity"] for b in product["batches"])
+        batches = products[pid]["batches"]
+        after = sum(int(b["quantity"]) for b in batches)
+        if before - after != consumed[pid]:
+            errors.append(f"product {pid}: stock dropped by {before - after}, orders consumed {consumed[pid]}")
+        if any(int(b["quantity"]) < 0 for b in batches):
+            errors.append(f"product {pid}: negative batch quantity")
+
+    if storage.get_rollups() != rollups.build(orders):
+        errors.append("rollups differ from a rebuild over the stored orders")
+
+    same_ip_orders = sum(1 for _, ip, _ in accepted if ip == SAME_IP)
+    if same_ip_orders > 1:
+        errors.append(f"{same_ip_orders} orders accepted from one IP within the hourly limit")
+    accepted_ips = {ip for _, ip, _ in accepted}
+    missing_ips = [ip for ip in accepted_ips if pharmacy_app.rate_limiter.check("checkout", ip)[0]]
+    if missing_ips:
+        errors.append(f"{len(missing_ips)} checkout rate-limit tokens not used up")
+    kept = [ip for ip, _ in jobs if ip not in accepted_ips and not pharmacy_app.rate_limiter.check("checkout", ip)[0]]
+    if kept:
+        errors.append(f"{len(kept)} rejected checkouts kept their rate-limit token")
+
+    print(f"{len(jobs)} checkouts from {args.processes}x{args.threads} workers ({args.backend}): "
+          f"{len(accepted)} accepted, {len(jobs) - len(accepted)} rejected for stock or the rate limit "
+          f"({same_ip_orders} of {args.same_ip} from one IP)")
+    for e in errors:
+        print("FAIL:", e)
+    if not errors:
+        print("OK: no lost orders or stock decrements")
+        shutil.rmtree(data_dir, ignore_errors=True)
+    else:
+        print("data left in", data_dir)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())